@@ -0,0 +1,654 @@
+# --- address_state.py (Persistent per-address feature summaries, extended with new transactions only) ---
+#
+# A summary holds mergeable accumulators for the 56 base features of an address's
+# confirmed history: transaction counts, and one sorted multiset per value family
+# (amounts, fees, fee shares, blocks, block gaps, counterparty counts) stored as
+# (value, count) rows next to its size, exact total and a median cursor. Folding
+# in a transaction touches a few rows per family and the features are read back
+# with index lookups, so rescoring a known address costs about the same at a
+# hundred transactions as at a million.
+
+import copy
+import hashlib
+import json
+import logging
+import time
+from collections import Counter, namedtuple
+from fractions import Fraction
+from functools import partial
+
+import numpy as np
+
+from counterparty_graph import Edges, edge_arrays, edges_from_columns
+from feature_engine import (
+    EXPECTED_FEATURES, SATOSHI_TO_BTC, TxColumns, concat_columns, features_from_columns, flatten_transactions
+)
+from result_cache import transaction_fingerprint
+from storage import LocalConnection, select_in
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS address_summary (
+    address     TEXT PRIMARY KEY,
+    n_tx        INTEGER NOT NULL,
+    last_block  INTEGER NOT NULL,
+    last_hashes TEXT NOT NULL,
+    summary     TEXT NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summary_values (
+    address TEXT NOT NULL,
+    name    TEXT NOT NULL,
+    value   REAL NOT NULL,
+    count   INTEGER NOT NULL,
+    PRIMARY KEY (address, name, value)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS summary_counterparties (
+    address      TEXT NOT NULL,
+    counterparty TEXT NOT NULL,
+    count        INTEGER NOT NULL,
+    value        INTEGER NOT NULL,
+    PRIMARY KEY (address, counterparty)
+) WITHOUT ROWID;
+"""
+
+# Multisets whose min/max/mean/median/total are features, with the divisor of their values
+STAT_SETS = {
+    'values': SATOSHI_TO_BTC, 'sent': SATOSHI_TO_BTC, 'received': SATOSHI_TO_BTC, 'fees': SATOSHI_TO_BTC,
+    'shares': 1, 'block_gaps': 1, 'sent_gaps': 1, 'received_gaps': 1, 'cp_counts': 1,
+}
+# Multisets only looked up by value (membership, neighbours, min/max)
+PLAIN_SETS = ('blocks', 'sent_blocks', 'received_blocks', 'share_first', 'share_candidates')
+# Block multiset -> the multiset of gaps between its consecutive elements
+GAP_SETS = {'blocks': 'block_gaps', 'sent_blocks': 'sent_gaps', 'received_blocks': 'received_gaps'}
+
+# The features of a streamed history, and what the counterparty graph needs to store its row
+StreamScore = namedtuple('StreamScore', ['features', 'fingerprint', 'load_edges'])
+# The address_summary row: confirmed transactions held, watermark, accumulator header
+SummaryHeader = namedtuple('SummaryHeader', ['n_tx', 'last_block', 'last_hashes', 'state'])
+
+
+class InconsistentSummary(Exception):
+    """The stored rows don't agree with the summary header; the summary must be rebuilt."""
+
+
+def hash_set_digest(hashes):
+    """Order-independent identity of a set of transaction hashes: count plus a sum of 64-bit hashes."""
+    total = 0
+    for h in hashes:
+        total += int.from_bytes(hashlib.blake2b((h or '').encode('utf-8'), digest_size=8).digest(), 'little')
+    return f"{len(hashes)}:{total & 0xFFFFFFFFFFFFFFFF:016x}"
+
+
+class Multiset:
+    """One sorted multiset of a summary: (value, count) rows plus size, exact total and a median cursor.
+
+    `state` is its part of the summary header. The cursor is the element at rank
+    (n - 1) // 2, as [value, copy index]; inserts and removals move it by as many
+    elements as they add or take away, so the median never reads the whole set.
+    Plain multisets (`median=False`) skip the cursor.
+    """
+
+    def __init__(self, conn, address, name, state, scale=1, median=True):
+        self.conn = conn
+        self.address = address
+        self.name = name
+        self.state = state
+        self.scale = scale
+        self.median_cursor = median
+
+    @staticmethod
+    def new_state():
+        return {'n': 0, 'distinct': 0, 'total': '0', 'at': None}
+
+    def __len__(self):
+        return self.state['n']
+
+    def count(self, value):
+        row = self.conn.execute(
+            'SELECT count FROM summary_values WHERE address = ? AND name = ? AND value = ?',
+            (self.address, self.name, float(value))
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _scan(self, above, value=None, limit=1):
+        """(value, count) rows after (`above`) or before `value` (None: from the end), nearest first."""
+        if value is None:
+            where, params = '', ()
+        else:
+            where, params = f" AND value {'>' if above else '<'} ?", (float(value),)
+        return self.conn.execute(
+            f"SELECT value, count FROM summary_values WHERE address = ? AND name = ?{where} "
+            f"ORDER BY value {'ASC' if above else 'DESC'} LIMIT ?",
+            (self.address, self.name, *params, limit)
+        ).fetchall()
+
+    def before(self, value):
+        """The nearest (value, count) below `value`, or None."""
+        rows = self._scan(False, value)
+        return rows[0] if rows else None
+
+    def after(self, value):
+        """The nearest (value, count) above `value`, or None."""
+        rows = self._scan(True, value)
+        return rows[0] if rows else None
+
+    def first(self):
+        rows = self._scan(True)
+        return rows[0][0] if rows else None
+
+    def last(self):
+        rows = self._scan(False)
+        return rows[0][0] if rows else None
+
+    def _change(self, value, k, old):
+        if old + k:
+            if old:
+                self.conn.execute('UPDATE summary_values SET count = ? WHERE address = ? AND name = ? AND value = ?',
+                                  (old + k, self.address, self.name, value))
+            else:
+                self.conn.execute('INSERT INTO summary_values (address, name, value, count) VALUES (?, ?, ?, ?)',
+                                  (self.address, self.name, value, k))
+                self.state['distinct'] += 1
+        else:
+            self.conn.execute('DELETE FROM summary_values WHERE address = ? AND name = ? AND value = ?',
+                              (self.address, self.name, value))
+            self.state['distinct'] -= 1
+        self.state['n'] += k
+        self.state['total'] = str(Fraction(self.state['total']) + Fraction(value) * k)
+
+    def add(self, value, k=1):
+        """Insert `k` copies of `value`; returns how many were there before."""
+        return self.add_many([value], [k])[0]
+
+    def add_many(self, values, counts=None):
+        """Insert `values` (with `counts` copies each, if given); returns each distinct value's previous count."""
+        if counts is None:
+            values, counts = np.unique(np.asarray(values, dtype=np.float64), return_counts=True)
+        at = self.state['at']
+        rank = (self.state['n'] - 1) // 2
+        previous = []
+        for value, k in zip([float(v) for v in values], [int(k) for k in counts]):
+            old = self.count(value)
+            self._change(value, k, old)
+            previous.append(old)
+            if at is not None and value < at[0]:
+                rank += k
+        if self.median_cursor and previous:
+            if at is None:
+                self.state['at'] = [float(min(values)), 0]
+                rank = 0
+            self._move(rank)
+        return previous
+
+    def remove(self, value, k=1):
+        """Take `k` copies of `value` out."""
+        value = float(value)
+        old = self.count(value)
+        if old < k:
+            raise InconsistentSummary(f"{self.name}: removing {k} x {value}, {old} stored")
+        self._change(value, -k, old)
+        if not self.median_cursor:
+            return
+        if not self.state['n']:
+            self.state['at'] = None
+            return
+        rank = (self.state['n'] + k - 1) // 2
+        at_value, index = self.state['at']
+        left = old - k
+        if value < at_value:
+            rank -= k
+        elif value == at_value and index >= left:
+            # Copies go from the top: if the cursor's went, re-anchor on the nearest element left
+            if left:
+                self.state['at'] = [value, left - 1]
+                rank -= index - (left - 1)
+            else:
+                below = self.before(value)
+                if below is not None:
+                    self.state['at'] = [below[0], below[1] - 1]
+                    rank -= index + 1
+                else:
+                    self.state['at'] = [self.after(value)[0], 0]
+                    rank -= index
+        self._move(rank)
+
+    def _move(self, rank):
+        """Move the cursor from the element at `rank` to the lower median."""
+        steps = (self.state['n'] - 1) // 2 - rank
+        if not steps:
+            return
+        value, index = self.state['at']
+        if steps > 0:
+            here = self.count(value)
+            if index + steps < here:
+                self.state['at'] = [value, index + steps]
+                return
+            steps -= here - index  # 0: the first copy of the next value
+            for value, count in self._scan(True, value, steps + 1):
+                if steps < count:
+                    self.state['at'] = [value, steps]
+                    return
+                steps -= count
+        else:
+            steps = -steps
+            if steps <= index:
+                self.state['at'] = [value, index - steps]
+                return
+            steps -= index + 1  # 0: the last copy of the previous value
+            for value, count in self._scan(False, value, steps + 1):
+                if steps < count:
+                    self.state['at'] = [value, count - 1 - steps]
+                    return
+                steps -= count
+        raise InconsistentSummary(f"{self.name}: median cursor ran past the stored values")
+
+    def load(self, values):
+        """Fill an empty multiset from an array in one pass (new summaries)."""
+        values, counts = np.unique(np.asarray(values, dtype=np.float64), return_counts=True)
+        if not len(values):
+            return
+        self.conn.executemany(
+            'INSERT INTO summary_values (address, name, value, count) VALUES (?, ?, ?, ?)',
+            ((self.address, self.name, value, k) for value, k in zip(values.tolist(), counts.tolist()))
+        )
+        n = int(counts.sum())
+        if np.all(values == np.rint(values)):
+            total = Fraction(sum(int(value) * k for value, k in zip(values.tolist(), counts.tolist())))
+        else:
+            total = sum((Fraction(value) * k for value, k in zip(values.tolist(), counts.tolist())), Fraction(0))
+        self.state.update(n=n, distinct=len(values), total=str(total))
+        if self.median_cursor:
+            rank = (n - 1) // 2
+            ends = np.cumsum(counts)
+            i = int(np.searchsorted(ends, rank, side='right'))
+            self.state['at'] = [float(values[i]), rank - (int(ends[i - 1]) if i else 0)]
+
+    def median(self):
+        value, index = self.state['at']
+        if self.state['n'] % 2:
+            return value / self.scale
+        upper = value if index + 1 < self.count(value) else self.after(value)[0]
+        # np.median averages the two middle elements of the scaled array
+        return (value / self.scale + upper / self.scale) / 2
+
+    def stats(self):
+        """min/max/mean/median/total like feature_engine.array_stats, totals and means exact."""
+        n = self.state['n']
+        if not n:
+            return {'min': 0.0, 'max': 0.0, 'mean': 0.0, 'median': 0.0, 'total': 0.0}
+        total = Fraction(self.state['total'])
+        return {
+            'min': self.first() / self.scale,
+            'max': self.last() / self.scale,
+            'mean': float(total / (self.scale * n)),
+            'median': self.median(),
+            'total': float(total / self.scale),
+        }
+
+
+class Summary:
+    """The accumulators of one address, on a connection and inside the caller's transaction.
+
+    `state` is the JSON header (transaction counts and each multiset's state); the
+    multisets' rows and the per-counterparty counts live in their own tables.
+    """
+
+    def __init__(self, conn, address, state=None):
+        self.conn = conn
+        self.address = address
+        self.state = state or {
+            'n_tx': 0, 'n_sender': 0, 'n_receiver': 0,
+            'sets': {name: Multiset.new_state() for name in (*STAT_SETS, *PLAIN_SETS)},
+        }
+        self.sets = {name: Multiset(conn, address, name, self.state['sets'][name], scale)
+                     for name, scale in STAT_SETS.items()}
+        self.sets.update({name: Multiset(conn, address, name, self.state['sets'][name], median=False)
+                          for name in PLAIN_SETS})
+
+    @staticmethod
+    def _families(columns):
+        """The per-transaction arrays each accumulator is fed from."""
+        sent, received, fees, blocks = columns.sent, columns.received, columns.fees, columns.blocks
+        is_sender, is_receiver = sent > 0, received > 0
+        confirmed = blocks > 0
+        sent_mask = is_sender & (fees > 0)
+        total_value = sent + received
+        involved = (fees > 0) & (total_value > 0)
+        return {
+            'is_sender': is_sender, 'is_receiver': is_receiver,
+            'values': np.concatenate([sent[is_sender], received[is_receiver]]),
+            'sent': sent[is_sender], 'received': received[is_receiver], 'fees': fees,
+            # Same expressions as feature_engine._fee_shares, so equal shares compare equal
+            'share_first': fees[sent_mask] / sent[sent_mask] * 100,
+            'share_candidates': fees[involved] / total_value[involved] * 100,
+            'blocks': np.sort(blocks[confirmed]),
+            'sent_blocks': np.sort(blocks[confirmed & is_sender]),
+            'received_blocks': np.sort(blocks[confirmed & is_receiver]),
+        }
+
+    def _count_transactions(self, columns, families):
+        self.state['n_tx'] += len(columns)
+        self.state['n_sender'] += int(families['is_sender'].sum())
+        self.state['n_receiver'] += int(families['is_receiver'].sum())
+
+    def build(self, columns):
+        """Fill a new summary from a whole history at once."""
+        families = self._families(columns)
+        self._count_transactions(columns, families)
+        for name in ('values', 'sent', 'received', 'fees', 'share_first', 'share_candidates', *GAP_SETS):
+            self.sets[name].load(families[name])
+        for name, gaps in GAP_SETS.items():
+            self.sets[gaps].load(np.diff(families[name]))
+        first, candidates = families['share_first'], families['share_candidates']
+        self.sets['shares'].load(np.concatenate([first, np.unique(candidates[~np.isin(candidates, first)])]))
+
+        counts, values = edge_arrays(columns)
+        present = np.flatnonzero(counts > 0)
+        self.conn.executemany(
+            'INSERT INTO summary_counterparties (address, counterparty, count, value) VALUES (?, ?, ?, ?)',
+            ((self.address, columns.cp_addresses[i], int(counts[i]), int(values[i])) for i in present.tolist())
+        )
+        self.sets['cp_counts'].load(counts[present])
+
+    def fold(self, columns):
+        """Add transactions to the summary, touching only the rows their values land on."""
+        if not len(columns):
+            return
+        families = self._families(columns)
+        self._count_transactions(columns, families)
+        for name in ('values', 'sent', 'received', 'fees'):
+            self.sets[name].add_many(families[name])
+        self._fold_shares(families['share_first'], families['share_candidates'])
+        for name, gaps in GAP_SETS.items():
+            self._fold_blocks(self.sets[name], self.sets[gaps], families[name])
+        self._fold_counterparties(columns)
+
+    def _fold_shares(self, first, candidates):
+        # The fee shares are every sent share plus each distinct other share not among them
+        shares, firsts, seen = self.sets['shares'], self.sets['share_first'], self.sets['share_candidates']
+        first_values, first_counts = np.unique(first, return_counts=True)
+        for value, old in zip(first_values.tolist(), firsts.add_many(first_values, first_counts)):
+            if not old and seen.count(value):
+                # Counted once as another transaction's share until now
+                shares.remove(value)
+        shares.add_many(first)
+        values, counts = np.unique(candidates, return_counts=True)
+        shares.add_many([value for value, old in zip(values.tolist(), seen.add_many(values, counts))
+                         if not old and not firsts.count(value)])
+
+    @staticmethod
+    def _fold_blocks(blocks, gaps, new_blocks):
+        for block in new_blocks.tolist():
+            if blocks.add(block):
+                gaps.add(0)
+                continue
+            below, above = blocks.before(block), blocks.after(block)
+            if below is not None and above is not None:
+                gaps.remove(above[0] - below[0])
+            if below is not None:
+                gaps.add(block - below[0])
+            if above is not None:
+                gaps.add(above[0] - block)
+
+    def _fold_counterparties(self, columns):
+        counts, values = edge_arrays(columns)
+        present = np.flatnonzero(counts > 0)
+        names = [columns.cp_addresses[i] for i in present.tolist()]
+        stored = dict(select_in(
+            self.conn,
+            'SELECT counterparty, count FROM summary_counterparties WHERE address = ? AND counterparty IN ({placeholders})',
+            names, params=(self.address,)
+        ))
+        self.conn.executemany(
+            'INSERT INTO summary_counterparties (address, counterparty, count, value) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(address, counterparty) DO UPDATE SET count = count + excluded.count, '
+            'value = value + excluded.value',
+            ((self.address, name, int(counts[i]), int(values[i])) for name, i in zip(names, present.tolist()))
+        )
+        cp_counts = self.sets['cp_counts']
+        for old, k in Counter(stored.values()).items():
+            cp_counts.remove(old, k)
+        cp_counts.add_many([stored.get(name, 0) + int(counts[i]) for name, i in zip(names, present.tolist())])
+
+    def features(self):
+        """The 56 base features of everything folded in."""
+        sets, state = self.sets, self.state
+        blocks = sets['blocks']
+        first_block, last_block = blocks.first(), blocks.last()
+        first_sent, first_received = sets['sent_blocks'].first(), sets['received_blocks'].first()
+        cp_counts = sets['cp_counts']
+        unique_blocks = float(blocks.state['distinct'])
+        features = {
+            'num_txs_as_sender': float(state['n_sender']),
+            'num_txs_as receiver': float(state['n_receiver']),
+            'total_txs': float(state['n_tx']),
+            'first_block_appeared_in': first_block or 0.0,
+            'last_block_appeared_in': last_block or 0.0,
+            'lifetime_in_blocks': last_block - first_block if len(blocks) > 1 else 0.0,
+            'first_sent_block': first_sent or 0.0,
+            'first_received_block': first_received or 0.0,
+            'num_timesteps_appeared_in': unique_blocks,
+            **{f'btc_transacted_{k}': v for k, v in sets['values'].stats().items()},
+            **{f'btc_sent_{k}': v for k, v in sets['sent'].stats().items()},
+            **{f'btc_received_{k}': v for k, v in sets['received'].stats().items()},
+            **{f'fees_{k}': v for k, v in sets['fees'].stats().items()},
+            **{f'fees_as_share_{k}': v for k, v in sets['shares'].stats().items()},
+            **{f'blocks_btwn_txs_{k}': v for k, v in sets['block_gaps'].stats().items()},
+            **{f'blocks_btwn_input_txs_{k}': v for k, v in sets['sent_gaps'].stats().items()},
+            **{f'blocks_btwn_output_txs_{k}': v for k, v in sets['received_gaps'].stats().items()},
+            'num_addr_transacted_multiple': float(len(cp_counts) - cp_counts.count(1)),
+            **{f'transacted_w_address_{k}': v for k, v in cp_counts.stats().items()},
+            'Time step': unique_blocks,
+        }
+        for feature in EXPECTED_FEATURES:
+            features.setdefault(feature, 0.0)
+        return features
+
+
+def score_columns(columns):
+    """The StreamScore of transactions held in full, straight from their columns."""
+    if not len(columns):
+        return StreamScore(None, None, None)
+    return StreamScore(features_from_columns(columns), transaction_fingerprint(columns),
+                       partial(edges_from_columns, columns))
+
+
+def read_new(transactions, target_address, last_block=0, last_hashes=()):
+    """Read a newest-first stream until it reaches history at or below the watermark.
+
+    Returns (the new confirmed transactions, the unconfirmed ones seen on the way),
+    both as TxColumns.
+    """
+    pending = []
+
+    def new_confirmed():
+        for tx in transactions:
+            block = tx.get('block_height') or 0
+            if not block:
+                pending.append(tx)
+            elif block > last_block or (block == last_block and tx.get('hash') not in last_hashes):
+                yield tx
+            elif block < last_block:
+                return
+
+    new = flatten_transactions(new_confirmed(), target_address)
+    return new, flatten_transactions(pending, target_address)
+
+
+def _newer_rows(columns, last_block, last_hashes):
+    """Row indexes of a TxColumns above the watermark."""
+    new = columns.blocks > last_block
+    for i in np.flatnonzero(columns.blocks == last_block).tolist():
+        new[i] = columns.hashes[i] not in last_hashes
+    return np.flatnonzero(new)
+
+
+def _take_rows(columns, rows):
+    """Sub-select rows of a TxColumns, keeping only the counterparties those rows use."""
+    if len(rows) == len(columns):
+        return columns
+    starts, ends = columns.cp_offsets[rows], columns.cp_offsets[rows + 1]
+    cp_ids = np.concatenate([columns.cp_ids[s:e] for s, e in zip(starts, ends)]) if len(rows) else columns.cp_ids[:0]
+    used, cp_ids = np.unique(cp_ids, return_inverse=True)
+    return TxColumns(
+        target_address=columns.target_address,
+        hashes=[columns.hashes[i] for i in rows],
+        times=columns.times[rows], blocks=columns.blocks[rows], fees=columns.fees[rows],
+        sent=columns.sent[rows], received=columns.received[rows],
+        cp_offsets=np.concatenate([[0], np.cumsum(ends - starts)]).astype(np.int64),
+        cp_ids=cp_ids.astype(np.int32),
+        cp_addresses=[columns.cp_addresses[i] for i in used.tolist()],
+    )
+
+
+class AddressStateStore:
+    """SQLite-backed feature summaries of addresses scored from their full history.
+
+    Used by the streaming path only: the default single-page path scores the page
+    it has and never reads or writes a summary.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = LocalConnection(path, SCHEMA, self._upgrade_schema)
+
+    @staticmethod
+    def _upgrade_schema(conn):
+        # Stores from before the summaries kept whole column snapshots per address;
+        # those addresses are read in full once more instead
+        conn.execute('DROP TABLE IF EXISTS address_state')
+
+    @staticmethod
+    def _header(conn, address):
+        row = conn.execute('SELECT n_tx, last_block, last_hashes, summary FROM address_summary WHERE address = ?',
+                           (address,)).fetchone()
+        if row is None:
+            return None
+        n_tx, last_block, last_hashes, state = row
+        return SummaryHeader(n_tx, last_block, set(last_hashes.split('\n')) if last_hashes else set(),
+                             json.loads(state))
+
+    def header(self, address):
+        """The stored SummaryHeader of `address`, or None."""
+        return self._header(self._conn(), address)
+
+    def delete(self, address):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for table in ('address_summary', 'summary_values', 'summary_counterparties'):
+                conn.execute(f'DELETE FROM {table} WHERE address = ?', (address,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def edges(self, address, pending=None):
+        """The counterparty Edges of the stored history, plus those of `pending` (a TxColumns) if given."""
+        merged = {cp: [count, value] for cp, count, value in self._conn().execute(
+            'SELECT counterparty, count, value FROM summary_counterparties WHERE address = ?', (address,)
+        )}
+        if pending is not None and len(pending):
+            counts, values = edge_arrays(pending)
+            for i in np.flatnonzero(counts > 0).tolist():
+                entry = merged.setdefault(pending.cp_addresses[i], [0, 0])
+                entry[0] += int(counts[i])
+                entry[1] += int(values[i])
+        return Edges(list(merged), np.array([c for c, _ in merged.values()], dtype=np.int64),
+                     np.array([v for _, v in merged.values()], dtype=np.int64))
+
+    def update_from_stream(self, address, history):
+        """Base features of a paginated newest-first AddressHistory, keeping the summary in step.
+
+        Paging stops once the stream reaches transactions already summarized, so a
+        known address only downloads and folds in its new pages; unconfirmed
+        transactions are folded into a throwaway copy for scoring. The result covers
+        exactly what is reported for the address: the summarized history plus the
+        new pages, checked against the `n_tx` the API reports, or only the
+        transactions read when the history was cut short by the transaction cap or
+        time budget (nothing is persisted then). Returns a StreamScore (features None
+        when there are no transactions), or None if the stored summary doesn't add
+        up to the reported history; the caller then deletes it and reads the
+        history again.
+        """
+        known = self.header(address)
+        if known is None:
+            new, pending = read_new(history, address)
+        else:
+            new, pending = read_new(history, address, known.last_block, known.last_hashes)
+
+        if history.truncated or (known is None and not len(new)):
+            return score_columns(concat_columns(new, pending))
+
+        conn = self._conn()
+        # Only a read when nothing is folded in: the snapshot just has to be consistent
+        conn.execute('BEGIN IMMEDIATE' if len(new) or len(pending) else 'BEGIN')
+        try:
+            # Another worker may have changed the summary while the pages were read
+            stored = self._header(conn, address)
+            if stored is not None:
+                new = _take_rows(new, _newer_rows(new, stored.last_block, stored.last_hashes))
+            n_stored = stored.n_tx if stored is not None else 0
+            if history.n_tx is not None and n_stored + len(new) + len(pending) != history.n_tx:
+                logger.info("[STATE] %s: %d stored + %d new + %d unconfirmed transactions, but %d reported",
+                            address, n_stored, len(new), len(pending), history.n_tx)
+                conn.execute('ROLLBACK')
+                return None
+            if stored is None:
+                score = self._create(conn, address, new, pending)
+            else:
+                score = self._extend(conn, address, stored, new, pending)
+            conn.execute('COMMIT')
+        except InconsistentSummary as e:
+            conn.execute('ROLLBACK')
+            logger.warning("[STATE] %s: %s", address, e)
+            return None
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return score
+
+    def _create(self, conn, address, new, pending):
+        """A first summary from the whole confirmed history, scored straight from the columns in hand."""
+        summary = Summary(conn, address)
+        summary.build(new)
+        self._save(conn, address, summary, new)
+        logger.debug("[STATE] %s: summarized %d transactions", address, len(new))
+        return score_columns(concat_columns(new, pending))
+
+    def _extend(self, conn, address, stored, new, pending):
+        summary = Summary(conn, address, stored.state)
+        summary.fold(new)
+        if len(new):
+            self._save(conn, address, summary, new, stored)
+            logger.debug("[STATE] %s: folded %d new transactions (%d total)", address, len(new), summary.state['n_tx'])
+        if len(pending):
+            conn.execute('SAVEPOINT pending')
+            scratch = Summary(conn, address, copy.deepcopy(summary.state))
+            scratch.fold(pending)
+            features = scratch.features()
+            conn.execute('ROLLBACK TO pending')
+            conn.execute('RELEASE pending')
+        else:
+            features = summary.features()
+        last_block = int(new.blocks.max()) if len(new) else stored.last_block
+        fingerprint = f"{summary.state['n_tx'] + len(pending)}:{last_block}:{hash_set_digest(pending.hashes)}"
+        return StreamScore(features, fingerprint, partial(self.edges, address, pending))
+
+    @staticmethod
+    def _save(conn, address, summary, new, stored=None):
+        last_block, last_hashes = (stored.last_block, set(stored.last_hashes)) if stored is not None else (0, set())
+        top = int(new.blocks.max()) if len(new) else 0
+        if top > last_block:
+            last_block, last_hashes = top, set()
+        last_hashes.update(h for h, b in zip(new.hashes, new.blocks.tolist()) if b == last_block)
+        conn.execute(
+            'INSERT INTO address_summary (address, n_tx, last_block, last_hashes, summary, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(address) DO UPDATE SET n_tx = excluded.n_tx, last_block = excluded.last_block, '
+            'last_hashes = excluded.last_hashes, summary = excluded.summary, updated_at = excluded.updated_at',
+            (address, summary.state['n_tx'], last_block, '\n'.join(sorted(h or '' for h in last_hashes)),
+             json.dumps(summary.state), time.time())
+        )
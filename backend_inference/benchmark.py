@@ -0,0 +1,632 @@
+# --- benchmark.py (Synthetic-data benchmarks for the inference pipeline) ---
+#
+#   python benchmark.py run --quick --output bench.json
+#   python benchmark.py run --sizes 1,1000,1000000 --fan-out low,high --compare bench.json
+#   python benchmark.py compare old.json new.json --tolerance 0.25
+#   python benchmark.py startup --budget 3.0
+#
+# Nothing here touches the network or the real caches: transactions come from a
+# seeded generator, the upstream fetcher is replaced by a stub serving them, and
+# the tx / feature state / result caches live in a temporary directory.
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+# Counterparties per transaction (inputs + outputs besides the target), min / max
+FAN_OUT = {
+    'low': (1, 3),
+    'medium': (2, 10),
+    'high': (10, 40),
+}
+
+DEFAULT_SIZES = '1,10,100,1000,10000,100000,1000000'
+QUICK_SIZES = '1,100,10000'
+GENESIS_TIME = 1231006505
+# Modules the web layer should only load during warm-up, never on import
+HEAVY_MODULES = ('pandas', 'joblib', 'sklearn', 'xgboost', 'onnxruntime', 'aiohttp', 'scipy')
+
+
+def _hash(rng):
+    return '%064x' % rng.getrandbits(256)
+
+
+def _output(rng, addr, value, n, tx_index):
+    return {
+        'type': 0,
+        'spent': rng.random() < 0.7,
+        'value': value,
+        'n': n,
+        'tx_index': tx_index,
+        'script': '0014' + '%040x' % rng.getrandbits(160),
+        'addr': addr,
+    }
+
+
+def synthetic_transactions(address, n_tx, fan_out='medium', seed=0):
+    """Yield `n_tx` rawaddr-shaped transactions involving `address`, newest first.
+
+    About 45% of transactions spend from the address (it appears in an input's
+    `prev_out`), the rest pay to it. Counterparties are drawn from a pool with a
+    skewed popularity, so some addresses recur across many transactions the way
+    exchanges and mixers do. The same arguments always yield the same data.
+    """
+    rng = random.Random(f"{address}:{n_tx}:{fan_out}:{seed}")
+    low, high = FAN_OUT[fan_out]
+    pool_size = max(16, n_tx * (low + high) // 6)
+    height = 850_000
+    now = GENESIS_TIME + height * 600
+
+    def counterparty():
+        return f"1Bench{int(pool_size * rng.random() ** 3):028x}"
+
+    for i in range(n_tx):
+        height -= rng.choice((0, 0, 1, 1, 2, 5, 30))
+        now = min(now - rng.randint(1, 1200), GENESIS_TIME + height * 600)
+        tx_index = 9_000_000_000 - i
+        fee = int(rng.lognormvariate(8.5, 1.2))
+        n_cp = rng.randint(low, high)
+        inputs, outs = [], []
+
+        if rng.random() < 0.45:
+            value = int(rng.lognormvariate(15, 2.5)) + fee
+            inputs.append({'prev_out': _output(rng, address, value, 0, tx_index - 1)})
+            for _ in range(rng.randint(0, n_cp // 3)):
+                inputs.append({'prev_out': _output(rng, counterparty(), int(rng.lognormvariate(14, 2)), 0, tx_index - 2)})
+            n_out = max(1, n_cp - len(inputs) + 1)
+            remaining = value - fee
+            for n in range(n_out):
+                amount = remaining // (n_out - n) if n < n_out - 1 else remaining
+                remaining -= amount
+                outs.append(_output(rng, counterparty(), amount, n, tx_index))
+            if rng.random() < 0.5:
+                outs.append(_output(rng, address, int(rng.lognormvariate(12, 2)), len(outs), tx_index))
+        else:
+            n_in = max(1, min(n_cp, rng.randint(1, 3)))
+            for _ in range(n_in):
+                inputs.append({'prev_out': _output(rng, counterparty(), int(rng.lognormvariate(15, 2)), 0, tx_index - 3)})
+            outs.append(_output(rng, address, int(rng.lognormvariate(14, 2.5)), 0, tx_index))
+            for n in range(max(0, n_cp - n_in)):
+                outs.append(_output(rng, counterparty(), int(rng.lognormvariate(14, 2)), n + 1, tx_index))
+
+        for n, inp in enumerate(inputs):
+            inp.update({'sequence': 4294967295, 'witness': '', 'script': '', 'index': n})
+        yield {
+            'hash': _hash(rng),
+            'ver': 2,
+            'vin_sz': len(inputs),
+            'vout_sz': len(outs),
+            'size': 10 + 148 * len(inputs) + 34 * len(outs),
+            'weight': 4 * (10 + 148 * len(inputs) + 34 * len(outs)),
+            'fee': fee,
+            'relayed_by': '0.0.0.0',
+            'lock_time': 0,
+            'tx_index': tx_index,
+            'double_spend': False,
+            'time': now,
+            'block_index': height,
+            'block_height': height,
+            'inputs': inputs,
+            'out': outs,
+            'result': 0,
+            'balance': 0,
+        }
+
+
+def synthetic_rawaddr(address, transactions, params=None):
+    """One rawaddr response page (`limit` / `offset` params) over a pre-built history."""
+    params = params or {}
+    offset = int(params.get('offset', 0))
+    limit = int(params.get('limit', 50 if params else len(transactions)))
+    return {
+        'address': address,
+        'n_tx': len(transactions),
+        'total_received': 0,
+        'total_sent': 0,
+        'final_balance': 0,
+        'txs': transactions[offset:offset + limit],
+    }
+
+
+class StubFetcher:
+    """Serves synthetic histories in place of `BlockchainFetcher.fetch_address`."""
+
+    def __init__(self):
+        self.histories = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def add(self, address, transactions):
+        self.histories[address] = transactions
+
+    def fetch_address(self, address, params=None, deadline=None):
+        with self._lock:
+            self.calls += 1
+        return synthetic_rawaddr(address, self.histories.get(address, []), params)
+
+
+def summarize(durations, n_tx=None):
+    durations = sorted(durations)
+    median = statistics.median(durations)
+    summary = {
+        'median_s': median,
+        'p95_s': durations[min(len(durations) - 1, int(round(0.95 * (len(durations) - 1))))],
+        'min_s': durations[0],
+        'repeats': len(durations),
+    }
+    if n_tx:
+        summary['n_tx'] = n_tx
+        summary['us_per_tx'] = median / n_tx * 1e6
+    return summary
+
+
+def measure(fn, repeats, warmup=1):
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def _isolate_environment(workdir, model_file=None):
+    """Point every cache at `workdir` before the pipeline modules read their config."""
+    os.environ['TX_CACHE_DB'] = os.path.join(workdir, 'tx_cache.db')
+    os.environ['FEATURE_STATE_DB'] = os.path.join(workdir, 'feature_state.db')
+    os.environ['FEATURE_STORE_DIR'] = os.path.join(workdir, 'feature_store')
+    os.environ['COUNTERPARTY_GRAPH_DB'] = os.path.join(workdir, 'counterparty_graph.db')
+    os.environ.pop('BLOCK_INDEX_DB', None)
+    os.environ['SINGLEFLIGHT_LOCK_DIR'] = os.path.join(workdir, 'locks')
+    os.environ['RESULT_CACHE_INVALIDATIONS_DB'] = os.path.join(workdir, 'invalidations.db')
+    # Every prediction should run the pipeline, not come back from the result cache
+    os.environ['RESULT_CACHE_SIZE'] = '0'
+    os.environ['RESULT_CACHE_DB'] = ''
+    os.environ['MODEL_RELOAD_INTERVAL'] = '0'
+    os.environ.pop('METRICS_MULTIPROC_DIR', None)
+    if model_file:
+        os.environ['MODEL_FILE'] = model_file
+
+
+class Benchmark:
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = workdir
+        self.results = {}
+
+        import xgverifyv3
+        self.xgv = xgverifyv3
+        xgverifyv3.tx_store.legacy_json = None
+        self.stub = StubFetcher()
+        xgverifyv3.fetcher.fetch_address = self.stub.fetch_address
+        self.snapshot = xgverifyv3.get_model_snapshot()
+
+    def record(self, name, summary):
+        self.results[name] = summary
+        per_tx = f" ({summary['us_per_tx']:.2f} us/tx)" if 'us_per_tx' in summary else ''
+        extra = f" {summary['requests_per_s']:.1f} req/s" if 'requests_per_s' in summary else ''
+        print(f"  {name:<58} median {summary['median_s'] * 1000:10.3f} ms{per_tx}{extra}")
+
+    def repeats_for(self, n_tx):
+        # Keep the large histories affordable; their run-to-run noise is small anyway
+        if n_tx >= 100_000:
+            return 1
+        return self.args.repeats
+
+    def run_case(self, n_tx, fan_out):
+        from feature_engine import dumps_columns, features_from_columns, flatten_transactions, loads_columns
+        from fetcher import AddressHistory
+
+        xgv = self.xgv
+        case = f"n_tx={n_tx},fan_out={fan_out}"
+        address = f"1Target{n_tx}{fan_out}"
+        repeats = self.repeats_for(n_tx)
+        warmup = 0 if n_tx >= 100_000 else 1
+        print(f"[{case}]")
+
+        if n_tx > self.args.materialize_limit:
+            # Too big to hold as dicts: stream the generator straight into the flattener
+            self.record(f"flatten_streaming[{case}]", summarize(measure(
+                lambda: flatten_transactions(synthetic_transactions(address, n_tx, fan_out), address),
+                repeats, warmup), n_tx))
+            columns = flatten_transactions(synthetic_transactions(address, n_tx, fan_out), address)
+            self.record(f"base_features[{case}]", summarize(measure(
+                lambda: features_from_columns(columns), repeats, warmup), n_tx))
+            return
+
+        start = time.perf_counter()
+        transactions = list(synthetic_transactions(address, n_tx, fan_out))
+        self.results[f"generate[{case}]"] = summarize([time.perf_counter() - start], n_tx)
+
+        columns = flatten_transactions(transactions, address)
+        self.record(f"flatten[{case}]", summarize(measure(
+            lambda: flatten_transactions(transactions, address), repeats, warmup), n_tx))
+        self.record(f"base_features[{case}]", summarize(measure(
+            lambda: features_from_columns(columns), repeats, warmup), n_tx))
+        payload = dumps_columns(columns)
+        self.record(f"columns_encode[{case}]", summarize(measure(
+            lambda: dumps_columns(columns), repeats, warmup), n_tx))
+        self.record(f"columns_decode[{case}]", summarize(measure(
+            lambda: loads_columns(address, payload), repeats, warmup), n_tx))
+
+        self.record(f"build_feature_dict[{case}]", summarize(measure(
+            lambda: xgv.build_feature_dict(transactions, address), repeats, warmup), n_tx))
+
+        # Streaming path with a summary of everything but the newest transaction,
+        # which arrives on the first page of the stream
+        def stream():
+            return AddressHistory(self.stub, address, page_size=xgv.STREAM_PAGE_SIZE)
+
+        def state_update():
+            xgv.address_states.delete(address)
+            self.stub.add(address, transactions[1:])
+            xgv.address_states.update_from_stream(address, AddressHistory(self.stub, address, page_size=n_tx))
+            self.stub.add(address, transactions)
+            start = time.perf_counter()
+            xgv.address_states.update_from_stream(address, stream())
+            return time.perf_counter() - start
+        if n_tx > 1:
+            state_update()
+            self.record(f"state_update_one_new_tx[{case}]",
+                        summarize([state_update() for _ in range(repeats)], n_tx))
+            # Nothing new: one page read up to the watermark, features from the summary
+            self.record(f"state_rescore_unchanged[{case}]", summarize(measure(
+                lambda: xgv.address_states.update_from_stream(address, stream()), repeats, warmup), n_tx))
+
+        if self.snapshot is None or n_tx > self.args.e2e_limit:
+            return
+        self.stub.add(address, transactions)
+        self.record(f"predict_uncached[{case}]", summarize(
+            [self._predict_cold(address) for _ in range(repeats)], n_tx))
+        self.record(f"predict_tx_cache_hit[{case}]", summarize(measure(
+            lambda: xgv.predict_ransomware(address), repeats, warmup), n_tx))
+        self._stage_breakdown(case, lambda: xgv.predict_ransomware(address), repeats)
+
+        if self.args.http_requests and n_tx <= self.args.http_limit:
+            self.run_http(case, n_tx, fan_out, transactions)
+
+    def _predict_cold(self, address):
+        xgv = self.xgv
+        xgv.tx_store.delete(address)
+        start = time.perf_counter()
+        xgv.predict_ransomware(address)
+        return time.perf_counter() - start
+
+    def _stage_breakdown(self, case, fn, repeats):
+        """Mean per-stage time inside `fn`, read from the pipeline's own stage histograms."""
+        from metrics import STAGE_SECONDS
+
+        def totals():
+            with STAGE_SECONDS.registry.lock:
+                return {key[0]: (row[-1], row[-2]) for key, row in STAGE_SECONDS.values.items()}
+        before = totals()
+        for _ in range(repeats):
+            fn()
+        for stage, (total, count) in sorted(totals().items()):
+            prev_total, prev_count = before.get(stage, (0.0, 0))
+            if count > prev_count:
+                mean = (total - prev_total) / (count - prev_count)
+                self.record(f"stage.{stage}[{case}]", {'median_s': mean, 'p95_s': mean, 'min_s': mean,
+                                                        'repeats': count - prev_count})
+
+    def run_http(self, case, n_tx, fan_out, transactions):
+        """Requests per second through Flask + the full pipeline, one fresh address per request."""
+        from werkzeug.serving import make_server
+        import requests
+        import main
+
+        n_requests = self.args.http_requests
+        addresses = [f"1Http{n_tx}{fan_out}{i}" for i in range(n_requests)]
+        for address in addresses:
+            # Same history shape, re-targeted at each address so every request does full work
+            self.stub.add(address, list(synthetic_transactions(address, n_tx, fan_out, seed=1)))
+
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, main.app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = f"http://127.0.0.1:{server.server_port}/predict"
+        local = threading.local()
+
+        def one(address):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+            start = time.perf_counter()
+            response = session.post(url, json={'address': address}, timeout=300)
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.args.http_concurrency) as pool:
+                latencies = list(pool.map(one, addresses))
+            elapsed = time.perf_counter() - start
+        finally:
+            server.shutdown()
+            thread.join()
+            for address in addresses:
+                self.stub.histories.pop(address, None)
+
+        summary = summarize(latencies, n_tx)
+        summary['requests_per_s'] = n_requests / elapsed
+        summary['concurrency'] = self.args.http_concurrency
+        self.record(f"http_predict[{case}]", summary)
+
+    def run_scoring(self):
+        """Enhancement, scaling and inference for 1 and `batch` rows; independent of history size."""
+        if self.snapshot is None:
+            print("[BENCH] No model available: skipping scoring and end-to-end stages")
+            return
+        import pandas as pd
+        from feature_engine import features_from_columns, flatten_transactions
+
+        xgv = self.xgv
+        address = '1TargetScoring'
+        feature_dicts = []
+        for seed in range(self.args.batch):
+            txs = synthetic_transactions(address, 1 + seed % 200, 'medium', seed=seed)
+            feature_dicts.append(features_from_columns(flatten_transactions(txs, address)))
+
+        print("[scoring]")
+        for rows in (1, self.args.batch):
+            batch = feature_dicts[:rows]
+            enhanced = xgv.align_features(
+                xgv.create_enhanced_pattern_features(pd.DataFrame(batch)), self.snapshot.feature_names)
+            scaled = self.snapshot.scaler.transform(enhanced)
+            case = f"rows={rows}"
+            self.record(f"enhancement[{case}]", summarize(measure(
+                lambda: xgv.align_features(xgv.create_enhanced_pattern_features(pd.DataFrame(batch)),
+                                           self.snapshot.feature_names), self.args.repeats)))
+            self.record(f"scaling[{case}]", summarize(measure(
+                lambda: self.snapshot.scaler.transform(enhanced), self.args.repeats)))
+            self.record(f"inference[{case}]", summarize(measure(
+                lambda: self.snapshot.model.predict_proba(scaled), self.args.repeats)))
+            self.record(f"score_feature_dicts[{case}]", summarize(measure(
+                lambda: xgv.score_feature_dicts(batch, self.snapshot), self.args.repeats)))
+
+
+def _metadata(args):
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        revision = ''
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_revision': revision or None,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': {key: value for key, value in vars(args).items() if key != 'func'},
+    }
+
+
+def compare(baseline, current, tolerance=0.25, min_delta=0.0005):
+    """Print current vs baseline medians; return the names that got slower than allowed.
+
+    A benchmark regresses when its median grows by more than `tolerance` (relative)
+    and by more than `min_delta` seconds, so sub-millisecond jitter is ignored.
+    """
+    regressions = []
+    base_results = baseline['results']
+    print(f"{'benchmark':<60} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+    for name, result in current['results'].items():
+        before = base_results.get(name)
+        if before is None:
+            continue
+        old, new = before['median_s'], result['median_s']
+        change = (new - old) / old if old else 0.0
+        regressed = change > tolerance and new - old > min_delta
+        marker = '  REGRESSION' if regressed else ''
+        print(f"{name:<60} {old * 1000:12.3f} {new * 1000:12.3f} {change:+8.1%}{marker}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def cmd_run(args):
+    sizes = [int(size) for size in (args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)).split(',')]
+    fan_outs = (args.fan_out or ('low,high' if args.quick else 'low,medium,high')).split(',')
+    for fan_out in fan_outs:
+        if fan_out not in FAN_OUT:
+            raise SystemExit(f"Unknown fan-out {fan_out!r}; choose from {', '.join(FAN_OUT)}")
+
+    # Models fitted on plain arrays warn on every DataFrame they score
+    warnings.filterwarnings('ignore', message='X has feature names')
+    with tempfile.TemporaryDirectory(prefix='ransomware-bench-') as workdir:
+        _isolate_environment(workdir, args.model)
+        bench = Benchmark(args, workdir)
+        bench.run_scoring()
+        for fan_out in fan_outs:
+            for n_tx in sizes:
+                bench.run_case(n_tx, fan_out)
+
+    report = {'meta': _metadata(args), 'results': bench.results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"[BENCH] Wrote {len(bench.results)} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        if regressions:
+            print(f"[BENCH] {len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+def _startup_child(args):
+    """One cold start, measured inside a fresh interpreter: print the timings as JSON."""
+    import resource
+
+    warnings.filterwarnings('ignore', message='X has feature names')
+    logging.basicConfig(level=logging.WARNING)
+    timings = {}
+    with tempfile.TemporaryDirectory(prefix='ransomware-startup-') as workdir:
+        _isolate_environment(workdir, args.model)
+        os.environ['WARMUP'] = 'eager'
+        os.environ['LOG_LEVEL'] = 'WARNING'
+
+        start = time.perf_counter()
+        import flask  # noqa: F401
+        import xgverifyv3
+        timings['import'] = time.perf_counter() - start
+        heavy = sorted(name for name in HEAVY_MODULES if name in sys.modules)
+
+        xgverifyv3.tx_store.legacy_json = None
+        stub = StubFetcher()
+        xgverifyv3.fetcher.fetch_address = stub.fetch_address
+        address = '1StartupTarget'
+        stub.add(address, list(synthetic_transactions(address, args.n_tx, 'medium')))
+
+        start = time.perf_counter()
+        if xgverifyv3.warmup() is None:
+            raise SystemExit("[BENCH] Model could not be loaded; pass --model")
+        timings['warmup'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        import main
+        timings['app'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = main.app.test_client().post('/predict', json={'address': address})
+        timings['first_prediction'] = time.perf_counter() - start
+        if response.status_code != 200:
+            raise SystemExit(f"[BENCH] First prediction failed: {response.get_json()}")
+    timings['total'] = sum(timings.values())
+
+    print(json.dumps({
+        'timings': timings,
+        'heavy_modules_at_import': heavy,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+    return 0
+
+
+def cmd_startup(args):
+    if args.child:
+        return _startup_child(args)
+
+    command = [sys.executable, os.path.abspath(__file__), 'startup', '--child', '--n-tx', str(args.n_tx)]
+    if args.model:
+        command += ['--model', os.path.abspath(args.model)]
+    runs = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        child = subprocess.run(command, capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+        process_s = time.perf_counter() - start
+        if child.returncode != 0:
+            sys.stderr.write(child.stderr)
+            print(child.stdout.strip() or f"[BENCH] Startup run failed with exit code {child.returncode}")
+            return 1
+        run = json.loads(child.stdout.strip().splitlines()[-1])
+        run['timings']['process'] = process_s
+        runs.append(run)
+
+    results = {}
+    print("[startup]")
+    for stage in ('import', 'warmup', 'app', 'first_prediction', 'total', 'process'):
+        summary = summarize([run['timings'][stage] for run in runs])
+        results[f"startup.{stage}"] = summary
+        print(f"  {'startup.' + stage:<58} median {summary['median_s'] * 1000:10.3f} ms")
+    rss = statistics.median(run['max_rss_mb'] for run in runs)
+    heavy = runs[-1]['heavy_modules_at_import']
+    print(f"  max RSS {rss:.0f} MB; heavy modules loaded by import: {', '.join(heavy) or 'none'}")
+
+    report = {'meta': _metadata(args), 'results': results, 'max_rss_mb': rss, 'heavy_modules_at_import': heavy}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"[BENCH] Wrote {len(results)} results to {args.output}")
+
+    status = 0
+    total = results['startup.total']['median_s']
+    if args.budget and total > args.budget:
+        print(f"[BENCH] Cold start took {total:.3f}s, over the {args.budget:.3f}s budget")
+        status = 1
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        if regressions:
+            print(f"[BENCH] {len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            status = 1
+    return status
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.tolerance)
+    if regressions:
+        print(f"[BENCH] {len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ransomware inference pipeline on synthetic data.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="Run the benchmarks.")
+    run.add_argument('--sizes', help=f"Comma-separated history sizes (default {DEFAULT_SIZES}).")
+    run.add_argument('--fan-out', help="Comma-separated fan-out levels: low, medium, high (default all).")
+    run.add_argument('--quick', action='store_true', help=f"Smaller default matrix: sizes {QUICK_SIZES}, fan-out low,high.")
+    run.add_argument('--repeats', type=int, default=5)
+    run.add_argument('--batch', type=int, default=256, help="Rows for the batch scoring benchmarks.")
+    run.add_argument('--materialize-limit', type=int, default=50_000,
+                     help="Larger histories are streamed through the flattener only.")
+    run.add_argument('--e2e-limit', type=int, default=50_000,
+                     help="Largest history run through predict_ransomware.")
+    run.add_argument('--http-requests', type=int, default=32, help="Requests per HTTP case (0 disables).")
+    run.add_argument('--http-concurrency', type=int, default=8)
+    run.add_argument('--http-limit', type=int, default=10_000, help="Largest history used for HTTP throughput.")
+    run.add_argument('--model', help="Model bundle to use (default MODEL_FILE).")
+    run.add_argument('--output', help="Write results as JSON to this file.")
+    run.add_argument('--compare', help="Baseline results file; exit 1 on regressions.")
+    run.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative slowdown.")
+    run.set_defaults(func=cmd_run)
+
+    startup = commands.add_parser('startup', help="Time a cold start: import, warm-up and the first prediction.")
+    startup.add_argument('--budget', type=float, default=float(os.environ.get('STARTUP_BUDGET', '0') or 0),
+                         help="Fail when the median import + warm-up + first prediction time exceeds this "
+                              "many seconds (default STARTUP_BUDGET; 0 disables).")
+    startup.add_argument('--repeats', type=int, default=5, help="Fresh interpreters to start.")
+    startup.add_argument('--n-tx', type=int, default=100, help="History size of the first prediction.")
+    startup.add_argument('--model', help="Model bundle to use (default MODEL_FILE).")
+    startup.add_argument('--output', help="Write results as JSON to this file.")
+    startup.add_argument('--compare', help="Baseline results file; exit 1 on regressions.")
+    startup.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative slowdown.")
+    startup.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    startup.set_defaults(func=cmd_startup)
+
+    cmp_parser = commands.add_parser('compare', help="Compare two results files.")
+    cmp_parser.add_argument('baseline')
+    cmp_parser.add_argument('current')
+    cmp_parser.add_argument('--tolerance', type=float, default=0.25)
+    cmp_parser.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
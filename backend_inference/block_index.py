@@ -0,0 +1,415 @@
+# --- block_index.py (Address -> transaction index built from a local node's blocks) ---
+#
+#   bitcoin-cli getblock <hash> 2 > blocks/000123.json
+#   python block_index.py ingest blocks/ --workers 8
+#   python block_index.py sync --rpc-url http://127.0.0.1:18443 --rpc-user ... --rpc-password ...
+#   python block_index.py show bcrt1q...
+#
+# Blocks are read from `getblock <hash> 2` JSON (one block per .json file, a JSON
+# array of blocks, or one block per line in .jsonl; any of them gzipped), parsed
+# in a process pool and applied in height order. Inputs are resolved against the
+# outputs of earlier ingested blocks (or taken from `prevout` in verbosity-3 JSON),
+# and every transaction is stored in the blockchain.info rawaddr shape, so
+# fetch_transactions can serve it in place of the API (BLOCK_INDEX_DB).
+
+import argparse
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from feature_engine import concat_columns, flatten_transactions
+from storage import LocalConnection, chunked
+
+logger = logging.getLogger(__name__)
+
+SATOSHIS = 100_000_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    height INTEGER PRIMARY KEY,
+    hash   TEXT NOT NULL UNIQUE,
+    time   INTEGER NOT NULL,
+    n_tx   INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    txid     TEXT PRIMARY KEY,
+    height   INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    payload  BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS address_txs (
+    address  TEXT NOT NULL,
+    height   INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    txid     TEXT NOT NULL,
+    PRIMARY KEY (address, height, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS outputs (
+    txid    TEXT NOT NULL,
+    n       INTEGER NOT NULL,
+    address TEXT,
+    value   INTEGER NOT NULL,
+    PRIMARY KEY (txid, n)
+) WITHOUT ROWID;
+"""
+
+
+def _satoshis(btc):
+    return int(round(float(btc) * SATOSHIS))
+
+
+def _script_address(script):
+    """The address of a scriptPubKey (`address` since Core 22, `addresses` before), or None."""
+    if not script:
+        return None
+    if script.get('address'):
+        return script['address']
+    addresses = script.get('addresses')
+    return addresses[0] if addresses and len(addresses) == 1 else None
+
+
+def parse_block(block):
+    """Reduce a `getblock <hash> 2` block to what the index keeps.
+
+    Returns (height, hash, time, txs) with one (txid, fee, inputs, outputs) per
+    transaction: inputs are (prev_txid, vout, address, value), address and value
+    None unless the JSON carries the prevout, and a coinbase has no inputs; outputs
+    are (n, address, value). Values are in satoshis, fee None when not given.
+    """
+    txs = []
+    for tx in block['tx']:
+        inputs = []
+        for vin in tx.get('vin', []):
+            if 'coinbase' in vin:
+                continue
+            prevout = vin.get('prevout')
+            if prevout:
+                inputs.append((vin['txid'], vin['vout'], _script_address(prevout.get('scriptPubKey')),
+                               _satoshis(prevout.get('value', 0))))
+            else:
+                inputs.append((vin['txid'], vin['vout'], None, None))
+        outputs = [
+            (vout['n'], _script_address(vout.get('scriptPubKey')), _satoshis(vout.get('value', 0)))
+            for vout in tx.get('vout', [])
+        ]
+        fee = _satoshis(tx['fee']) if tx.get('fee') is not None else None
+        txs.append((tx['txid'], fee, inputs, outputs))
+    return block['height'], block['hash'], block.get('time') or 0, txs
+
+
+def _open(path):
+    return gzip.open(path, 'rt') if path.endswith('.gz') else open(path, 'r')
+
+
+def parse_file(path):
+    """Parse every block in one export file (a block, a JSON array of blocks, or JSON lines)."""
+    with _open(path) as f:
+        if path.endswith(('.jsonl', '.jsonl.gz', '.ndjson', '.ndjson.gz')):
+            blocks = [json.loads(line) for line in f if line.strip()]
+        else:
+            data = json.load(f)
+            blocks = data if isinstance(data, list) else [data]
+    # An RPC response saved as-is wraps the block in {"result": ...}
+    return [parse_block(block.get('result', block) if 'tx' not in block else block) for block in blocks]
+
+
+def block_files(paths):
+    """Expand directories into their export files, in name order."""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(('.json', '.jsonl', '.ndjson', '.json.gz', '.jsonl.gz', '.ndjson.gz')):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+class BlockIndex:
+    """SQLite index of the transactions touching each address, appended block by block.
+
+    Blocks at or below an already ingested height are skipped, so re-running an
+    ingest over the same export (or a growing one) only appends new blocks. The
+    `outputs` table holds the unspent outputs seen so far and is what inputs are
+    resolved against; spent outputs are removed from it. Reorgs are not handled:
+    a different block at an ingested height is reported and skipped.
+
+    columns() keeps the flattened histories of up to `cache_size` addresses with
+    the tip height they were read at. Since blocks are only ever appended, a
+    cached history is extended with the transactions of newer blocks instead of
+    being read and flattened again.
+    """
+
+    def __init__(self, path, cache_size=256):
+        self.path = path
+        self.cache_size = cache_size
+        self._conn = LocalConnection(path, SCHEMA)
+        self._columns = OrderedDict()
+        self._columns_lock = threading.Lock()
+
+    def tip(self):
+        """(height, hash) of the highest ingested block, or (None, None)."""
+        row = self._conn().execute('SELECT height, hash FROM blocks ORDER BY height DESC LIMIT 1').fetchone()
+        return row if row is not None else (None, None)
+
+    def has_address(self, address):
+        return self._conn().execute('SELECT 1 FROM address_txs WHERE address = ? LIMIT 1', (address,)).fetchone() is not None
+
+    def n_tx(self, address):
+        return self._conn().execute('SELECT COUNT(*) FROM address_txs WHERE address = ?', (address,)).fetchone()[0]
+
+    def transactions(self, address, limit=None, offset=0):
+        """rawaddr-style transactions of `address`, newest first; None if the address never appeared."""
+        rows = self._conn().execute(
+            'SELECT t.payload FROM address_txs a JOIN transactions t ON t.txid = a.txid '
+            'WHERE a.address = ? ORDER BY a.height DESC, a.position DESC LIMIT ? OFFSET ?',
+            (address, -1 if limit is None else limit, offset)
+        ).fetchall()
+        if not rows and offset == 0:
+            return None
+        return [json.loads(zlib.decompress(payload)) for payload, in rows]
+
+    def _transactions_between(self, address, above, upto):
+        """Transactions of `address` in blocks above height `above` up to `upto`, newest first."""
+        rows = self._conn().execute(
+            'SELECT t.payload FROM address_txs a JOIN transactions t ON t.txid = a.txid '
+            'WHERE a.address = ? AND a.height > ? AND a.height <= ? ORDER BY a.height DESC, a.position DESC',
+            (address, above, upto)
+        )
+        return [json.loads(zlib.decompress(payload)) for payload, in rows]
+
+    def columns(self, address):
+        """The address's full history as a TxColumns, or None if it is not in the index.
+
+        The result may be shared with other callers: treat it as read-only.
+        """
+        height = self.tip()[0]
+        if height is None:
+            return None
+        with self._columns_lock:
+            cached = self._columns.get(address)
+            if cached is not None:
+                self._columns.move_to_end(address)
+        if cached is not None and cached[0] == height:
+            return cached[1]
+
+        if cached is None:
+            # Bounded by the tip just read, so a block committed meanwhile is not half counted
+            transactions = self._transactions_between(address, -1, height)
+            if not transactions:
+                return None
+            columns = flatten_transactions(transactions, address)
+        else:
+            newer = self._transactions_between(address, cached[0], height)
+            columns = concat_columns(flatten_transactions(newer, address), cached[1]) if newer else cached[1]
+
+        with self._columns_lock:
+            current = self._columns.get(address)
+            if current is None or current[0] < height:
+                self._columns[address] = (height, columns)
+                self._columns.move_to_end(address)
+                while len(self._columns) > self.cache_size:
+                    self._columns.popitem(last=False)
+        return columns
+
+    def apply(self, parsed_blocks):
+        """Append parsed blocks (in any order; applied by height) in one write transaction.
+
+        Returns {'blocks', 'transactions', 'unresolved_inputs'} for what was added.
+        """
+        conn = self._conn()
+        added = {'blocks': 0, 'transactions': 0, 'unresolved_inputs': 0}
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            known = dict(conn.execute('SELECT height, hash FROM blocks WHERE height >= ?',
+                                      (min((b[0] for b in parsed_blocks), default=0),)))
+            created = {}   # outputs created in this batch and not spent yet
+            spent = []     # outputs from earlier batches spent in this one
+            tx_rows, address_rows, block_rows = [], [], []
+
+            for height, block_hash, block_time, txs in sorted(parsed_blocks, key=lambda b: b[0]):
+                if height in known:
+                    if known[height] != block_hash:
+                        logger.error("[BLOCK INDEX] Block %s at height %d differs from the indexed %s; "
+                                     "reorgs are not supported, skipping", block_hash, height, known[height])
+                    continue
+                known[height] = block_hash
+                for position, (txid, fee, inputs, outputs) in enumerate(txs):
+                    addresses = set()
+                    tx_inputs = []
+                    input_total, resolved = 0, True
+                    for prev_txid, vout, address, value in inputs:
+                        found = created.pop((prev_txid, vout), None)
+                        if found is None:
+                            found = conn.execute('SELECT address, value FROM outputs WHERE txid = ? AND n = ?',
+                                                 (prev_txid, vout)).fetchone()
+                            if found is not None:
+                                spent.append((prev_txid, vout))
+                        if value is None and found is not None:
+                            address, value = found
+                        if value is None:
+                            added['unresolved_inputs'] += 1
+                            resolved = False
+                            tx_inputs.append({})
+                            continue
+                        input_total += value
+                        tx_inputs.append({'prev_out': {'addr': address, 'value': value, 'tx_hash': prev_txid, 'n': vout}})
+                        if address:
+                            addresses.add(address)
+
+                    tx_outputs = []
+                    for n, address, value in outputs:
+                        created[(txid, n)] = (address, value)
+                        tx_outputs.append({'addr': address, 'value': value, 'n': n})
+                        if address:
+                            addresses.add(address)
+
+                    if fee is None:
+                        fee = input_total - sum(value for _, _, value in outputs) if inputs and resolved else 0
+                    tx = {
+                        'hash': txid,
+                        'time': block_time,
+                        'block_height': height,
+                        'fee': fee,
+                        'inputs': tx_inputs,
+                        'out': tx_outputs,
+                    }
+                    payload = zlib.compress(json.dumps(tx, separators=(',', ':')).encode('utf-8'), 1)
+                    tx_rows.append((txid, height, position, payload))
+                    address_rows.extend((address, height, position, txid) for address in addresses)
+                block_rows.append((height, block_hash, block_time, len(txs)))
+                added['blocks'] += 1
+                added['transactions'] += len(txs)
+
+            conn.executemany('INSERT OR REPLACE INTO transactions (txid, height, position, payload) VALUES (?, ?, ?, ?)',
+                             tx_rows)
+            conn.executemany('INSERT OR IGNORE INTO address_txs (address, height, position, txid) VALUES (?, ?, ?, ?)',
+                             address_rows)
+            conn.executemany('DELETE FROM outputs WHERE txid = ? AND n = ?', spent)
+            conn.executemany('INSERT OR REPLACE INTO outputs (txid, n, address, value) VALUES (?, ?, ?, ?)',
+                             ((txid, n, address, value) for (txid, n), (address, value) in created.items()))
+            conn.executemany('INSERT INTO blocks (height, hash, time, n_tx) VALUES (?, ?, ?, ?)', block_rows)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return added
+
+    def stats(self):
+        conn = self._conn()
+        height, block_hash = self.tip()
+        return {
+            'path': self.path,
+            'blocks': conn.execute('SELECT COUNT(*) FROM blocks').fetchone()[0],
+            'tip_height': height,
+            'tip_hash': block_hash,
+            'transactions': conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0],
+            'addresses': conn.execute('SELECT COUNT(DISTINCT address) FROM address_txs').fetchone()[0],
+            'unspent_outputs': conn.execute('SELECT COUNT(*) FROM outputs').fetchone()[0],
+            'bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+
+def ingest(index, paths, workers=None, files_per_batch=64):
+    """Parse export files in a process pool and append their blocks to `index`.
+
+    Files are parsed in parallel and applied `files_per_batch` at a time, sorted by
+    height within each batch, so exports should be named in height order (as
+    `getblock` dumps per height usually are) for inputs to resolve across batches.
+    """
+    files = list(block_files(paths))
+    workers = workers or os.cpu_count() or 1
+    totals = {'blocks': 0, 'transactions': 0, 'unresolved_inputs': 0}
+    start = time.monotonic()
+    pool = multiprocessing.Pool(workers) if workers > 1 and len(files) > 1 else None
+    try:
+        parse = pool.imap if pool is not None else map
+        for batch in chunked(parse(parse_file, files), files_per_batch):
+            added = index.apply([block for blocks in batch for block in blocks])
+            for key, value in added.items():
+                totals[key] += value
+            logger.info("[BLOCK INDEX] %d blocks, %d transactions indexed (tip %s) in %.1fs",
+                        totals['blocks'], totals['transactions'], index.tip()[0], time.monotonic() - start)
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return totals
+
+
+def _rpc(session, url, method, *params):
+    response = session.post(url, json={'jsonrpc': '1.0', 'id': 'block_index', 'method': method, 'params': list(params)},
+                            timeout=120)
+    body = response.json()
+    if body.get('error'):
+        raise RuntimeError(f"{method}: {body['error']}")
+    return body['result']
+
+
+def sync_rpc(index, url, user=None, password=None, batch_blocks=100):
+    """Append every block the node has above the index's tip, fetched with `getblock <hash> 2`."""
+    import requests
+
+    session = requests.Session()
+    if user:
+        session.auth = (user, password or '')
+    node_height = _rpc(session, url, 'getblockcount')
+    tip, _ = index.tip()
+    totals = {'blocks': 0, 'transactions': 0, 'unresolved_inputs': 0}
+    for start in range(0 if tip is None else tip + 1, node_height + 1, batch_blocks):
+        blocks = [
+            parse_block(_rpc(session, url, 'getblock', _rpc(session, url, 'getblockhash', height), 2))
+            for height in range(start, min(start + batch_blocks, node_height + 1))
+        ]
+        for key, value in index.apply(blocks).items():
+            totals[key] += value
+        logger.info("[BLOCK INDEX] Synced to height %d of %d", index.tip()[0], node_height)
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build an address -> transaction index from a local node's blocks.")
+    parser.add_argument("--index", default=os.environ.get('BLOCK_INDEX_DB') or 'block_index.db')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest', help="Append blocks from `getblock <hash> 2` JSON exports.")
+    ingest_parser.add_argument("paths", nargs='+', help="Export files or directories of them.")
+    ingest_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parser processes.")
+    ingest_parser.add_argument("--files-per-batch", type=int, default=64)
+    sync_parser = commands.add_parser('sync', help="Append new blocks straight from the node's JSON-RPC.")
+    sync_parser.add_argument("--rpc-url", default=os.environ.get('BITCOIN_RPC_URL', 'http://127.0.0.1:18443'))
+    sync_parser.add_argument("--rpc-user", default=os.environ.get('BITCOIN_RPC_USER'))
+    sync_parser.add_argument("--rpc-password", default=os.environ.get('BITCOIN_RPC_PASSWORD'))
+    commands.add_parser('stats', help="Print the index size and tip.")
+    show_parser = commands.add_parser('show', help="Print an address's transactions as rawaddr JSON.")
+    show_parser.add_argument("address")
+    show_parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(message)s')
+    index = BlockIndex(args.index)
+    if args.command == 'ingest':
+        totals = ingest(index, args.paths, args.workers, args.files_per_batch)
+    elif args.command == 'sync':
+        totals = sync_rpc(index, args.rpc_url, args.rpc_user, args.rpc_password)
+    elif args.command == 'stats':
+        print(json.dumps(index.stats(), indent=2))
+        return 0
+    else:
+        transactions = index.transactions(args.address, limit=args.limit) or []
+        print(json.dumps({'address': args.address, 'n_tx': index.n_tx(args.address), 'txs': transactions}, indent=2))
+        return 0
+    print(f"[BLOCK INDEX] Added {totals['blocks']} blocks, {totals['transactions']} transactions "
+          f"({totals['unresolved_inputs']} inputs spending outputs outside the index)", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
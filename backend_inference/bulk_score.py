@@ -0,0 +1,198 @@
+# --- bulk_score.py (Offline bulk scoring over a process pool) ---
+#
+#   python xgverifyv3.py --input addresses.txt --output scores.csv --offline
+#   cat addresses.txt | python xgverifyv3.py --input - --output scores.jsonl --resume
+#
+# Addresses are scored in chunks by worker processes that each load the model
+# once. Results are appended to the output as chunks finish, so the output file
+# doubles as the checkpoint: --resume skips every address already scored in it
+# and retries the ones that recorded an error.
+
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from storage import chunked
+
+CSV_FIELDS = [
+    'address', 'ransomware_probability', 'is_ransomware', 'confidence_level', 'threshold_used',
+    'transactions_analyzed', 'model_version', 'error',
+]
+
+
+def add_arguments(parser):
+    """Bulk-mode options for the xgverifyv3 CLI."""
+    group = parser.add_argument_group('bulk scoring')
+    group.add_argument("--input", "-i", help="File with one address per line ('-' for stdin); enables bulk mode.")
+    group.add_argument("--output", "-o", help="Results file (.csv or .jsonl); stdout when omitted.")
+    group.add_argument("--format", choices=['csv', 'jsonl'], help="Output format (default: from --output extension, else jsonl).")
+    group.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count).")
+    group.add_argument("--chunk-size", type=int, default=64, help="Addresses scored per model pass.")
+    group.add_argument("--resume", action='store_true', help="Skip addresses already scored in --output; retry those that failed.")
+    group.add_argument("--offline", action='store_true', help="Only use the local transaction cache, never the API.")
+    group.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress lines.")
+
+
+def read_addresses(path):
+    """Yield addresses from `path` (or stdin for '-'), skipping blanks and '#' comments."""
+    f = sys.stdin if path == '-' else open(path, 'r')
+    try:
+        for line in f:
+            address = line.strip()
+            if address and not address.startswith('#'):
+                yield address
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _truncate_partial_line(path):
+    """Drop a trailing line left half-written by an interrupted run."""
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        data_start = max(0, size - 1024 * 1024)
+        f.seek(data_start)
+        tail = f.read()
+        cut = tail.rfind(b'\n')
+        f.truncate(data_start + cut + 1 if cut >= 0 else 0)
+
+
+def completed_addresses(path, fmt):
+    """Addresses a previous run's output scored; rows that recorded an error are retried."""
+    if not path or not os.path.exists(path):
+        return set()
+    _truncate_partial_line(path)
+    done = set()
+    with open(path, 'r', newline='') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                if row.get('address') and not row.get('error'):
+                    done.add(row['address'])
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if not record.get('error'):
+                    done.add(record['address'])
+    return done
+
+
+class ResultWriter:
+    def __init__(self, path, fmt, append):
+        new_file = not (append and path and os.path.exists(path) and os.path.getsize(path) > 0)
+        self.f = open(path, 'a' if append else 'w', newline='') if path else sys.stdout
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.csv = csv.DictWriter(self.f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            if new_file:
+                self.csv.writeheader()
+
+    def write(self, results):
+        for result in results:
+            if self.fmt == 'csv':
+                self.csv.writerow(result)
+            else:
+                self.f.write(json.dumps(result) + '\n')
+        self.f.flush()
+
+    def close(self):
+        if self.f is not sys.stdout:
+            self.f.close()
+
+
+_offline = False
+
+
+def _init_worker(offline):
+    """Pool initializer: import the pipeline and load the model once per worker."""
+    global _offline
+    _offline = offline
+    import xgverifyv3
+    xgverifyv3.get_model_snapshot()
+
+
+def _score_chunk(addresses):
+    import xgverifyv3
+    try:
+        results = xgverifyv3.predict_ransomware_batch(addresses, offline=_offline)
+    except Exception as e:
+        return [{'address': address, 'error': f"{type(e).__name__}: {e}"} for address in addresses]
+    finally:
+        # Pool workers exit without running atexit handlers
+        xgverifyv3.flush_background_writes()
+    if results is None:
+        return [{'address': address, 'error': 'Model is not available'} for address in addresses]
+    for result in results:
+        result.pop('cache_hit', None)
+    return results
+
+
+def run(args):
+    """Score every address from `args.input`; returns a process exit code."""
+    fmt = args.format or ('csv' if args.output and args.output.endswith('.csv') else 'jsonl')
+    done = completed_addresses(args.output, fmt) if args.resume else set()
+    if done:
+        print(f"[BULK] Resuming: {len(done)} addresses already in {args.output}", file=sys.stderr)
+
+    seen = set(done)
+
+    def pending():
+        for address in read_addresses(args.input):
+            if address not in seen:
+                seen.add(address)
+                yield address
+
+    writer = ResultWriter(args.output, fmt, append=args.resume)
+    chunks = chunked(pending(), max(1, args.chunk_size))
+    scored = errors = 0
+    start = last_report = time.monotonic()
+
+    def report(final=False):
+        elapsed = time.monotonic() - start
+        rate = (scored + errors) / elapsed if elapsed > 0 else 0.0
+        label = 'Done' if final else 'Progress'
+        print(f"[BULK] {label}: {scored + errors} addresses ({scored} scored, {errors} errors) "
+              f"in {elapsed:.1f}s, {rate:.1f} addresses/s", file=sys.stderr)
+
+    pool = None
+    try:
+        if args.workers > 1:
+            pool = multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(args.offline,))
+            results_iter = pool.imap_unordered(_score_chunk, chunks)
+        else:
+            _init_worker(args.offline)
+            results_iter = map(_score_chunk, chunks)
+
+        for results in results_iter:
+            writer.write(results)
+            failed = sum(1 for result in results if 'error' in result)
+            errors += failed
+            scored += len(results) - failed
+            if time.monotonic() - last_report >= args.progress_interval:
+                last_report = time.monotonic()
+                report()
+        if pool is not None:
+            pool.close()
+            pool.join()
+            pool = None
+    except KeyboardInterrupt:
+        print("[BULK] Interrupted; rerun with --resume to continue.", file=sys.stderr)
+        return 130
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        writer.close()
+        report(final=True)
+    return 0
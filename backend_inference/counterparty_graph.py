@@ -0,0 +1,377 @@
+# --- counterparty_graph.py (Persistent counterparty graph shared by every scoring job) ---
+#
+#   python counterparty_graph.py stats
+#   python counterparty_graph.py neighbors 1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa
+#   python counterparty_graph.py exposure 1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa --hops 3
+#
+# Every address whose history is fetched gets one adjacency row: its counterparties
+# as interned node IDs, how many of its transactions each one shares, and the
+# address's own value moved in those transactions. Rows are CSR segments (sorted
+# IDs plus parallel count / value arrays), and the rows of already-fetched
+# neighbours give multi-hop exposure without any upstream call. Rows are written
+# behind the requests that fetched them; the features never read the graph.
+
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import namedtuple
+from functools import partial
+
+import numpy as np
+
+from metrics import stage_timer
+from result_cache import transaction_fingerprint
+from storage import LocalConnection, WriteBehind, select_in
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id      INTEGER PRIMARY KEY,
+    address TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS edges (
+    node        INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    degree      INTEGER NOT NULL,
+    updated_at  REAL NOT NULL,
+    payload     BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scores (
+    node        INTEGER PRIMARY KEY,
+    probability REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+"""
+
+# Neighbour IDs, shared transaction counts and values (satoshis), all int64
+EdgeRow = namedtuple('EdgeRow', ['node', 'fingerprint', 'neighbors', 'counts', 'values'])
+# An address's counterparties (addresses) with parallel counts and values, before interning
+Edges = namedtuple('Edges', ['addresses', 'counts', 'values'])
+
+# In-process address -> ID cache; IDs never change once assigned
+INTERN_CACHE_SIZE = 1_000_000
+# Queued updates are written at least this often (seconds), one transaction per batch
+WRITE_INTERVAL = 0.5
+# Updates waiting beyond this are dropped; the row is refreshed the next time the address is scored
+WRITE_QUEUE_SIZE = 10000
+
+
+def _encode_row(neighbors, counts, values):
+    body = b''.join(np.ascontiguousarray(a, dtype='<i8').tobytes() for a in (neighbors, counts, values))
+    return zlib.compress(struct.pack('<Q', len(neighbors)) + body, 1)
+
+
+def _decode_row(payload):
+    data = zlib.decompress(payload)
+    n = struct.unpack_from('<Q', data)[0]
+    arrays = np.frombuffer(data, dtype='<i8', offset=8, count=3 * n).reshape(3, n)
+    return arrays[0], arrays[1], arrays[2]
+
+
+def edge_arrays(columns, counterparty_counts=None):
+    """Per counterparty of a TxColumns: (counts, values), indexed like `cp_addresses`.
+
+    The value of an edge is the target's sent + received amount summed over the
+    transactions it shares with that counterparty.
+    """
+    if counterparty_counts is None:
+        counterparty_counts = columns.counterparty_counts()
+    amounts = (columns.sent + columns.received).astype(np.float64)
+    per_entry = np.repeat(amounts, np.diff(columns.cp_offsets))
+    values = np.bincount(columns.cp_ids, weights=per_entry, minlength=len(columns.cp_addresses))
+    return np.asarray(counterparty_counts, dtype=np.int64), np.rint(values).astype(np.int64)
+
+
+def edges_from_columns(columns, counterparty_counts=None):
+    """The Edges of a TxColumns: its counterparties with their counts and values."""
+    counts, values = edge_arrays(columns, counterparty_counts)
+    present = np.flatnonzero(counts > 0)
+    return Edges([columns.cp_addresses[i] for i in present.tolist()], counts[present], values[present])
+
+
+class CounterpartyGraph:
+    """SQLite-backed adjacency of every fetched address.
+
+    Request threads only queue their updates (`enqueue_update()`,
+    `enqueue_scores()`); a background writer stores them in batches, one write
+    transaction per batch, so scoring never waits for the graph's write lock.
+    An address's row is replaced when its transaction fingerprint changes and
+    left alone otherwise. Scored probabilities are kept per node for exposure.
+    `update()` and `record_scores()` write synchronously, for offline use.
+    """
+
+    def __init__(self, path, write_interval=WRITE_INTERVAL, max_queue=WRITE_QUEUE_SIZE):
+        self.path = path
+        self._conn = LocalConnection(path, SCHEMA)
+        self._ids = {}
+        self._ids_lock = threading.Lock()
+        self._writes = WriteBehind(self._write, 'counterparty_graph', interval=write_interval, max_queue=max_queue)
+
+    def _intern(self, conn, addresses):
+        """IDs of `addresses`, inserting unknown ones. Must run inside a write transaction."""
+        ids = {address: self._ids.get(address) for address in addresses}
+        missing = [address for address, node in ids.items() if node is None]
+        if missing:
+            conn.executemany('INSERT OR IGNORE INTO nodes (address) VALUES (?)', ((address,) for address in missing))
+            ids.update(select_in(conn, 'SELECT address, id FROM nodes WHERE address IN ({placeholders})', missing))
+        return ids
+
+    def _remember(self, ids):
+        with self._ids_lock:
+            if len(self._ids) + len(ids) > INTERN_CACHE_SIZE:
+                self._ids.clear()
+            self._ids.update(ids)
+
+    def node_ids(self, addresses):
+        """{address: id} for the addresses already in the graph."""
+        return dict(select_in(self._conn(), 'SELECT address, id FROM nodes WHERE address IN ({placeholders})',
+                              addresses))
+
+    def addresses(self, node_ids):
+        """{id: address} for `node_ids`."""
+        return dict(select_in(self._conn(), 'SELECT id, address FROM nodes WHERE id IN ({placeholders})',
+                              [int(node) for node in node_ids]))
+
+    def _row_by_id(self, node):
+        found = self._conn().execute('SELECT fingerprint, payload FROM edges WHERE node = ?', (node,)).fetchone()
+        if found is None:
+            return None
+        return EdgeRow(node, found[0], *_decode_row(found[1]))
+
+    def row(self, address):
+        """The stored EdgeRow of `address`, or None if its history was never fetched."""
+        node = self._ids.get(address) or self.node_ids([address]).get(address)
+        return None if node is None else self._row_by_id(node)
+
+    def enqueue_update(self, address, columns):
+        """Queue storing the counterparties of `address` from its TxColumns; returns at once."""
+        self.enqueue_edges(address, transaction_fingerprint(columns), partial(edges_from_columns, columns))
+
+    def enqueue_edges(self, address, fingerprint, load_edges):
+        """Queue replacing the row of `address` with `load_edges()` (an Edges), unless `fingerprint` is stored.
+
+        `load_edges` runs on the writer thread, and only when the row has changed.
+        """
+        self._writes.submit(('edges', address, (fingerprint, load_edges)))
+
+    def enqueue_scores(self, addresses, probabilities):
+        """Queue keeping the latest probability of each scored address; returns at once."""
+        for address, probability in zip(addresses, probabilities):
+            self._writes.submit(('score', address, float(probability)))
+
+    def flush(self, timeout=None):
+        """Write the queued updates now; True once none are pending."""
+        return self._writes.flush(timeout)
+
+    def _write(self, items):
+        # Later items for the same address replace earlier ones
+        edges = {address: value for kind, address, value in items if kind == 'edges'}
+        scores = {address: value for kind, address, value in items if kind == 'score'}
+        with stage_timer('counterparty_graph'):
+            self._write_edges(edges, scores)
+
+    def _write_edges(self, edges, scores=None):
+        """Store {address: (fingerprint, load_edges)} and {address: probability} in one transaction."""
+        scores = scores or {}
+        stored = dict(select_in(
+            self._conn(),
+            'SELECT n.address, e.fingerprint FROM nodes n JOIN edges e ON e.node = n.id '
+            'WHERE n.address IN ({placeholders})',
+            list(edges)
+        )) if edges else {}
+        # Loaded before taking the write lock, which other workers' writers share
+        loaded = {address: (fingerprint, load_edges()) for address, (fingerprint, load_edges) in edges.items()
+                  if stored.get(address) != fingerprint}
+        if not loaded and not scores:
+            return {}
+        names = set(loaded) | set(scores)
+        for _, row_edges in loaded.values():
+            names.update(row_edges.addresses)
+
+        conn = self._conn()
+        now = time.time()
+        rows = {}
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            ids = self._intern(conn, list(names))
+            for address, (fingerprint, row_edges) in loaded.items():
+                neighbors = np.fromiter((ids[cp] for cp in row_edges.addresses), dtype=np.int64,
+                                        count=len(row_edges.addresses))
+                order = np.argsort(neighbors, kind='stable')
+                row = EdgeRow(ids[address], fingerprint, neighbors[order],
+                              np.asarray(row_edges.counts, dtype=np.int64)[order],
+                              np.asarray(row_edges.values, dtype=np.int64)[order])
+                conn.execute(
+                    'INSERT INTO edges (node, fingerprint, degree, updated_at, payload) VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT(node) DO UPDATE SET fingerprint = excluded.fingerprint, degree = excluded.degree, '
+                    'updated_at = excluded.updated_at, payload = excluded.payload',
+                    (row.node, fingerprint, len(row.neighbors), now,
+                     _encode_row(row.neighbors, row.counts, row.values))
+                )
+                rows[address] = row
+            conn.executemany(
+                'INSERT INTO scores (node, probability, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(node) DO UPDATE SET probability = excluded.probability, updated_at = excluded.updated_at',
+                [(ids[address], probability, now) for address, probability in scores.items()]
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._remember(ids)
+        return rows
+
+    def update(self, address, columns, counterparty_counts=None):
+        """Store the counterparties of `address` from its TxColumns now; returns its EdgeRow.
+
+        `counterparty_counts` (indexed like `columns.cp_addresses`) is used when the
+        caller already has it. Nothing is rewritten while the fingerprint is unchanged.
+        """
+        written = self._write_edges({
+            address: (transaction_fingerprint(columns), partial(edges_from_columns, columns, counterparty_counts))
+        })
+        return written.get(address) or self.row(address)
+
+    def record_scores(self, addresses, probabilities):
+        """Keep the latest probability of each scored address, for exposure, now."""
+        if addresses:
+            self._write_edges({}, {address: float(p) for address, p in zip(addresses, probabilities)})
+
+    def _scores(self, node_ids):
+        return dict(select_in(self._conn(), 'SELECT node, probability FROM scores WHERE node IN ({placeholders})',
+                              [int(node) for node in node_ids]))
+
+    def exposure(self, address, hops=2, max_nodes=10000):
+        """Random-walk exposure of `address` to scored addresses, per hop.
+
+        A walk starts at `address` and steps to a counterparty with probability
+        proportional to their shared transaction count; it can only continue from
+        addresses whose history has been fetched. For each hop, `exposure` is the
+        expected ransomware probability of where the walk lands, over the part of
+        the walk (`scored_weight`) that lands on an address with a score. Nodes
+        first reached at an earlier hop are not revisited; the walk stops after
+        `max_nodes` nodes.
+        """
+        start = self.row(address)
+        if start is None:
+            return None
+        weights = {start.node: 1.0}
+        visited = {start.node}
+        rows = {start.node: start}
+        result = []
+        for hop in range(1, hops + 1):
+            reached = {}
+            for node, weight in weights.items():
+                row = rows.get(node) or self._row_by_id(node)
+                if row is None or not len(row.counts):
+                    continue
+                shares = weight * row.counts / row.counts.sum()
+                for neighbor, share in zip(row.neighbors.tolist(), shares.tolist()):
+                    if neighbor not in visited:
+                        reached[neighbor] = reached.get(neighbor, 0.0) + share
+            if not reached:
+                break
+            if len(visited) + len(reached) > max_nodes:
+                # Keep the heaviest part of the frontier within the node budget
+                keep = sorted(reached, key=reached.get, reverse=True)[:max(0, max_nodes - len(visited))]
+                reached = {node: reached[node] for node in keep}
+            scores = self._scores(reached)
+            scored_weight = sum(reached[node] for node in scores)
+            result.append({
+                'hop': hop,
+                'nodes': len(reached),
+                'scored_nodes': len(scores),
+                'scored_weight': scored_weight,
+                'exposure': sum(reached[node] * p for node, p in scores.items()) / scored_weight if scored_weight else 0.0,
+            })
+            visited.update(reached)
+            weights, rows = reached, {}
+        return result
+
+    def csr(self):
+        """The whole graph as CSR arrays: (offsets, neighbors, counts, values), indexed by node ID."""
+        conn = self._conn()
+        n_nodes = (conn.execute('SELECT COALESCE(MAX(id), 0) FROM nodes').fetchone()[0] or 0) + 1
+        degrees = np.zeros(n_nodes, dtype=np.int64)
+        for node, degree in conn.execute('SELECT node, degree FROM edges'):
+            degrees[node] = degree
+        offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(degrees, out=offsets[1:])
+        neighbors = np.empty(offsets[-1], dtype=np.int64)
+        counts = np.empty(offsets[-1], dtype=np.int64)
+        values = np.empty(offsets[-1], dtype=np.int64)
+        for node, payload in conn.execute('SELECT node, payload FROM edges'):
+            row_neighbors, row_counts, row_values = _decode_row(payload)
+            start = offsets[node]
+            if len(row_neighbors) != degrees[node]:
+                continue  # rewritten since the degrees were read; keep the older shape
+            neighbors[start:start + len(row_neighbors)] = row_neighbors
+            counts[start:start + len(row_neighbors)] = row_counts
+            values[start:start + len(row_neighbors)] = row_values
+        return offsets, neighbors, counts, values
+
+    def stats(self):
+        conn = self._conn()
+        n_edges, n_fetched = conn.execute('SELECT COALESCE(SUM(degree), 0), COUNT(*) FROM edges').fetchone()
+        return {
+            'path': self.path,
+            'nodes': conn.execute('SELECT COUNT(*) FROM nodes').fetchone()[0],
+            'fetched_nodes': n_fetched,
+            'edges': n_edges,
+            'scored_nodes': conn.execute('SELECT COUNT(*) FROM scores').fetchone()[0],
+            'bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the counterparty graph.")
+    parser.add_argument("--graph", default=os.environ.get('COUNTERPARTY_GRAPH_DB', 'counterparty_graph.db'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help="Print node, edge and score counts.")
+    neighbors_parser = commands.add_parser('neighbors', help="Print an address's counterparties.")
+    neighbors_parser.add_argument("address")
+    neighbors_parser.add_argument("--limit", type=int, default=50)
+    exposure_parser = commands.add_parser('exposure', help="Multi-hop exposure of an address to scored addresses.")
+    exposure_parser.add_argument("address")
+    exposure_parser.add_argument("--hops", type=int, default=2)
+    exposure_parser.add_argument("--max-nodes", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING').upper(), format='%(message)s')
+    graph = CounterpartyGraph(args.graph)
+    if args.command == 'stats':
+        print(json.dumps(graph.stats(), indent=2))
+        return 0
+    if args.command == 'exposure':
+        result = graph.exposure(args.address, args.hops, args.max_nodes)
+    else:
+        row = graph.row(args.address)
+        if row is not None:
+            top = np.argsort(-row.counts, kind='stable')[:args.limit]
+            names = graph.addresses(row.neighbors[top])
+            result = {
+                'degree': len(row.neighbors),
+                'counterparties': [
+                    {'address': names.get(int(row.neighbors[i])), 'transactions': int(row.counts[i]),
+                     'value': int(row.values[i])}
+                    for i in top.tolist()
+                ],
+            }
+        else:
+            result = None
+    if result is None:
+        print(f"{args.address} is not in the graph (its history was never fetched)", file=sys.stderr)
+        return 1
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+# --- feature_store.py (Memory-mapped store of scored feature vectors) ---
+#
+#   python feature_store.py stats
+#   python feature_store.py rescore --model new_model.joblib --output rescored.csv
+#   python feature_store.py rescore --model enhanced_ransomware_model_v3.joblib \
+#       --onnx ../src/analysis/src/analysis_model.onnx --output rescored.jsonl
+#
+# Every vector the API scores (56 base + 10 enhanced features, unscaled, in the
+# training feature order) is written to one float32 matrix file; an SQLite index
+# maps addresses to rows. A new model version can then be scored over the whole
+# matrix in chunks straight from the memory map, without refetching anything.
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from feature_engine import fill_feature_matrix
+from metrics import stage_timer
+from storage import LocalConnection, WriteBehind, select_in
+
+logger = logging.getLogger(__name__)
+
+DTYPE = np.dtype('<f4')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feature_index (
+    address     TEXT PRIMARY KEY,
+    row         INTEGER NOT NULL UNIQUE,
+    fingerprint TEXT,
+    updated_at  REAL NOT NULL
+);
+"""
+
+# Queued vectors are written at least this often (seconds), one transaction per batch
+WRITE_INTERVAL = 0.5
+# Vectors waiting beyond this are dropped; the row is refreshed the next time the address is scored
+WRITE_QUEUE_SIZE = 10000
+
+
+class FeatureStore:
+    """Append-only float32 feature matrix with an address -> row index.
+
+    `<path>/features.f32` holds the rows back to back, `<path>/index.db` the index
+    and `<path>/meta.json` the column names (fixed when the store is created). An
+    address scored again overwrites its own row. Rows are allocated and written
+    inside one SQLite write transaction, so concurrent workers never share a row
+    and an indexed row is always fully written. The API queues its vectors with
+    enqueue_many(); a writer thread stores them in batches.
+    """
+
+    def __init__(self, path, feature_names=None, write_interval=WRITE_INTERVAL, max_queue=WRITE_QUEUE_SIZE):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.matrix_path = os.path.join(path, 'features.f32')
+        self.index_path = os.path.join(path, 'index.db')
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.feature_names = json.load(f)['feature_names']
+        elif feature_names is None:
+            raise FileNotFoundError(f"No feature store at {path}")
+        else:
+            self.feature_names = list(feature_names)
+            tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'feature_names': self.feature_names, 'dtype': DTYPE.str}, f)
+            os.replace(tmp_path, meta_path)
+        self.index = {name: i for i, name in enumerate(self.feature_names)}
+        self.row_bytes = len(self.feature_names) * DTYPE.itemsize
+        self._local = threading.local()
+        self._conn = LocalConnection(self.index_path, SCHEMA, self._open_matrix)
+        self._writes = WriteBehind(self._write, 'feature_store', interval=write_interval, max_queue=max_queue)
+
+    def _open_matrix(self, conn):
+        # The matrix file descriptor lives and dies with the thread's index connection
+        self._local.fd = os.open(self.matrix_path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def vectorize(self, feature_dicts):
+        """Base feature dicts -> float32 rows in this store's column order."""
+        out = np.zeros((len(feature_dicts), len(self.feature_names)), dtype=np.float64)
+        return fill_feature_matrix(feature_dicts, self.index, out).astype(DTYPE)
+
+    def put_many(self, addresses, feature_dicts, fingerprints=None):
+        """Write the vectors of `feature_dicts` for `addresses`, reusing each address's row."""
+        if not addresses:
+            return
+        rows = self.vectorize(feature_dicts)
+        fingerprints = fingerprints or [None] * len(addresses)
+        now = time.time()
+        conn = self._conn()
+        fd = self._local.fd
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            next_row = conn.execute('SELECT COALESCE(MAX(row) + 1, 0) FROM feature_index').fetchone()[0]
+            known = dict(select_in(conn, 'SELECT address, row FROM feature_index WHERE address IN ({placeholders})',
+                                   list(dict.fromkeys(addresses))))
+            index_rows = []
+            for address, vector, fingerprint in zip(addresses, rows, fingerprints):
+                row = known.get(address)
+                if row is None:
+                    row = known[address] = next_row
+                    next_row += 1
+                os.pwrite(fd, vector.tobytes(), row * self.row_bytes)
+                index_rows.append((address, row, fingerprint, now))
+            conn.executemany(
+                'INSERT INTO feature_index (address, row, fingerprint, updated_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(address) DO UPDATE SET fingerprint = excluded.fingerprint, '
+                'updated_at = excluded.updated_at',
+                index_rows
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def enqueue_many(self, addresses, feature_dicts, fingerprints=None):
+        """Queue put_many() for the writer thread; returns at once."""
+        fingerprints = fingerprints or [None] * len(addresses)
+        for item in zip(addresses, feature_dicts, fingerprints):
+            self._writes.submit(item)
+
+    def flush(self, timeout=None):
+        """Write the queued vectors now; True once none are pending."""
+        return self._writes.flush(timeout)
+
+    def _write(self, items):
+        # A later vector for the same address replaces an earlier one
+        latest = {address: (feature_dict, fingerprint) for address, feature_dict, fingerprint in items}
+        with stage_timer('feature_store'):
+            self.put_many(list(latest), [feature_dict for feature_dict, _ in latest.values()],
+                          [fingerprint for _, fingerprint in latest.values()])
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM feature_index').fetchone()[0]
+
+    def get(self, address):
+        """The stored vector for `address` as {feature name: value}, or None."""
+        found = self._conn().execute('SELECT row FROM feature_index WHERE address = ?', (address,)).fetchone()
+        if found is None:
+            return None
+        vector = self.matrix()[found[0]]
+        return dict(zip(self.feature_names, vector.tolist()))
+
+    def matrix(self):
+        """Read-only memory map over every written row."""
+        conn = self._conn()
+        n_rows = conn.execute('SELECT COALESCE(MAX(row) + 1, 0) FROM feature_index').fetchone()[0]
+        n_rows = min(n_rows, os.path.getsize(self.matrix_path) // self.row_bytes)
+        if n_rows == 0:
+            return np.zeros((0, len(self.feature_names)), dtype=DTYPE)
+        return np.memmap(self.matrix_path, dtype=DTYPE, mode='r', shape=(n_rows, len(self.feature_names)))
+
+    def iter_chunks(self, chunk_rows=65536):
+        """Yield (addresses, rows) per chunk; `rows` is a view into the memory map, not a copy."""
+        matrix = self.matrix()
+        conn = self._conn()
+        for start in range(0, len(matrix), chunk_rows):
+            stop = min(start + chunk_rows, len(matrix))
+            indexed = conn.execute(
+                'SELECT row, address FROM feature_index WHERE row >= ? AND row < ? ORDER BY row', (start, stop)
+            ).fetchall()
+            if not indexed:
+                continue
+            if len(indexed) == stop - start:
+                yield [address for _, address in indexed], matrix[start:stop]
+            else:
+                # Gaps left by rolled-back writes: only hand out indexed rows
+                rows = np.fromiter((row for row, _ in indexed), dtype=np.int64, count=len(indexed))
+                yield [address for _, address in indexed], matrix[rows]
+
+    def stats(self):
+        count, oldest, newest = self._conn().execute(
+            'SELECT COUNT(*), MIN(updated_at), MAX(updated_at) FROM feature_index'
+        ).fetchone()
+        return {
+            'path': self.path,
+            'rows': count,
+            'features': len(self.feature_names),
+            'bytes': os.path.getsize(self.matrix_path) if os.path.exists(self.matrix_path) else 0,
+            'oldest': oldest,
+            'newest': newest,
+        }
+
+
+def column_selector(store_names, model_names):
+    """Column indexes of `model_names` in the store, or None when the layouts already match."""
+    if list(store_names) == list(model_names):
+        return None
+    index = {name: i for i, name in enumerate(store_names)}
+    missing = [name for name in model_names if name not in index]
+    if missing:
+        logger.warning("[FEATURE STORE] Missing features (scored as 0): %s", missing)
+    # Missing columns point at an extra all-zero column appended per chunk
+    return np.array([index.get(name, len(store_names)) for name in model_names], dtype=np.int64), bool(missing)
+
+
+def make_chunk_scorer(snapshot, onnx_path=None, store_names=None):
+    """fn(float32 chunk) -> probabilities, using the bundle's scaler and its model or an ONNX graph."""
+    selector = column_selector(store_names or snapshot.feature_names, snapshot.feature_names)
+
+    def select(chunk):
+        if selector is None:
+            return chunk
+        columns, pad = selector
+        if pad:
+            chunk = np.hstack([chunk, np.zeros((len(chunk), 1), dtype=chunk.dtype)])
+        return chunk[:, columns]
+
+    if onnx_path:
+        from onnx_backend import scaler_params
+        import onnxruntime as ort
+
+        offset, divisor = scaler_params(snapshot.scaler, len(snapshot.feature_names))
+        session = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+        input_name = session.get_inputs()[0].name
+        outputs = [o.name for o in session.get_outputs()]
+        output_name = 'probabilities' if 'probabilities' in outputs else outputs[-1]
+
+        def score(chunk):
+            x = ((select(chunk) - offset) / divisor).astype(np.float32)
+            probabilities = session.run([output_name], {input_name: x})[0]
+            if isinstance(probabilities, list):
+                return np.array([p[1] for p in probabilities], dtype=np.float64)
+            return np.asarray(probabilities, dtype=np.float64)[:, 1]
+        return score
+
+    def score(chunk):
+        x = snapshot.scaler.transform(select(chunk))
+        return snapshot.model.predict_proba(x)[:, 1]
+    return score
+
+
+def rescore(store, snapshot, output, fmt='csv', onnx_path=None, chunk_rows=65536):
+    """Score every stored vector with `snapshot` (or `onnx_path`) and stream the results to `output`."""
+    from bulk_score import ResultWriter
+
+    score = make_chunk_scorer(snapshot, onnx_path, store.feature_names)
+    writer = ResultWriter(output, fmt, append=False)
+    total = flagged = 0
+    start = time.monotonic()
+    try:
+        for addresses, rows in store.iter_chunks(chunk_rows):
+            probabilities = score(rows)
+            flags = probabilities >= snapshot.threshold
+            writer.write(
+                {
+                    'address': address,
+                    'ransomware_probability': probability,
+                    'is_ransomware': flag,
+                    'threshold_used': snapshot.threshold,
+                    'model_version': snapshot.version,
+                }
+                for address, probability, flag in zip(addresses, probabilities.tolist(), flags.tolist())
+            )
+            total += len(addresses)
+            flagged += int(flags.sum())
+            print(f"[FEATURE STORE] Rescored {total} addresses ({flagged} flagged), "
+                  f"{total / max(time.monotonic() - start, 1e-9):.0f} addresses/s", file=sys.stderr)
+    finally:
+        writer.close()
+    return total, flagged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the feature store or rescore it with another model.")
+    parser.add_argument("--store", default=os.environ.get('FEATURE_STORE_DIR', 'feature_store'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help="Print row count and size.")
+    rescore_parser = commands.add_parser('rescore', help="Score every stored vector with a model bundle.")
+    rescore_parser.add_argument("--model", default=os.environ.get('MODEL_FILE', 'enhanced_ransomware_model_v3.joblib'),
+                                help="joblib bundle (model, scaler, feature_names, threshold).")
+    rescore_parser.add_argument("--onnx", help="Score with this ONNX graph instead of the bundle's model "
+                                               "(the bundle still provides the scaler and feature order).")
+    rescore_parser.add_argument("--output", "-o", help="Results file (.csv or .jsonl); stdout when omitted.")
+    rescore_parser.add_argument("--format", choices=['csv', 'jsonl'])
+    rescore_parser.add_argument("--chunk-rows", type=int, default=65536)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING').upper(), format='%(message)s')
+    store = FeatureStore(args.store)
+    if args.command == 'stats':
+        print(json.dumps(store.stats(), indent=2))
+        return 0
+
+    from model_registry import ModelRegistry
+
+    snapshot = ModelRegistry(args.model, poll_interval=0).load()
+    if snapshot is None:
+        return 1
+    fmt = args.format or ('csv' if args.output and args.output.endswith('.csv') else 'jsonl')
+    total, flagged = rescore(store, snapshot, args.output, fmt, args.onnx, args.chunk_rows)
+    print(f"[FEATURE STORE] Done: {total} addresses rescored with model {snapshot.version}, {flagged} flagged",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
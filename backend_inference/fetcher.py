@@ -0,0 +1,363 @@
+# --- fetcher.py (Pooled, rate-limited blockchain.info client) ---
+
+import asyncio
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import UPSTREAM_ERRORS, UPSTREAM_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class FetchError(requests.exceptions.RequestException):
+    """Upstream call failed after retries, or could not be scheduled in time."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket that hands out time slots instead of sleeping.
+
+    `reserve()` books the next free slot and returns how long the caller must wait
+    for it (0 while the bucket has tokens), so callers are queued fairly and only
+    the caller that actually exceeds the rate waits.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """Reserve one token. Returns the delay in seconds, or None if it exceeds `max_wait`."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            delay = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if max_wait is not None and delay > max_wait:
+                return None
+            # Tokens may go negative: that is the queue of callers already booked
+            self._tokens -= 1
+            return delay
+
+    def refund(self):
+        """Give back a token reserved by a caller that gave up before using its slot."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+    def share(self, n_processes):
+        """Scale this bucket down to 1/n of its rate, for one of n forked processes."""
+        with self._lock:
+            self.rate /= n_processes
+            self.capacity = max(1.0, self.capacity / n_processes)
+            self._tokens = min(self._tokens, self.capacity)
+
+
+def _backoff_delay(attempt, backoff, retry_after=None):
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+    return backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+
+class BlockchainFetcher:
+    """Shared blockchain.info client: one connection pool, one rate limiter, bounded concurrency."""
+
+    def __init__(self, base_url='https://blockchain.info', rate=0.1, burst=1, max_concurrency=4,
+                 timeout=45, retries=3, backoff=2.0, max_queue_wait=60.0):
+        self.base_url = base_url.rstrip('/')
+        self.limiter = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_queue_wait = max_queue_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        # requests.Session is not guaranteed thread-safe; the pool behind it is per-thread
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._local.session = session
+        return session
+
+    def address_url(self, address):
+        return f"{self.base_url}/rawaddr/{address}"
+
+    def _wait_for_slot(self, deadline):
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        max_wait = self.max_queue_wait if remaining is None else min(self.max_queue_wait, remaining)
+        delay = self.limiter.reserve(max_wait=max_wait)
+        if delay is None:
+            UPSTREAM_ERRORS.inc()
+            raise FetchError("Upstream rate limit: no request slot available in time")
+        if delay:
+            time.sleep(delay)
+
+    def get_json(self, url, params=None, deadline=None):
+        """GET `url` and decode JSON, retrying 429/5xx and connection errors with backoff."""
+        last_error = None
+        for attempt in range(self.retries + 1):
+            self._wait_for_slot(deadline)
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = min(timeout, max(0.1, deadline - time.monotonic()))
+            with self._semaphore:
+                try:
+                    response = self.session.get(url, params=params, timeout=timeout)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    UPSTREAM_REQUESTS.inc(outcome='connection_error')
+                    last_error, retry_after = e, None
+                else:
+                    UPSTREAM_REQUESTS.inc(outcome=f"{response.status_code // 100}xx")
+                    if response.status_code not in RETRY_STATUSES:
+                        if response.status_code >= 400:
+                            UPSTREAM_ERRORS.inc()
+                        response.raise_for_status()
+                        return response.json()
+                    last_error = FetchError(f"HTTP {response.status_code} from {url}")
+                    retry_after = response.headers.get('Retry-After')
+
+            if attempt == self.retries:
+                break
+            delay = _backoff_delay(attempt, self.backoff, retry_after)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                break
+            logger.warning("[FETCHER] Retrying in %.1fs after: %s", delay, last_error)
+            time.sleep(delay)
+        UPSTREAM_ERRORS.inc()
+        raise FetchError(f"Giving up on {url}: {last_error}")
+
+    def fetch_address(self, address, params=None, deadline=None):
+        return self.get_json(self.address_url(address), params=params, deadline=deadline)
+
+    def iter_address(self, address, page_size=50, max_txs=None, time_budget=None):
+        """Stream the full history of `address` page by page. See AddressHistory."""
+        return AddressHistory(self, address, page_size=page_size, max_txs=max_txs, time_budget=time_budget)
+
+
+class AddressHistory:
+    """Walks an address's rawaddr pages (newest first) and yields transactions one by one.
+
+    Only the current page is held in memory. Paging stops at `max_txs` or once
+    `time_budget` seconds have passed; `n_tx` is the total the API reports for the
+    address and `fetched` how many were yielded.
+    """
+
+    def __init__(self, fetcher, address, page_size=50, max_txs=None, time_budget=None):
+        self.fetcher = fetcher
+        self.address = address
+        self.page_size = page_size
+        self.max_txs = max_txs
+        self.time_budget = time_budget
+        self.n_tx = None
+        self.fetched = 0
+        self.pages = 0
+        self.truncated = False
+
+    def __iter__(self):
+        deadline = time.monotonic() + self.time_budget if self.time_budget else None
+        offset = 0
+        while True:
+            if self.max_txs is not None and self.fetched >= self.max_txs:
+                self.truncated = True
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                self.truncated = True
+                return
+
+            limit = self.page_size if self.max_txs is None else min(self.page_size, self.max_txs - self.fetched)
+            try:
+                data = self.fetcher.fetch_address(
+                    self.address, params={'limit': limit, 'offset': offset}, deadline=deadline
+                )
+            except requests.exceptions.RequestException:
+                if self.pages == 0:
+                    raise
+                # Out of time or upstream trouble mid-history: keep what we have
+                self.truncated = True
+                return
+
+            self.pages += 1
+            if self.n_tx is None:
+                self.n_tx = data.get('n_tx')
+            txs = data.get('txs') or []
+            for tx in txs:
+                self.fetched += 1
+                yield tx
+
+            offset += len(txs)
+            if len(txs) < limit or (self.n_tx is not None and offset >= self.n_tx):
+                return
+
+
+class AsyncBlockchainFetcher:
+    """asyncio variant for batch paths. Shares the token bucket of a BlockchainFetcher.
+
+    fetch_addresses_sync() runs on one event loop thread per process, which keeps
+    a single aiohttp session, and so its pooled connections, across batches.
+    aiohttp is imported on first use: the single-address API path never needs it.
+    """
+
+    # How often a task waiting for a free upstream slot checks again
+    SLOT_POLL_INTERVAL = 0.01
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+        self._loop = None
+        self._pid = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            # A forked child inherits the loop but not its thread: start its own
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='async-fetcher', daemon=True).start()
+                if self._pid is None:
+                    atexit.register(self.close)
+                self._loop, self._pid, self._session = loop, os.getpid(), None
+            return self._loop
+
+    def _new_session(self):
+        import aiohttp
+
+        return aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=self.fetcher.timeout),
+            connector=aiohttp.TCPConnector(limit=self.fetcher.max_concurrency),
+        )
+
+    async def _shared_session(self):
+        # Only ever called on the loop thread, so it needs no lock
+        if self._session is None or self._session.closed:
+            self._session = self._new_session()
+        return self._session
+
+    def close(self, timeout=5.0):
+        """Close the shared session and stop this process's loop thread."""
+        with self._lock:
+            loop = self._loop if self._pid == os.getpid() else None
+            self._loop = None
+        if loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result(timeout)
+            self._session = None
+        loop.call_soon_threadsafe(loop.stop)
+
+    async def _acquire_slot(self):
+        """Take one of the fetcher's `max_concurrency` slots without blocking the event loop.
+
+        The slots are the same threading semaphore the synchronous client uses, so
+        every batch, in every thread's event loop, shares one per-process limit.
+        Polling (rather than acquiring in an executor) keeps cancellation from
+        leaking a slot.
+        """
+        semaphore = self.fetcher._semaphore
+        while not semaphore.acquire(blocking=False):
+            await asyncio.sleep(self.SLOT_POLL_INTERVAL)
+
+    async def _get_json(self, session, url, params=None, deadline=None):
+        import aiohttp
+
+        fetcher = self.fetcher
+        last_error = None
+        for attempt in range(fetcher.retries + 1):
+            max_wait = fetcher.max_queue_wait
+            if deadline is not None:
+                max_wait = min(max_wait, max(0.0, deadline - time.monotonic()))
+            delay = fetcher.limiter.reserve(max_wait=max_wait)
+            if delay is None:
+                UPSTREAM_ERRORS.inc()
+                raise FetchError("Upstream rate limit: no request slot available in time")
+            try:
+                if delay:
+                    await asyncio.sleep(delay)
+                await self._acquire_slot()
+            except asyncio.CancelledError:
+                # Cancelled at the deadline before sending: the reserved token goes back
+                fetcher.limiter.refund()
+                raise
+            retry_after = None
+            try:
+                async with session.get(url, params=params) as response:
+                    UPSTREAM_REQUESTS.inc(outcome=f"{response.status // 100}xx")
+                    if response.status not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+                    last_error = FetchError(f"HTTP {response.status} from {url}")
+                    retry_after = response.headers.get('Retry-After')
+            except aiohttp.ClientResponseError as e:
+                UPSTREAM_ERRORS.inc()
+                raise FetchError(f"HTTP {e.status} from {url}") from e
+            except ValueError as e:
+                # A 200 with a body that isn't JSON (maintenance pages, truncated responses)
+                UPSTREAM_ERRORS.inc()
+                raise FetchError(f"Invalid JSON from {url}: {e}") from e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                UPSTREAM_REQUESTS.inc(outcome='connection_error')
+                last_error = e
+            finally:
+                self.fetcher._semaphore.release()
+            if attempt == fetcher.retries:
+                break
+            delay = _backoff_delay(attempt, fetcher.backoff, retry_after)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                break
+            await asyncio.sleep(delay)
+        UPSTREAM_ERRORS.inc()
+        raise FetchError(f"Giving up on {url}: {last_error}")
+
+    async def fetch_addresses(self, addresses, deadline=None):
+        """Fetch many addresses concurrently. Returns {address: data or FetchError}.
+
+        Fetches still running at the monotonic `deadline` are cancelled and reported
+        as FetchError; the ones already done are kept. A failure never affects the
+        other addresses. On another event loop than the fetcher's own, the batch
+        gets a session of its own.
+        """
+        if asyncio.get_running_loop() is self._loop:
+            return await self._fetch_all(await self._shared_session(), addresses, deadline)
+        async with self._new_session() as session:
+            return await self._fetch_all(session, addresses, deadline)
+
+    async def _fetch_all(self, session, addresses, deadline):
+        async def one(address):
+            request = self._get_json(session, self.fetcher.address_url(address), deadline=deadline)
+            try:
+                if deadline is None:
+                    return address, await request
+                return address, await asyncio.wait_for(request, max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                UPSTREAM_ERRORS.inc()
+                return address, FetchError(f"Deadline passed while fetching {address}")
+            except FetchError as e:
+                return address, e
+        return dict(await asyncio.gather(*(one(address) for address in addresses)))
+
+    def fetch_addresses_sync(self, addresses, deadline=None):
+        """fetch_addresses() on this process's loop thread, from any thread; blocks until done."""
+        return asyncio.run_coroutine_threadsafe(self.fetch_addresses(addresses, deadline), self._ensure_loop()).result()
@@ -0,0 +1,72 @@
+# --- gunicorn.conf.py (Production serving: preforked workers sharing a preloaded model) ---
+#
+# Run with: gunicorn -c gunicorn.conf.py main:app
+#
+# The app is imported once in the master, which also runs the warm-up (model,
+# pandas/xgboost or onnxruntime, one throwaway prediction); workers are then
+# forked from it and share those pages copy-on-write.
+
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+
+# Must cover a queued upstream fetch (UPSTREAM_MAX_QUEUE_WAIT + UPSTREAM_TIMEOUT)
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+# Worker recycling: restart each worker after this many requests (jittered so
+# they don't all restart at once)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+preload_app = True
+# Warm up in the master before forking: a background warm-up thread would not
+# survive the fork and every worker would start cold
+os.environ['WARMUP'] = 'eager'
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def on_starting(server):
+    # Metrics from a previous run of the service must not be summed into this one
+    metrics_dir = os.environ.get('METRICS_MULTIPROC_DIR')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            os.remove(os.path.join(metrics_dir, name))
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far into the permanent generation so the GC never
+    # touches (and so never copies) the preloaded model pages in the workers
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from metrics import registry as metrics_registry
+    from xgverifyv3 import fetcher, model_registry
+
+    # The master's warm-up observations are reported from its own metrics file;
+    # without this every worker would report them again
+    metrics_registry.reset()
+    # Threads don't survive fork: restart the model file watcher in this worker
+    model_registry.start()
+    # Each worker gets its share of the upstream rate limit so the total stays the same
+    fetcher.limiter.share(server.cfg.workers)
+    server.log.info(f"Worker {worker.pid} ready with model version {model_registry.status()['model_version']}")
+
+
+def worker_exit(server, worker):
+    from metrics import registry as metrics_registry
+    from xgverifyv3 import flush_background_writes
+
+    # Write the last updates before the worker goes: its file outlives it and
+    # the flusher thread may not have run since the final request
+    metrics_registry.flush()
+    # Likewise the graph updates still queued for the background writer
+    flush_background_writes(timeout=graceful_timeout / 2)
@@ -1,9 +1,63 @@
-from flask import Flask, request, jsonify
-from xgverifyv3 import predict_ransomware
+from flask import Flask, Response, request, jsonify
+from xgverifyv3 import predict_ransomware, predict_ransomware_batch, model_registry, result_cache, warmup
+from metrics import registry as metrics_registry, stage_timer
+from scheduler import AdmissionGate, DeadlineExceeded, Overloaded
+from singleflight import SingleFlightTimeout
+import logging
+import os
+import threading
+import time
 import traceback
 
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s'
+)
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', '500'))
+# Predictions running at once in this process; more get 429 + Retry-After (0: no limit)
+MAX_PENDING_REQUESTS = int(os.environ.get('MAX_PENDING_REQUESTS', '64'))
+# Seconds a prediction may take, upstream fetches included; a request's "timeout" can only shorten it
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', '60'))
+# 'eager': load the model and its libraries before serving; 'background': serve at
+# once (e.g. health checks) and report not ready on /ready until warm
+WARMUP = os.environ.get('WARMUP', 'eager').lower()
+
+warm = threading.Event()  # set once the warm-up phase is over, successful or not
+
+def warm_up():
+    """Load the model, run one throwaway prediction, then start watching the model file."""
+    try:
+        warmup()
+    except Exception:
+        logger.exception("[API] Warm-up failed")
+    # The registry hot-reloads the model when the file changes
+    model_registry.start()
+    warm.set()
+
+if WARMUP == 'background':
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+else:
+    warm_up()
+
+admission = AdmissionGate(MAX_PENDING_REQUESTS)
+
+def request_deadline(data):
+    """Monotonic deadline for this request: REQUEST_DEADLINE, or the shorter "timeout" it asks for."""
+    timeout = REQUEST_DEADLINE
+    requested = data.get('timeout')
+    if isinstance(requested, (int, float)) and not isinstance(requested, bool) and requested > 0:
+        timeout = min(timeout, float(requested))
+    return time.monotonic() + timeout
+
+def overloaded_response(e):
+    response = jsonify({'error': str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
 @app.route('/predict', methods=['POST'])
 def predict():
     data = request.get_json()
@@ -11,23 +65,81 @@ def predict():
         return jsonify({'error': 'Please provide a Bitcoin address in the JSON payload'}), 400
 
     address = data['address']
-    print(f"[API] Received address for prediction: {address}")
+    logger.debug("[API] Received address for prediction: %s", address)
+    deadline = request_deadline(data)
+    # The shared work runs to the server's deadline: another request for the same
+    # address may be waiting on it with more time than this one asked for
+    run_deadline = time.monotonic() + REQUEST_DEADLINE
 
     try:
-        result = predict_ransomware(address)
+        # Optional per-request override of STREAMING_INGEST (read the full paginated history)
+        with admission.enter(), stage_timer('request'):
+            result = predict_ransomware(address, streaming=data.get('streaming'), deadline=deadline,
+                                        run_deadline=run_deadline)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except (SingleFlightTimeout, DeadlineExceeded) as e:
+        return jsonify({'error': str(e)}), 504
     except Exception as e:
-        print("[API ERROR] Exception during prediction:")
-        traceback.print_exc()  # Cetak traceback ke terminal/log
+        logger.exception("[API] Exception during prediction")
         return jsonify({'error': str(e), 'trace': traceback.format_exc()}), 500
 
     if result is None:
+        if time.monotonic() >= deadline:
+            return jsonify({'error': 'Deadline passed before the address could be analyzed'}), 504
         return jsonify({'error': 'Failed to analyze the address or fetch data'}), 500
 
     return jsonify(result)
 
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    data = request.get_json()
+    if not data or not isinstance(data.get('addresses'), list) or not data['addresses']:
+        return jsonify({'error': 'Please provide a non-empty list of Bitcoin addresses in "addresses"'}), 400
+
+    addresses = data['addresses']
+    if not all(isinstance(address, str) and address for address in addresses):
+        return jsonify({'error': 'Every entry in "addresses" must be a non-empty string'}), 400
+    if len(addresses) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} addresses per batch'}), 400
+
+    logger.debug("[API] Received batch of %d addresses for prediction", len(addresses))
+
+    try:
+        with admission.enter(), stage_timer('batch_request'):
+            results = predict_ransomware_batch(addresses, deadline=request_deadline(data))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.exception("[API] Exception during batch prediction")
+        return jsonify({'error': str(e), 'trace': traceback.format_exc()}), 500
+
+    if results is None:
+        return jsonify({'error': 'Model is not available'}), 500
+
+    return jsonify({'results': results})
+
+@app.route('/predict/cache', methods=['DELETE'])
+@app.route('/predict/cache/<address>', methods=['DELETE'])
+def invalidate_prediction_cache(address=None):
+    removed = result_cache.invalidate(address)
+    return jsonify({'invalidated': removed, 'address': address})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    status = model_registry.status()
+    status['warm'] = warm.is_set()
+    status['ready'] = status['ready'] and status['warm']
+    return jsonify(status), (200 if status['ready'] else 503)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain', content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/', methods=['GET'])
 def home():
     return "🚀 Ransomware Detection API is running!", 200
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8000, debug=True)
+    # Development server only; production runs `gunicorn -c gunicorn.conf.py main:app`
+    app.run(host='0.0.0.0', port=8000, debug=os.environ.get('FLASK_DEBUG') == '1')
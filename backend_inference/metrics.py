@@ -0,0 +1,246 @@
+# --- metrics.py (Counters, histograms and stage timers in Prometheus text format) ---
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class Counter:
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry.changed()
+
+
+class Histogram:
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label key -> [count per bucket..., +Inf count, sum]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.registry.lock:
+            row = self.values.get(key)
+            if row is None:
+                row = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[len(self.buckets)] += 1
+            row[-1] += value
+        self.registry.changed()
+
+
+class MetricsRegistry:
+    """Process-local metrics, optionally aggregated across worker processes.
+
+    With `multiproc_dir`, a background thread in every process writes its values
+    to `<dir>/<pid>.json` within `flush_interval` of any change, and `render()`
+    sums all files, so any gunicorn worker can answer a scrape for the whole
+    service.
+    """
+
+    def __init__(self, multiproc_dir=None, flush_interval=1.0):
+        self.multiproc_dir = multiproc_dir
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self._dirty = False
+        self._flusher_lock = threading.Lock()
+        self._flusher_pid = None
+        if multiproc_dir:
+            os.makedirs(multiproc_dir, exist_ok=True)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.metrics.setdefault(name, Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(self, name, documentation, labelnames, buckets))
+
+    @contextmanager
+    def timer(self, histogram, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - start, **labels)
+
+    def _snapshot(self):
+        with self.lock:
+            return {
+                name: [[list(key), value] for key, value in metric.values.items()]
+                for name, metric in self.metrics.items()
+            }
+
+    def reset(self):
+        """Zero every metric, e.g. in a freshly forked worker that must not re-report its parent's values.
+
+        Only call this right after a fork: the lock is replaced because the parent
+        may have forked while one of its threads held it.
+        """
+        self.lock = threading.Lock()
+        self._flusher_lock = threading.Lock()
+        for metric in self.metrics.values():
+            metric.values = {}
+        self._dirty = False
+        self._flusher_pid = None
+
+    def changed(self):
+        """Called after every update: the flusher thread writes it out within `flush_interval`."""
+        if not self.multiproc_dir:
+            return
+        self._dirty = True
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+    def _start_flusher(self):
+        with self._flusher_lock:
+            # Threads don't survive fork: each process starts its own
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name='metrics-flusher', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+    def flush(self):
+        """Write this process's values to its file now (at scrape time and on worker exit)."""
+        if not self.multiproc_dir:
+            return
+        # Cleared before the snapshot so an update racing with it is written next time
+        self._dirty = False
+        path = os.path.join(self.multiproc_dir, f"{os.getpid()}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _collect(self):
+        """{name: {label key: value}} summed over this process (and the others, if shared)."""
+        if not self.multiproc_dir:
+            with self.lock:
+                return {name: {key: (list(v) if isinstance(v, list) else v) for key, v in metric.values.items()}
+                        for name, metric in self.metrics.items()}
+
+        self.flush()
+        totals = {name: {} for name in self.metrics}
+        for filename in os.listdir(self.multiproc_dir):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.multiproc_dir, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, entries in snapshot.items():
+                if name not in totals:
+                    continue
+                for key, value in entries:
+                    key = tuple(key)
+                    current = totals[name].get(key)
+                    if current is None:
+                        totals[name][key] = value
+                    elif isinstance(value, list):
+                        totals[name][key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        totals[name][key] = current + value
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        values = self._collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            if isinstance(metric, Histogram):
+                lines.append(f"# TYPE {name} histogram")
+                for key, row in sorted(values.get(name, {}).items()):
+                    for bound, count in zip(metric.buckets, row):
+                        lines.append(f"{name}_bucket{_format_labels(metric.labelnames, key, [('le', bound)])} {count}")
+                    cumulative = row[len(metric.buckets)]
+                    lines.append(f"{name}_bucket{_format_labels(metric.labelnames, key, [('le', '+Inf')])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(metric.labelnames, key)} {row[-1]}")
+                    lines.append(f"{name}_count{_format_labels(metric.labelnames, key)} {cumulative}")
+            else:
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(values.get(name, {}).items()):
+                    lines.append(f"{name}{_format_labels(metric.labelnames, key)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry(multiproc_dir=os.environ.get('METRICS_MULTIPROC_DIR') or None)
+
+STAGE_SECONDS = registry.histogram(
+    'ransomware_stage_seconds', 'Time spent in each inference pipeline stage.', ['stage']
+)
+CACHE_REQUESTS = registry.counter(
+    'ransomware_cache_requests_total', 'Cache lookups by cache and outcome.', ['cache', 'outcome']
+)
+UPSTREAM_REQUESTS = registry.counter(
+    'ransomware_upstream_requests_total', 'Upstream blockchain API calls by outcome.', ['outcome']
+)
+UPSTREAM_ERRORS = registry.counter(
+    'ransomware_upstream_errors_total', 'Upstream blockchain API failures after retries.'
+)
+PREDICTIONS = registry.counter(
+    'ransomware_predictions_total', 'Predictions served by outcome.', ['outcome']
+)
+TRANSACTIONS_PER_ADDRESS = registry.histogram(
+    'ransomware_transactions_per_address', 'Transactions analyzed per scored address.',
+    buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 1000000)
+)
+INFERENCE_BATCH_SIZE = registry.histogram(
+    'ransomware_inference_batch_size', 'Predictions scored per micro-batch.',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+SCHEDULER_REJECTIONS = registry.counter(
+    'ransomware_scheduler_rejections_total', 'Requests turned away by the scheduler, by reason.', ['reason']
+)
+BACKGROUND_WRITES_DROPPED = registry.counter(
+    'ransomware_background_writes_dropped_total', 'Queued store writes dropped (queue full or write failed).',
+    ['queue']
+)
+
+
+def stage_timer(stage):
+    """`with stage_timer('scaling'): ...` records the block's duration for that stage."""
+    return registry.timer(STAGE_SECONDS, stage=stage)
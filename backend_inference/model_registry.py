@@ -0,0 +1,148 @@
+# --- model_registry.py (Process-wide model holder with hot reload) ---
+
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+ModelSnapshot = namedtuple(
+    'ModelSnapshot',
+    ['model', 'scaler', 'feature_names', 'threshold', 'version', 'path', 'loaded_at']
+)
+
+
+class ModelRegistry:
+    """Loads the model bundle once and swaps in new versions when the file changes.
+
+    Readers call `get()` and keep the returned snapshot for the whole request, so a
+    reload never changes the model underneath an in-flight prediction. Files in
+    `companion_paths` (the ONNX export) are part of the version and are watched
+    too, so replacing only one of them publishes a new version.
+    """
+
+    def __init__(self, path, poll_interval=5.0, companion_paths=()):
+        self.path = path
+        self.companion_paths = [p for p in companion_paths if p]
+        self.poll_interval = poll_interval
+        self._snapshot = None
+        self._file_stat = None
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        self.last_error = None
+
+    def get(self):
+        """Return the current snapshot, or None if no model has been loaded yet."""
+        return self._snapshot
+
+    def is_ready(self):
+        return self._snapshot is not None
+
+    def _stat(self):
+        st = os.stat(self.path)
+        stats = [(st.st_mtime_ns, st.st_size)]
+        for path in self.companion_paths:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                stats.append(None)
+            else:
+                stats.append((st.st_mtime_ns, st.st_size))
+        return tuple(stats)
+
+    def _version(self, raw):
+        digest = hashlib.sha256(raw)
+        for path in self.companion_paths:
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+        return digest.hexdigest()[:12]
+
+    def load(self, force=False):
+        """Load the model file and atomically publish it if its content changed."""
+        with self._load_lock:
+            if not os.path.exists(self.path):
+                self.last_error = f"Model file not found: {self.path}"
+                logger.error("[REGISTRY] %s", self.last_error)
+                return self._snapshot
+
+            file_stat = self._stat()
+            if not force and self._snapshot is not None and file_stat == self._file_stat:
+                return self._snapshot
+
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+            version = self._version(raw)
+            self._file_stat = file_stat
+
+            if not force and self._snapshot is not None and version == self._snapshot.version:
+                return self._snapshot
+
+            try:
+                # joblib (and the model's own libraries, pulled in by unpickling) load on first use
+                import joblib
+
+                model_data = joblib.load(io.BytesIO(raw))
+                snapshot = ModelSnapshot(
+                    model=model_data['model'],
+                    scaler=model_data['scaler'],
+                    feature_names=list(model_data['feature_names']),
+                    threshold=float(model_data['threshold']),
+                    version=version,
+                    path=self.path,
+                    loaded_at=time.time(),
+                )
+            except Exception as e:
+                # Keep serving the previous version if the new file is broken or half-written
+                self.last_error = f"Failed to load {self.path}: {e}"
+                logger.error("[REGISTRY] %s", self.last_error)
+                return self._snapshot
+
+            previous = self._snapshot
+            self._snapshot = snapshot
+            self.last_error = None
+            if previous is None:
+                logger.info("[REGISTRY] Loaded model version %s (%d features)", version, len(snapshot.feature_names))
+            else:
+                logger.info("[REGISTRY] Reloaded model: %s -> %s", previous.version, version)
+            return snapshot
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if os.path.exists(self.path) and self._stat() != self._file_stat:
+                    self.load()
+            except OSError as e:
+                logger.warning("[REGISTRY] Could not stat %s: %s", self.path, e)
+
+    def start(self):
+        """Load the model now and start watching the file for changes."""
+        self.load()
+        if self.poll_interval > 0 and (self._watcher is None or not self._watcher.is_alive()):
+            self._stop.clear()
+            self._watcher = threading.Thread(target=self._watch, name='model-registry-watcher', daemon=True)
+            self._watcher.start()
+        return self._snapshot
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=self.poll_interval + 1)
+            self._watcher = None
+
+    def status(self):
+        snapshot = self._snapshot
+        return {
+            'ready': snapshot is not None,
+            'model_version': snapshot.version if snapshot else None,
+            'model_path': self.path,
+            'companion_paths': self.companion_paths,
+            'loaded_at': snapshot.loaded_at if snapshot else None,
+            'feature_count': len(snapshot.feature_names) if snapshot else 0,
+            'error': self.last_error,
+        }
@@ -0,0 +1,81 @@
+# --- onnx_backend.py (Lean onnxruntime inference path, no pandas) ---
+
+import threading
+
+import numpy as np
+import onnxruntime as ort
+
+from feature_engine import fill_feature_matrix
+
+
+def scaler_params(scaler, n_features):
+    """(offset, divisor) such that scaler.transform(x) == (x - offset) / divisor."""
+    offset, divisor = None, None
+    if hasattr(scaler, 'mean_'):
+        # StandardScaler
+        offset = scaler.mean_ if getattr(scaler, 'with_mean', True) else None
+        divisor = scaler.scale_ if getattr(scaler, 'with_std', True) else None
+    elif hasattr(scaler, 'center_'):
+        # RobustScaler
+        offset = scaler.center_ if getattr(scaler, 'with_centering', True) else None
+        divisor = scaler.scale_ if getattr(scaler, 'with_scaling', True) else None
+    else:
+        raise ValueError(f"Unsupported scaler for the ONNX backend: {type(scaler).__name__}")
+    offset = np.zeros(n_features) if offset is None else np.asarray(offset, dtype=np.float64)
+    divisor = np.ones(n_features) if divisor is None else np.asarray(divisor, dtype=np.float64)
+    return offset, divisor
+
+
+class OnnxScorer:
+    """Scores feature dicts with an onnxruntime session created once per model version.
+
+    Feature vectors are assembled in the fixed training `feature_names` order into
+    preallocated per-thread buffers; scaling uses the training scaler's parameters.
+    """
+
+    def __init__(self, onnx_path, scaler, feature_names, version=None):
+        self.onnx_path = onnx_path
+        self.version = version
+        self.feature_names = list(feature_names)
+        self.index = {name: i for i, name in enumerate(self.feature_names)}
+        self.offset, self.divisor = scaler_params(scaler, len(self.feature_names))
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = 1
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        expected = model_input.shape[-1]
+        if isinstance(expected, int) and expected != len(self.feature_names):
+            raise ValueError(f"{onnx_path} expects {expected} features, model bundle has {len(self.feature_names)}")
+        self.output_name = 'probabilities' if 'probabilities' in [o.name for o in self.session.get_outputs()] \
+            else self.session.get_outputs()[-1].name
+        self._local = threading.local()
+
+    def _buffers(self, n_rows):
+        raw = getattr(self._local, 'raw', None)
+        if raw is None or raw.shape[0] < n_rows:
+            self._local.raw = raw = np.zeros((max(1, n_rows), len(self.feature_names)), dtype=np.float64)
+            self._local.x = np.zeros(raw.shape, dtype=np.float32)
+        return raw[:n_rows], self._local.x[:n_rows]
+
+    def vectorize(self, feature_dicts):
+        """Base + enhanced features, aligned and scaled, as a float32 matrix (a view of a reused buffer)."""
+        raw, x = self._buffers(len(feature_dicts))
+        fill_feature_matrix(feature_dicts, self.index, raw)
+        np.subtract(raw, self.offset, out=raw)
+        np.divide(raw, self.divisor, out=raw)
+        x[...] = raw
+        return x
+
+    def predict_proba(self, feature_dicts):
+        """Probability of being illicit for each feature dict, in input order."""
+        return self.run(self.vectorize(feature_dicts))
+
+    def run(self, x):
+        """Probabilities for an already scaled float32 matrix from `vectorize()`."""
+        probabilities = self.session.run([self.output_name], {self.input_name: x})[0]
+        if isinstance(probabilities, list):
+            # ZipMap output: one {label: probability} dict per row
+            return np.array([p[1] for p in probabilities], dtype=np.float64)
+        return np.asarray(probabilities, dtype=np.float64)[:, 1]
@@ -0,0 +1,190 @@
+# --- result_cache.py (Prediction result cache) ---
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from feature_engine import TxColumns
+from storage import LocalConnection
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    address       TEXT NOT NULL,
+    fingerprint   TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    payload       TEXT NOT NULL,
+    created_at    REAL NOT NULL,
+    PRIMARY KEY (address, fingerprint, model_version)
+);
+CREATE INDEX IF NOT EXISTS result_cache_created_at ON result_cache (created_at);
+"""
+
+# When each address ('' for all of them) was last invalidated, for every process
+INVALIDATIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_invalidations (
+    address        TEXT PRIMARY KEY,
+    invalidated_at REAL NOT NULL
+);
+"""
+
+# The persistent tier is pruned (expired rows, then the oldest beyond its cap) at
+# most this often per process, from put()
+PRUNE_INTERVAL = 60.0
+
+
+def transaction_fingerprint(transactions):
+    """Cheap identity of a transaction set: its size plus the newest transaction hash."""
+    if not len(transactions):
+        return '0:'
+    if isinstance(transactions, TxColumns):
+        newest = np.flatnonzero(transactions.times == transactions.times.max()).tolist()
+        return f"{len(transactions)}:{max(transactions.hashes[i] or '' for i in newest)}"
+    latest = max(transactions, key=lambda tx: (tx.get('time') or 0, tx.get('hash') or ''))
+    return f"{len(transactions)}:{latest.get('hash') or ''}"
+
+
+class ResultCache:
+    """Bounded in-memory LRU of prediction results, with an optional SQLite tier.
+
+    Keys are (address, transaction fingerprint, model version), so new transactions
+    or a model reload naturally miss. Entries also expire after `ttl` seconds. The
+    SQLite tier keeps at most `max_persistent_entries` rows: writes prune expired
+    and then the oldest rows every PRUNE_INTERVAL seconds, so it can only run over
+    its cap by what is written in between.
+
+    invalidate() also records its time in the SQLite database at `invalidation_path`
+    (default: the persistent tier's), which every process sharing it checks before
+    serving an in-memory entry, so it clears the results of all workers.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300, persistent_path=None, max_persistent_entries=100000,
+                 invalidation_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent_path = persistent_path
+        self.max_persistent_entries = max_persistent_entries
+        self.invalidation_path = invalidation_path or persistent_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = LocalConnection(persistent_path, SCHEMA)
+        self._invalidations = LocalConnection(self.invalidation_path, INVALIDATIONS_SCHEMA)
+        self._next_prune = 0.0
+
+    def _expired(self, created_at, now):
+        return bool(self.ttl) and now - created_at > self.ttl
+
+    def get(self, address, fingerprint, model_version):
+        key = (address, fingerprint, model_version)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            created_at, result = entry
+            # Outside the lock: this may read another process's invalidation from SQLite
+            if not self._expired(created_at, now) and created_at > self._invalidated_at(address):
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                return dict(result)
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+
+        if not self.persistent_path:
+            return None
+        row = self._conn().execute(
+            'SELECT payload, created_at FROM result_cache WHERE address = ? AND fingerprint = ? AND model_version = ?',
+            key
+        ).fetchone()
+        if row is None or self._expired(row[1], now):
+            return None
+        result = json.loads(row[0])
+        self._remember(key, row[1], result)
+        return dict(result)
+
+    def _invalidated_at(self, address):
+        """When any process last invalidated `address` (or everything); 0 if never."""
+        if not self.invalidation_path:
+            return 0.0
+        row = self._invalidations().execute(
+            "SELECT MAX(invalidated_at) FROM result_invalidations WHERE address IN ('', ?)", (address,)
+        ).fetchone()
+        return row[0] or 0.0
+
+    def _remember(self, key, created_at, result):
+        with self._lock:
+            self._entries[key] = (created_at, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, address, fingerprint, model_version, result):
+        key = (address, fingerprint, model_version)
+        now = time.time()
+        result = dict(result)
+        self._remember(key, now, result)
+        if self.persistent_path:
+            self._conn().execute(
+                'INSERT OR REPLACE INTO result_cache (address, fingerprint, model_version, payload, created_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (address, fingerprint, model_version, json.dumps(result), now)
+            )
+            if time.monotonic() >= self._next_prune:
+                self._next_prune = time.monotonic() + PRUNE_INTERVAL
+                self.prune()
+
+    def prune(self):
+        """Delete expired rows of the persistent tier, then the oldest beyond its cap. Returns the number removed."""
+        if not self.persistent_path:
+            return 0
+        conn = self._conn()
+        removed = 0
+        if self.ttl:
+            removed += conn.execute('DELETE FROM result_cache WHERE created_at < ?', (time.time() - self.ttl,)).rowcount
+        if self.max_persistent_entries:
+            removed += conn.execute(
+                'DELETE FROM result_cache WHERE rowid IN ('
+                'SELECT rowid FROM result_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_persistent_entries,)
+            ).rowcount
+        return removed
+
+    def invalidate(self, address=None):
+        """Drop cached results for one address, or everything, in every process.
+
+        Returns the number removed here; other processes drop theirs as they look them up.
+        """
+        if self.invalidation_path:
+            now = time.time()
+            conn = self._invalidations()
+            conn.execute('INSERT OR REPLACE INTO result_invalidations (address, invalidated_at) VALUES (?, ?)',
+                         (address or '', now))
+            if self.ttl:
+                # Entries that old have expired anyway
+                conn.execute('DELETE FROM result_invalidations WHERE invalidated_at < ?', (now - self.ttl,))
+        with self._lock:
+            if address is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [key for key in self._entries if key[0] == address]
+                for key in keys:
+                    del self._entries[key]
+                removed = len(keys)
+        if self.persistent_path:
+            # The persistent tier is a superset of the in-memory one
+            if address is None:
+                removed = max(removed, self._conn().execute('DELETE FROM result_cache').rowcount)
+            else:
+                removed = max(removed, self._conn().execute(
+                    'DELETE FROM result_cache WHERE address = ?', (address,)
+                ).rowcount)
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries, 'ttl': self.ttl,
+                    'max_persistent_entries': self.max_persistent_entries if self.persistent_path else None}
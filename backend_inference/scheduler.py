@@ -0,0 +1,195 @@
+# --- scheduler.py (Micro-batching of concurrent predictions, admission control and deadlines) ---
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import INFERENCE_BATCH_SIZE, SCHEDULER_REJECTIONS, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Too much work is already queued; the caller should retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before its work was done."""
+
+
+def remaining(deadline):
+    """Seconds left until the monotonic `deadline` (None: no deadline)."""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class AdmissionGate:
+    """Bounds how many requests run the pipeline at once in this process.
+
+    `enter()` fails fast with Overloaded instead of letting requests pile up behind
+    slow upstream fetches. The Retry-After hint is the recent average time a request
+    spends inside the gate.
+    """
+
+    def __init__(self, max_pending, smoothing=0.2):
+        self.max_pending = max_pending
+        self.smoothing = smoothing
+        self.pending = 0
+        self._average = None
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        return max(1, math.ceil(self._average or 1))
+
+    def enter(self):
+        with self._lock:
+            if self.max_pending and self.pending >= self.max_pending:
+                SCHEDULER_REJECTIONS.inc(reason='queue_full')
+                raise Overloaded(f"Server busy: {self.pending} requests in progress", self.retry_after())
+            self.pending += 1
+        return _Admission(self, time.monotonic())
+
+    def _leave(self, elapsed):
+        with self._lock:
+            self.pending -= 1
+            if self._average is None:
+                self._average = elapsed
+            else:
+                self._average += self.smoothing * (elapsed - self._average)
+
+
+class _Admission:
+    def __init__(self, gate, started):
+        self.gate = gate
+        self.started = started
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.gate._leave(time.monotonic() - self.started)
+        return False
+
+
+class _Pending:
+    __slots__ = ('item', 'deadline', 'enqueued', 'done', 'result', 'error', 'cancelled')
+
+    def __init__(self, item, deadline):
+        self.item = item
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancelled = False
+
+
+class MicroBatcher:
+    """Collects items submitted concurrently from request threads into batches.
+
+    A worker thread takes the oldest waiting item, keeps collecting until it has
+    `max_batch_size` items or the oldest has waited `max_wait` seconds, and makes
+    one `batch_fn(items)` call, which must return one result per item. The queue
+    holds at most `max_queue` items; `submit()` raises Overloaded beyond that and
+    DeadlineExceeded when its deadline passes first (the item is then skipped).
+    With `max_batch_size` <= 1 items are scored inline on the caller's thread.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=32, max_wait=0.005, max_queue=1024, name='micro-batcher'):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.name = name
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        # Threads don't survive fork: each worker process starts its own
+        if self._pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = deque()
+                self._cond = threading.Condition()
+                self._pid = os.getpid()
+                self._worker = None
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+
+    def submit(self, item, deadline=None):
+        """Queue `item` and block until its batch has been scored; returns its result."""
+        if self.max_batch_size <= 1:
+            return self.batch_fn([item])[0]
+
+        pending = _Pending(item, deadline)
+        self._ensure_worker()
+        with self._cond:
+            if self.max_queue and len(self._queue) >= self.max_queue:
+                SCHEDULER_REJECTIONS.inc(reason='queue_full')
+                raise Overloaded(f"Inference queue is full ({len(self._queue)} waiting)",
+                                 max(1, math.ceil(self.max_wait * len(self._queue) / self.max_batch_size)))
+            self._queue.append(pending)
+            self._cond.notify()
+
+        if not pending.done.wait(None if deadline is None else max(0.0, remaining(deadline))):
+            pending.cancelled = True
+            SCHEDULER_REJECTIONS.inc(reason='deadline')
+            raise DeadlineExceeded("Deadline passed while waiting for inference")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            flush_at = self._queue[0].enqueued + self.max_wait
+            while len(self._queue) < self.max_batch_size:
+                wait = flush_at - time.monotonic()
+                if wait <= 0:
+                    break
+                self._cond.wait(wait)
+            n = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(n)]
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            now = time.monotonic()
+            live = []
+            for pending in batch:
+                if pending.cancelled:
+                    continue
+                if pending.deadline is not None and now >= pending.deadline:
+                    SCHEDULER_REJECTIONS.inc(reason='deadline')
+                    pending.error = DeadlineExceeded("Deadline passed while waiting for inference")
+                    pending.done.set()
+                    continue
+                STAGE_SECONDS.observe(now - pending.enqueued, stage='batch_queue')
+                live.append(pending)
+            if not live:
+                continue
+
+            INFERENCE_BATCH_SIZE.observe(len(live))
+            try:
+                results = self.batch_fn([pending.item for pending in live])
+            except Exception as e:
+                logger.exception("[SCHEDULER] Batch of %d failed", len(live))
+                for pending in live:
+                    pending.error = e
+            else:
+                for pending, result in zip(live, results):
+                    pending.result = result
+            for pending in live:
+                pending.done.set()
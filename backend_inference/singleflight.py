@@ -0,0 +1,226 @@
+# --- singleflight.py (Coalesce concurrent work on the same key) ---
+
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlightTimeout(TimeoutError):
+    """Gave up waiting for another caller's in-flight work on the same key."""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Runs at most one `fn` per key at a time; concurrent callers share its result.
+
+    Within a process, followers block on the leader's event and receive the same
+    result (or exception). Across worker processes the leader additionally holds an
+    flock on a per-key file, so a leader in another process waits for it and then
+    runs `fn` itself: results are not passed between processes, so `fn` should first
+    look in a store the other process fills (a SQLite cache, say) to skip the work.
+    The lock file is removed when the lock is released.
+    """
+
+    def __init__(self, lock_dir=None, timeout=120.0, poll_interval=0.05):
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def _lock_path(self, key):
+        return os.path.join(self.lock_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.lock')
+
+    def _acquire_file_lock(self, key, deadline):
+        path = self._lock_path(key)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        os.close(fd)
+                        raise SingleFlightTimeout(f"Timed out waiting for another worker on {key}")
+                    time.sleep(self.poll_interval)
+            # The previous holder unlinks the file before unlocking it: a lock taken on
+            # a file no longer at `path` excludes nobody, so open the current one again
+            try:
+                if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _release_file_lock(self, key, fd):
+        try:
+            os.unlink(self._lock_path(key))
+        except FileNotFoundError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def do(self, key, fn, timeout=None, run_timeout=None):
+        """Call `fn()` unless a call for `key` is already running; either way return its result.
+
+        This caller waits up to `timeout` seconds. `run_timeout` (default `timeout`)
+        bounds the run itself while it waits for another worker's lock; when it is
+        longer, the run goes on a thread of its own, so it carries on for the other
+        callers after this one has stopped waiting. A caller that joined a run which
+        ended in a TimeoutError tries again while it still has time of its own.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        run_timeout = timeout if run_timeout is None else run_timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    call.waiters += 1
+
+            if leader and run_timeout <= timeout:
+                return self._run(key, call, fn, deadline)
+            if leader:
+                threading.Thread(
+                    target=self._run_detached, args=(key, call, fn, time.monotonic() + run_timeout),
+                    name=f'singleflight-{key}', daemon=True
+                ).start()
+
+            if not call.done.wait(max(0.0, deadline - time.monotonic())):
+                raise SingleFlightTimeout(f"Timed out waiting for in-flight work on {key}")
+            if call.error is None:
+                return dict(call.result) if isinstance(call.result, dict) else call.result
+            if leader or not isinstance(call.error, TimeoutError) or time.monotonic() >= deadline:
+                raise call.error
+            # That run gave up on a deadline shorter than ours: run it again
+            logger.debug("[SINGLEFLIGHT] %s: retrying after the shared run timed out", key)
+
+    def _run(self, key, call, fn, deadline):
+        fd = None
+        try:
+            if self.lock_dir:
+                fd = self._acquire_file_lock(key, deadline)
+            call.result = fn()
+            if call.waiters:
+                logger.debug("[SINGLEFLIGHT] %s: shared result with %d waiting requests", key, call.waiters)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            if fd is not None:
+                self._release_file_lock(key, fd)
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_detached(self, key, call, fn, deadline):
+        try:
+            self._run(key, call, fn, deadline)
+        except Exception:
+            pass  # kept in call.error for the callers
+
+    def do_many(self, keys, fn, timeout=None):
+        """do() for many keys at once. Returns {key: result, or the exception it raised}.
+
+        `fn(keys)` must return {key: result}; an exception as a result is handed to
+        that key's waiters as its error. It is called once for all the keys no
+        other caller is working on; keys another thread is running wait for its
+        result, and keys another worker process holds the lock for are run in a
+        second `fn` call once that lock is free (`fn` should check the shared cache
+        first, as for do()). Every key may wait up to `timeout` seconds; as in do(),
+        a key whose shared run ended in a TimeoutError is tried again in that time.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        led, followed = {}, {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                call = self._calls.get(key)
+                if call is None:
+                    led[key] = self._calls[key] = _Call()
+                else:
+                    call.waiters += 1
+                    followed[key] = call
+
+        results = {}
+        fds = {}
+        try:
+            ready, busy = [], []
+            for key in led:
+                if not self.lock_dir:
+                    ready.append(key)
+                    continue
+                try:
+                    # A deadline already passed makes this a single non-blocking attempt
+                    fds[key] = self._acquire_file_lock(key, 0)
+                    ready.append(key)
+                except SingleFlightTimeout:
+                    busy.append(key)
+            if ready:
+                self._run_many(fn, ready, led, results)
+
+            waited = []
+            for key in busy:
+                try:
+                    fds[key] = self._acquire_file_lock(key, deadline)
+                    waited.append(key)
+                except SingleFlightTimeout as e:
+                    led[key].error = results[key] = e
+            if waited:
+                self._run_many(fn, waited, led, results)
+        finally:
+            for key, fd in fds.items():
+                self._release_file_lock(key, fd)
+            with self._lock:
+                for key in led:
+                    del self._calls[key]
+            for call in led.values():
+                call.done.set()
+
+        retry = []
+        for key, call in followed.items():
+            if not call.done.wait(max(0.0, deadline - time.monotonic())):
+                results[key] = SingleFlightTimeout(f"Timed out waiting for in-flight work on {key}")
+            elif isinstance(call.error, TimeoutError) and time.monotonic() < deadline:
+                retry.append(key)  # that run gave up on a deadline shorter than ours
+            elif call.error is not None:
+                results[key] = call.error
+            else:
+                results[key] = dict(call.result) if isinstance(call.result, dict) else call.result
+        if retry:
+            results.update(self.do_many(retry, fn, max(0.0, deadline - time.monotonic())))
+        return results
+
+    @staticmethod
+    def _run_many(fn, keys, calls, results):
+        try:
+            out = fn(keys)
+        except Exception as e:
+            for key in keys:
+                calls[key].error = results[key] = e
+            return
+        for key in keys:
+            outcome = results[key] = out.get(key)
+            if isinstance(outcome, Exception):
+                calls[key].error = outcome
+            else:
+                calls[key].result = outcome
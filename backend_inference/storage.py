@@ -0,0 +1,166 @@
+# --- storage.py (SQLite plumbing shared by the on-disk stores) ---
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from metrics import BACKGROUND_WRITES_DROPPED
+
+logger = logging.getLogger(__name__)
+
+# Rows looked up per `IN (...)` query, well under SQLite's bound-parameter limit
+IN_CHUNK_SIZE = 500
+
+
+class LocalConnection:
+    """Callable returning this thread's connection to one SQLite database.
+
+    There is one connection per thread and per process (connections must not
+    cross a fork), in WAL mode with autocommit, and `schema` is applied when it
+    is opened. `setup(conn)` runs once per new connection, for schema upgrades
+    or other per-connection state.
+    """
+
+    def __init__(self, path, schema, setup=None):
+        self.path = path
+        self.schema = schema
+        self.setup = setup
+        self._local = threading.local()
+
+    def __call__(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(self.schema)
+            if self.setup is not None:
+                self.setup(conn)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+def chunked(items, size):
+    """Yield lists of up to `size` consecutive items from any iterable."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def select_in(conn, sql, values, params=()):
+    """Rows of `sql` for every value, its `{placeholders}` filled IN_CHUNK_SIZE values at a time.
+
+    `params` are bound before the placeholders, for the rest of the WHERE clause.
+    """
+    for chunk in chunked(values, IN_CHUNK_SIZE):
+        yield from conn.execute(sql.format(placeholders=','.join('?' * len(chunk))), [*params, *chunk])
+
+
+class WriteBehind:
+    """Moves writes off the request path onto a background thread of this process.
+
+    `submit(item)` only queues. The writer thread waits up to `interval` seconds
+    after the first queued item (or until `batch_size` are queued) and hands them
+    all to one `write_fn(items)` call, so concurrent requests share a transaction
+    instead of each taking the database write lock. With more than `max_queue`
+    items waiting, new ones are dropped and counted in
+    ransomware_background_writes_dropped_total, as are the items of a failed
+    write. `flush()` writes whatever is queued from the calling thread; call it
+    before the process exits.
+    """
+
+    def __init__(self, write_fn, name, interval=0.5, batch_size=512, max_queue=10000):
+        self.write_fn = write_fn
+        self.name = name
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._writer = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_writer(self):
+        # Threads don't survive fork, and items queued before it belong to the parent
+        if self._pid == os.getpid() and self._writer.is_alive():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = deque()
+                self._cond = threading.Condition()
+                self._in_flight = 0
+                self._pid = os.getpid()
+                self._writer = None
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run, name=f'{self.name}-writer', daemon=True)
+                self._writer.start()
+
+    def submit(self, item):
+        """Queue `item` for the next batch; False if it was dropped because the queue is full."""
+        self._ensure_writer()
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                BACKGROUND_WRITES_DROPPED.inc(queue=self.name)
+                return False
+            self._queue.append(item)
+            if len(self._queue) == 1 or len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def _take(self, wait):
+        with self._cond:
+            if wait:
+                while not self._queue:
+                    self._cond.wait()
+                flush_at = time.monotonic() + self.interval
+                while len(self._queue) < self.batch_size:
+                    left = flush_at - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+            batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.batch_size))]
+            self._in_flight += len(batch)
+            return batch
+
+    def _write(self, batch):
+        try:
+            self.write_fn(batch)
+        except Exception as e:
+            BACKGROUND_WRITES_DROPPED.inc(len(batch), queue=self.name)
+            logger.warning("[STORAGE] %s: dropped a batch of %d writes: %s", self.name, len(batch), e)
+        finally:
+            with self._cond:
+                self._in_flight -= len(batch)
+                self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            self._write(self._take(wait=True))
+
+    def flush(self, timeout=None):
+        """Write everything queued so far and wait for the writer thread's batch; True once nothing is pending."""
+        if self._pid != os.getpid():
+            return True
+        while True:
+            batch = self._take(wait=False)
+            if not batch:
+                break
+            self._write(batch)
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._in_flight, timeout)
+
+    def pending(self):
+        """Items queued or being written."""
+        with self._cond:
+            return len(self._queue) + self._in_flight
@@ -0,0 +1,16 @@
+# --- conftest.py (Test setup: flat module imports, isolated stores) ---
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# xgverifyv3 opens its stores at import time: keep them out of the working tree
+_STORE_DIR = tempfile.mkdtemp(prefix='ransomware-tests-')
+for _name, _file in (('TX_CACHE_DB', 'tx_cache.db'), ('FEATURE_STATE_DB', 'feature_state.db'),
+                     ('COUNTERPARTY_GRAPH_DB', 'counterparty_graph.db'), ('FEATURE_STORE_DIR', 'feature_store'),
+                     ('SINGLEFLIGHT_LOCK_DIR', 'locks'), ('RESULT_CACHE_INVALIDATIONS_DB', 'invalidations.db')):
+    os.environ[_name] = os.path.join(_STORE_DIR, _file)
+os.environ['RESULT_CACHE_DB'] = ''
+os.environ['BLOCK_INDEX_DB'] = ''
@@ -0,0 +1,197 @@
+# --- test_address_state.py (Feature summaries score exactly what a full recomputation would) ---
+
+import random
+
+import numpy as np
+import pytest
+
+import xgverifyv3
+from address_state import AddressStateStore, Multiset, Summary
+from counterparty_graph import edges_from_columns
+from feature_engine import features_from_columns, flatten_transactions
+from txgen import make_tx, synthetic_history
+
+
+@pytest.fixture
+def states(tmp_path, monkeypatch):
+    store = AddressStateStore(str(tmp_path / 'feature_state.db'))
+    monkeypatch.setattr(xgverifyv3, 'address_states', store)
+    monkeypatch.setattr(xgverifyv3, 'FEATURE_STATE_ENABLED', True)
+    return store
+
+
+class FakeHistory:
+    """Stands in for fetcher.AddressHistory: a newest-first stream with the API's n_tx."""
+
+    def __init__(self, transactions, n_tx=None, truncate_after=None):
+        self.transactions = transactions
+        self.n_tx = len(transactions) if n_tx is None else n_tx
+        self.truncate_after = truncate_after
+        self.truncated = False
+        self.fetched = 0
+
+    def __iter__(self):
+        for tx in self.transactions:
+            if self.truncate_after is not None and self.fetched >= self.truncate_after:
+                self.truncated = True
+                return
+            self.fetched += 1
+            yield tx
+
+
+def confirmed_history(address, n, seed, blocks_per_tx=1):
+    history = synthetic_history(address, n, seed)
+    for i, tx in enumerate(history):
+        tx['block_height'] = 700_000 - i // blocks_per_tx
+    return history
+
+
+def expected(transactions, address):
+    return features_from_columns(flatten_transactions(transactions, address))
+
+
+def assert_same_features(actual, wanted):
+    # Totals and means come from exact sums, so they can differ from the float
+    # accumulation of features_from_columns in the last bits; everything else is exact
+    inexact = {name for name in wanted if name.endswith(('_total', '_mean'))}
+    assert {k: v for k, v in actual.items() if k not in inexact} == {k: v for k, v in wanted.items() if k not in inexact}
+    assert actual == pytest.approx(wanted, rel=1e-12, abs=1e-15)
+
+
+def test_default_page_path_leaves_the_summaries_alone(states):
+    address = '1PagePath'
+    history = synthetic_history(address, 53, seed=11)
+
+    assert xgverifyv3.build_feature_dict(history[3:], address) == expected(history[3:], address)
+    assert states.header(address) is None
+
+
+def test_known_address_only_folds_in_its_new_transactions(states):
+    address = '1StateExtend'
+    history = confirmed_history(address, 90, seed=13, blocks_per_tx=3)
+
+    first = states.update_from_stream(address, FakeHistory(history[40:]))
+    assert first.features == expected(history[40:], address)
+
+    for start in (25, 24, 3, 0):
+        read = FakeHistory(history[start:])
+        score = states.update_from_stream(address, read)
+        assert_same_features(score.features, expected(history[start:], address))
+        # Paging stopped at the stored watermark: the last stored block is re-read, no older one
+        assert read.fetched <= 40 - start + 3 + 1
+    assert states.header(address).n_tx == 90
+
+
+def test_unconfirmed_transactions_are_scored_but_not_stored(states):
+    address = '1StatePending'
+    history = confirmed_history(address, 60, seed=14)
+    states.update_from_stream(address, FakeHistory(history[10:]))
+    pending = [dict(tx, block_height=None) for tx in synthetic_history(address, 4, seed=99)]
+    for i, tx in enumerate(pending):
+        tx['hash'] = f'pending{i}'
+
+    stream = pending + history
+    score = states.update_from_stream(address, FakeHistory(stream))
+
+    assert_same_features(score.features, expected(stream, address))
+    assert states.header(address).n_tx == 60
+    # Without them again the summary holds just the confirmed history
+    assert_same_features(states.update_from_stream(address, FakeHistory(history)).features,
+                         expected(history, address))
+
+
+def test_random_histories_match_a_full_recomputation(states):
+    address = '1StateRandom'
+    rng = random.Random(5)
+    peers = [f'peer{i}' for i in range(12)]
+    history = []
+    block = 600_000
+    for i in range(150):
+        block += rng.choice([0, 0, 1, 2, 7])  # repeated blocks, small and large gaps
+        fee = rng.choice([0, 1_000, 5_000, 5_000])  # equal fees make equal fee shares
+        value = rng.choice([10_000, 50_000, rng.randint(1_000, 10 ** 6)])
+        inputs = [(address, value)] if rng.random() < 0.5 else [(rng.choice(peers), value)]
+        outputs = [(rng.choice([address, *peers]), value - fee)]
+        history.insert(0, make_tx(f'h{i}', 1_600_000_000 + i, block, fee, inputs, outputs))
+
+    cut = len(history)
+    while cut:
+        cut = max(0, cut - rng.randint(1, 25))
+        score = states.update_from_stream(address, FakeHistory(history[cut:]))
+        assert_same_features(score.features, expected(history[cut:], address))
+
+
+def test_stored_edges_match_the_full_history(states):
+    address = '1StateEdges'
+    history = confirmed_history(address, 70, seed=15)
+    states.update_from_stream(address, FakeHistory(history[30:]))
+    score = states.update_from_stream(address, FakeHistory(history))
+
+    edges = score.load_edges()
+    full = edges_from_columns(flatten_transactions(history, address))
+    assert dict(zip(edges.addresses, zip(edges.counts.tolist(), edges.values.tolist()))) == \
+        dict(zip(full.addresses, zip(full.counts.tolist(), full.values.tolist())))
+
+
+def test_summary_that_does_not_add_up_asks_for_a_rescan(states):
+    address = '1StateStream'
+    history = confirmed_history(address, 120, seed=16)
+
+    states.update_from_stream(address, FakeHistory(history[50:]))
+    assert states.update_from_stream(address, FakeHistory(history, n_tx=125)) is None
+
+    states.delete(address)
+    score = states.update_from_stream(address, FakeHistory(history))
+    assert score.features['total_txs'] == 120
+    assert states.header(address).n_tx == 120
+
+
+def test_truncated_stream_scores_only_what_was_read(states):
+    address = '1StateTruncated'
+    history = confirmed_history(address, 100, seed=17)
+
+    states.update_from_stream(address, FakeHistory(history[30:]))
+    score = states.update_from_stream(address, FakeHistory(history, truncate_after=10))
+
+    assert score.features == expected(history[:10], address)
+    assert states.header(address).n_tx == 70
+
+
+def test_median_cursor_follows_inserts_and_removals(states):
+    conn = states._conn()
+    values = Multiset(conn, '1Cursor', 'values', Multiset.new_state())
+    held = []
+    rng = random.Random(7)
+    conn.execute('BEGIN')
+    for _ in range(400):
+        if held and rng.random() < 0.4:
+            value = held.pop(rng.randrange(len(held)))
+            values.remove(value)
+        else:
+            value = float(rng.randint(0, 30))
+            held.append(value)
+            values.add(value)
+        if held:
+            assert values.stats()['median'] == float(np.median(held))
+            assert values.state['distinct'] == len(set(held))
+    conn.execute('ROLLBACK')
+
+
+def test_built_and_folded_summaries_agree(states):
+    address = '1StateBuild'
+    columns = flatten_transactions(confirmed_history(address, 80, seed=18, blocks_per_tx=2), address)
+    conn = states._conn()
+    conn.execute('BEGIN')
+    built = Summary(conn, address)
+    built.build(columns)
+    built_features = built.features()
+    conn.execute('ROLLBACK')
+
+    conn.execute('BEGIN')
+    folded = Summary(conn, address)
+    folded.fold(columns)
+    folded_features = folded.features()
+    conn.execute('ROLLBACK')
+
+    assert_same_features(built_features, features_from_columns(columns))
+    assert built_features == folded_features
@@ -0,0 +1,102 @@
+# --- test_block_index.py (Blocks from a node become rawaddr-style histories, appended in height order) ---
+
+from block_index import BlockIndex, parse_block
+from feature_engine import features_from_columns, flatten_transactions
+
+
+def vout(n, address, btc):
+    return {'n': n, 'value': btc, 'scriptPubKey': {'address': address}}
+
+
+def coinbase(txid, address, btc=50):
+    return {'txid': txid, 'vin': [{'coinbase': '03ab'}], 'vout': [vout(0, address, btc)]}
+
+
+def spend(txid, prev, outputs, fee=None):
+    tx = {'txid': txid, 'vin': [{'txid': prev_txid, 'vout': n} for prev_txid, n in prev],
+          'vout': [vout(n, address, btc) for n, (address, btc) in enumerate(outputs)]}
+    if fee is not None:
+        tx['fee'] = fee
+    return tx
+
+
+def block(height, *txs):
+    return {'height': height, 'hash': f'hash{height}', 'time': 1_600_000_000 + height * 600, 'tx': list(txs)}
+
+
+def test_parse_block_reads_addresses_values_and_prevouts():
+    legacy_output = {'n': 1, 'value': 0.5, 'scriptPubKey': {'addresses': ['1Legacy']}}
+    with_prevout = {'txid': 'prev', 'vout': 3,
+                    'prevout': {'value': 1.25, 'scriptPubKey': {'address': '1Spender'}}}
+    raw = block(7, coinbase('cb', '1Miner', 6.25),
+                {'txid': 'tx', 'fee': 0.0001, 'vin': [with_prevout, {'txid': 'other', 'vout': 0}],
+                 'vout': [vout(0, '1Payee', 1.0), legacy_output]})
+
+    height, block_hash, block_time, txs = parse_block(raw)
+
+    assert (height, block_hash, block_time) == (7, 'hash7', 1_600_004_200)
+    assert txs[0] == ('cb', None, [], [(0, '1Miner', 625_000_000)])
+    assert txs[1] == ('tx', 10_000,
+                      [('prev', 3, '1Spender', 125_000_000), ('other', 0, None, None)],
+                      [(0, '1Payee', 100_000_000), (1, '1Legacy', 50_000_000)])
+
+
+def test_apply_resolves_inputs_against_earlier_blocks():
+    index = BlockIndex(':memory:')
+    added = index.apply([parse_block(block(1, coinbase('cb1', '1Alice'))),
+                         parse_block(block(2, coinbase('cb2', '1Miner'),
+                                           spend('pay', [('cb1', 0)], [('1Bob', 30), ('1Alice', 19.999)]))),
+                         parse_block(block(3, coinbase('cb3', '1Miner'), spend('orphan', [('gone', 0)], [('1Bob', 1)])))])
+
+    assert added == {'blocks': 3, 'transactions': 5, 'unresolved_inputs': 1}
+    payment = index.transactions('1Bob')[1]
+    assert payment['hash'] == 'pay'
+    assert payment['inputs'] == [{'prev_out': {'addr': '1Alice', 'value': 5_000_000_000, 'tx_hash': 'cb1', 'n': 0}}]
+    assert payment['fee'] == 100_000  # inputs minus outputs, as the block JSON had no fee
+    assert [tx['hash'] for tx in index.transactions('1Alice')] == ['pay', 'cb1']
+    # The spent coinbase output is gone; the payment's outputs are unspent
+    assert index.stats()['unspent_outputs'] == 5
+    assert index.transactions('1Nobody') is None
+
+
+def test_blocks_at_ingested_heights_are_skipped():
+    index = BlockIndex(':memory:')
+    index.apply([parse_block(block(1, coinbase('cb1', '1Alice')))])
+
+    again = index.apply([parse_block(block(1, coinbase('cb1', '1Alice'))),
+                         parse_block(dict(block(1, coinbase('fork', '1Mallory')), hash='otherhash'))])
+
+    assert again['blocks'] == 0
+    assert index.tip() == (1, 'hash1')
+    assert index.transactions('1Mallory') is None
+
+
+def test_columns_are_extended_with_new_blocks_only(tmp_path):
+    index = BlockIndex(str(tmp_path / 'index.db'))
+    index.apply([parse_block(block(1, coinbase('cb1', '1Alice'))),
+                 parse_block(block(2, coinbase('cb2', '1Miner'), spend('pay1', [('cb1', 0)], [('1Bob', 10), ('1Alice', 39)])))])
+    first = index.columns('1Alice')
+    assert index.columns('1Alice') is first  # same tip: served from the cache
+
+    reads = []
+    read = index._transactions_between
+    index._transactions_between = lambda *args: reads.append(args) or read(*args)
+    index.apply([parse_block(block(3, coinbase('cb3', '1Miner'),
+                                   spend('pay2', [('pay1', 1)], [('1Carol', 20), ('1Alice', 18.5)]))),
+                 parse_block(block(4, coinbase('cb4', '1Miner')))])
+    extended = index.columns('1Alice')
+
+    assert reads == [('1Alice', 2, 4)]
+    full = flatten_transactions(index.transactions('1Alice'), '1Alice')
+    assert extended.hashes == full.hashes == ['pay2', 'pay1', 'cb1']
+    assert features_from_columns(extended) == features_from_columns(full)
+
+
+def test_the_columns_cache_is_bounded(tmp_path):
+    index = BlockIndex(str(tmp_path / 'index.db'), cache_size=2)
+    index.apply([parse_block(block(1, *(coinbase(f'cb{i}', f'1Addr{i}') for i in range(4))))])
+
+    for i in range(4):
+        assert index.columns(f'1Addr{i}').hashes == [f'cb{i}']
+    assert list(index._columns) == ['1Addr2', '1Addr3']
+    assert index.columns('1Unknown') is None
@@ -0,0 +1,41 @@
+# --- test_bulk_score.py (--resume retries the addresses that failed) ---
+
+from types import SimpleNamespace
+
+import pytest
+
+from bulk_score import ResultWriter, completed_addresses
+from fetcher import FetchError
+from xgverifyv3 import build_result
+
+SNAPSHOT = SimpleNamespace(threshold=0.5, feature_names=['total_txs'], version='test-model')
+
+
+def scored(address, probability):
+    return build_result(address, probability, SNAPSHOT, transactions_analyzed=12)
+
+
+def failed_chunk(address, error):
+    # What bulk_score._score_chunk writes for every address of a chunk that raised
+    return {'address': address, 'error': f"{type(error).__name__}: {error}"}
+
+
+FIRST_RUN = [
+    scored('1Scored', 0.1),
+    {'address': '1FetchFailed', 'error': 'Failed to fetch transaction data'},
+    {'address': '1CacheMiss', 'error': 'Not in the local transaction cache'},
+    failed_chunk('1RetriedOk', FetchError('Giving up on https://blockchain.info/rawaddr/1RetriedOk: HTTP 503')),
+    {'address': '1NoModel', 'error': 'Model is not available'},
+]
+RESUMED_RUN = [scored('1RetriedOk', 0.9)]
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'jsonl'])
+def test_only_rows_without_an_error_are_completed(tmp_path, fmt):
+    path = str(tmp_path / f'scores.{fmt}')
+    for rows, append in ((FIRST_RUN, False), (RESUMED_RUN, True)):
+        writer = ResultWriter(path, fmt, append=append)
+        writer.write(rows)
+        writer.close()
+
+    assert completed_addresses(path, fmt) == {'1Scored', '1RetriedOk'}
@@ -0,0 +1,71 @@
+# --- test_counterparty_graph.py (Graph updates are queued and written in batches off the request path) ---
+
+import threading
+
+import numpy as np
+
+from counterparty_graph import CounterpartyGraph, edges_from_columns
+from feature_engine import flatten_transactions
+from storage import WriteBehind
+from txgen import synthetic_history
+
+
+def columns(address, n=40, seed=0):
+    return flatten_transactions(synthetic_history(address, n, seed), address)
+
+
+def test_queued_updates_and_scores_are_stored_by_flush(tmp_path):
+    graph = CounterpartyGraph(str(tmp_path / 'graph.db'), write_interval=60)
+    target = columns('1Target', seed=1)
+
+    graph.enqueue_update('1Target', target)
+    graph.enqueue_scores(['1Target'], [0.25])
+    assert graph.row('1Target') is None  # nothing is written on the caller's thread
+
+    assert graph.flush(timeout=5)
+    row = graph.row('1Target')
+    edges = edges_from_columns(target)
+    names = graph.addresses(row.neighbors)
+    stored = {names[node]: (count, value) for node, count, value in
+              zip(row.neighbors.tolist(), row.counts.tolist(), row.values.tolist())}
+    assert stored == dict(zip(edges.addresses, zip(edges.counts.tolist(), edges.values.tolist())))
+    assert graph._scores([row.node]) == {row.node: 0.25}
+
+
+def test_the_writer_thread_batches_without_a_flush(tmp_path):
+    graph = CounterpartyGraph(str(tmp_path / 'graph.db'), write_interval=0.01)
+    for i in range(5):
+        graph.enqueue_update(f'1Addr{i}', columns(f'1Addr{i}', seed=i))
+
+    assert graph._writes.flush(timeout=5)
+    assert graph.stats()['fetched_nodes'] == 5
+
+
+def test_unchanged_fingerprint_skips_loading_the_edges(tmp_path):
+    graph = CounterpartyGraph(str(tmp_path / 'graph.db'), write_interval=60)
+    target = columns('1Same', seed=2)
+    graph.update('1Same', target)
+    loads = []
+
+    graph.enqueue_edges('1Same', graph.row('1Same').fingerprint, lambda: loads.append(1))
+    graph.flush(timeout=5)
+
+    assert loads == []
+
+
+def test_a_full_queue_drops_new_items_instead_of_blocking(tmp_path):
+    release = threading.Event()
+    written = []
+
+    def slow_write(items):
+        release.wait(5)
+        written.extend(items)
+
+    writes = WriteBehind(slow_write, 'test', interval=0, batch_size=1, max_queue=2)
+    accepted = [writes.submit(i) for i in range(10)]
+    release.set()
+    assert writes.flush(timeout=5)
+
+    assert not all(accepted)
+    assert sorted(written) == [i for i, ok in enumerate(accepted) if ok]
+    assert np.count_nonzero(accepted) <= 3  # two queued plus the one being written
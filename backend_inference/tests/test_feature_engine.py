@@ -0,0 +1,214 @@
+# --- test_feature_engine.py (Columnar features vs the original dict-based extractor) ---
+
+import copy
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from feature_engine import (EXPECTED_FEATURES, SATOSHI_TO_BTC, dumps_columns, enhanced_pattern_values,
+                            features_from_columns, flatten_transactions, loads_columns)
+from txgen import make_tx, synthetic_history
+from xgverifyv3 import create_enhanced_pattern_features
+
+TARGET = '1TargetAddressxxxxxxxxxxxxxxxxxxxx'
+
+
+def _safe_stats(values):
+    if not values:
+        return {'min': 0.0, 'max': 0.0, 'mean': 0.0, 'median': 0.0, 'total': 0.0}
+    return {
+        'min': float(min(values)),
+        'max': float(max(values)),
+        'mean': float(np.mean(values)),
+        'median': float(np.median(values)),
+        'total': float(sum(values))
+    }
+
+
+def legacy_build_feature_dict(transactions, target_address):
+    """The dict-based build_feature_dict the vectorized engine replaced, kept as the reference."""
+    if not transactions:
+        return None
+    transactions = copy.deepcopy(transactions)
+    transactions.sort(key=lambda x: x.get('time', 0))
+
+    sent_transactions = []
+    received_transactions = []
+    all_transaction_values = []
+    all_fees = []
+    block_heights = []
+    address_interaction_counts = Counter()
+
+    for tx in transactions:
+        tx_time = tx.get('time', 0)
+        tx_block = tx.get('block_height', 0)
+        tx_fee = tx.get('fee', 0)
+        if tx_block > 0:
+            block_heights.append(tx_block)
+        all_fees.append(tx_fee)
+
+        is_sender = False
+        sent_value = 0
+        for inp in tx.get('inputs', []):
+            if inp.get('prev_out') and inp['prev_out'].get('addr') == target_address:
+                is_sender = True
+                sent_value += inp['prev_out'].get('value', 0)
+        is_receiver = False
+        received_value = 0
+        for out in tx.get('out', []):
+            if out.get('addr') == target_address:
+                is_receiver = True
+                received_value += out.get('value', 0)
+
+        if is_sender and sent_value > 0:
+            sent_transactions.append({'value': sent_value, 'block': tx_block, 'time': tx_time, 'fee': tx_fee})
+            all_transaction_values.append(sent_value)
+        if is_receiver and received_value > 0:
+            received_transactions.append({'value': received_value, 'block': tx_block, 'time': tx_time})
+            all_transaction_values.append(received_value)
+
+        counterparties = set()
+        for inp in tx.get('inputs', []):
+            if inp.get('prev_out') and inp['prev_out'].get('addr'):
+                counterparties.add(inp['prev_out']['addr'])
+        for out in tx.get('out', []):
+            if out.get('addr'):
+                counterparties.add(out['addr'])
+        counterparties.discard(target_address)
+        for addr in counterparties:
+            address_interaction_counts[addr] += 1
+
+    sent_values_btc = [tx['value'] / SATOSHI_TO_BTC for tx in sent_transactions]
+    received_values_btc = [tx['value'] / SATOSHI_TO_BTC for tx in received_transactions]
+    all_values_btc = [v / SATOSHI_TO_BTC for v in all_transaction_values]
+    fees_btc = [f / SATOSHI_TO_BTC for f in all_fees]
+
+    def intervals(blocks):
+        return [blocks[i] - blocks[i - 1] for i in range(1, len(blocks))] if len(blocks) > 1 else []
+
+    block_intervals = intervals(sorted(block_heights))
+    sent_blocks = sorted([tx['block'] for tx in sent_transactions if tx['block'] > 0])
+    received_blocks = sorted([tx['block'] for tx in received_transactions if tx['block'] > 0])
+
+    fee_shares = []
+    for tx in sent_transactions:
+        if tx['value'] > 0 and tx['fee'] > 0:
+            fee_shares.append((tx['fee'] / tx['value']) * 100)
+    for tx in transactions:
+        tx_fee = tx.get('fee', 0)
+        if tx_fee > 0:
+            total_value = 0
+            for inp in tx.get('inputs', []):
+                if inp.get('prev_out') and inp['prev_out'].get('addr') == target_address:
+                    total_value += inp['prev_out'].get('value', 0)
+            for out in tx.get('out', []):
+                if out.get('addr') == target_address:
+                    total_value += out.get('value', 0)
+            if total_value > 0:
+                fee_share = (tx_fee / total_value) * 100
+                if fee_share not in fee_shares:
+                    fee_shares.append(fee_share)
+
+    addresses_multiple_interactions = len([a for a, count in address_interaction_counts.items() if count > 1])
+    unique_blocks = len(set(block_heights)) if block_heights else 0
+
+    features = {
+        'num_txs_as_sender': float(len(sent_transactions)),
+        'num_txs_as receiver': float(len(received_transactions)),
+        'total_txs': float(len(transactions)),
+        'first_block_appeared_in': float(min(block_heights)) if block_heights else 0.0,
+        'last_block_appeared_in': float(max(block_heights)) if block_heights else 0.0,
+        'lifetime_in_blocks': float(max(block_heights) - min(block_heights)) if len(block_heights) > 1 else 0.0,
+        'first_sent_block': float(min(sent_blocks)) if sent_blocks else 0.0,
+        'first_received_block': float(min(received_blocks)) if received_blocks else 0.0,
+        'num_timesteps_appeared_in': float(unique_blocks),
+        **{f'btc_transacted_{k}': v for k, v in _safe_stats(all_values_btc).items()},
+        **{f'btc_sent_{k}': v for k, v in _safe_stats(sent_values_btc).items()},
+        **{f'btc_received_{k}': v for k, v in _safe_stats(received_values_btc).items()},
+        **{f'fees_{k}': v for k, v in _safe_stats(fees_btc).items()},
+        **{f'fees_as_share_{k}': v for k, v in _safe_stats(fee_shares).items()},
+        **{f'blocks_btwn_txs_{k}': v for k, v in _safe_stats(block_intervals).items()},
+        **{f'blocks_btwn_input_txs_{k}': v for k, v in _safe_stats(intervals(sent_blocks)).items()},
+        **{f'blocks_btwn_output_txs_{k}': v for k, v in _safe_stats(intervals(received_blocks)).items()},
+        'num_addr_transacted_multiple': float(addresses_multiple_interactions),
+        **{f'transacted_w_address_{k}': v for k, v in _safe_stats(list(address_interaction_counts.values())).items()},
+        'Time step': float(unique_blocks),
+    }
+    for feature in EXPECTED_FEATURES:
+        features.setdefault(feature, 0.0)
+    return features
+
+
+def assert_same_66_features(transactions, target=TARGET):
+    expected = legacy_build_feature_dict(transactions, target)
+    actual = features_from_columns(flatten_transactions(transactions, target))
+
+    # The 56 base features must match exactly
+    assert set(actual) == set(expected) == set(EXPECTED_FEATURES)
+    for name in EXPECTED_FEATURES:
+        assert actual[name] == expected[name], name
+
+    # The 10 enhanced features: the original pandas derivation vs the per-dict one
+    enhanced = create_enhanced_pattern_features(pd.DataFrame([expected])).iloc[0]
+    derived = enhanced_pattern_values(actual)
+    assert len(derived) == 10
+    for name, value in derived.items():
+        assert value == pytest.approx(float(enhanced[name]), rel=1e-12, abs=1e-12), name
+
+
+def test_empty_history():
+    assert legacy_build_feature_dict([], TARGET) is None
+    features = features_from_columns(flatten_transactions([], TARGET))
+    assert set(features) == set(EXPECTED_FEATURES)
+    assert all(value == 0.0 for value in features.values())
+
+
+def test_empty_inputs_and_outputs():
+    assert_same_66_features([
+        make_tx('a', 1_600_000_000, 600_000, fee=1_000),
+        make_tx('b', 1_600_000_100, 600_001, inputs=[(TARGET, 5_000)]),
+        make_tx('c', 1_600_000_200, 600_002, outputs=[(TARGET, 7_000)]),
+    ])
+
+
+def test_self_transfers():
+    assert_same_66_features([
+        # Target pays itself (change back to the same address), alone and with a peer
+        make_tx('a', 1_600_000_000, 600_000, 500, [(TARGET, 10_000)], [(TARGET, 9_500)]),
+        make_tx('b', 1_600_000_050, 600_003, 700, [(TARGET, 20_000), ('peer', 1_000)], [(TARGET, 20_300)]),
+        make_tx('c', 1_600_000_100, 600_003, 500, [('peer', 3_000)], [(TARGET, 2_500)]),
+    ])
+
+
+def test_missing_prev_out_and_coinbase_inputs():
+    no_address = make_tx('b', 1_600_000_100, 600_010, 200, [(TARGET, 4_000)], [('peer', 3_800)])
+    # A prev_out without an address (non-standard script) and one missing its value
+    no_address['inputs'].append({'prev_out': {'value': 1_000}})
+    no_address['inputs'].append({'prev_out': {'addr': 'peer2'}})
+    assert_same_66_features([
+        make_tx('a', 1_600_000_000, 600_000, 0, [None], [(TARGET, 625_000_000), (None, 0)]),
+        no_address,
+        make_tx('c', 1_600_000_200, 600_020, 0, [None, ('peer', 10)], [(TARGET, 5)]),
+    ])
+
+
+def test_unconfirmed_and_duplicate_fee_shares():
+    assert_same_66_features([
+        make_tx('a', 1_600_000_000, None, 1_000, [(TARGET, 100_000)], [('peer', 99_000)]),
+        make_tx('b', 1_600_000_000, 600_000, 1_000, [('peer', 100_000)], [(TARGET, 99_000)]),
+        make_tx('c', 1_600_000_050, 600_000, 1_000, [('peer', 100_000)], [(TARGET, 99_000)]),
+        make_tx('d', 1_600_000_060, 600_004, 1_000, [(TARGET, 50_000)], [(TARGET, 49_000)]),
+    ])
+
+
+@pytest.mark.parametrize('n, seed', [(1, 0), (2, 1), (3, 2), (10, 3), (50, 4), (200, 5), (1_000, 6)])
+def test_synthetic_histories(n, seed):
+    assert_same_66_features(synthetic_history(TARGET, n, seed))
+
+
+def test_serialized_columns_give_the_same_features():
+    transactions = synthetic_history(TARGET, 120, seed=7)
+    columns = flatten_transactions(transactions, TARGET)
+    assert features_from_columns(loads_columns(TARGET, dumps_columns(columns))) == features_from_columns(columns)
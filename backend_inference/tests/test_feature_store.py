@@ -0,0 +1,104 @@
+# --- test_feature_store.py (Scored vectors round-trip through the matrix and rescore in bulk) ---
+
+import csv
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from feature_engine import features_from_columns, flatten_transactions
+from feature_store import FeatureStore, rescore
+from txgen import synthetic_history
+
+
+def features(address, seed):
+    return features_from_columns(flatten_transactions(synthetic_history(address, 20, seed), address))
+
+
+@pytest.fixture
+def feature_names():
+    return list(features('1Names', 0))
+
+
+def as_float32(feature_dict):
+    return {name: float(np.float32(value)) for name, value in feature_dict.items()}
+
+
+def test_put_and_get_round_trip_through_the_matrix(tmp_path, feature_names):
+    store = FeatureStore(str(tmp_path / 'store'), feature_names)
+    vectors = {f'1Addr{i}': features(f'1Addr{i}', i) for i in range(5)}
+
+    store.put_many(list(vectors), list(vectors.values()), [f'fp{i}' for i in range(5)])
+
+    assert len(store) == 5
+    for address, feature_dict in vectors.items():
+        assert store.get(address) == as_float32(feature_dict)
+    assert store.get('1Unknown') is None
+    # A second store on the same directory reads the column order back from meta.json
+    assert FeatureStore(str(tmp_path / 'store')).get('1Addr3') == as_float32(vectors['1Addr3'])
+
+
+def test_rescoring_an_address_overwrites_its_row(tmp_path, feature_names):
+    store = FeatureStore(str(tmp_path / 'store'), feature_names)
+    store.put_many(['1A', '1B'], [features('1A', 1), features('1B', 2)])
+
+    store.put_many(['1B', '1C'], [features('1B', 3), features('1C', 4)])
+
+    assert len(store) == 3
+    assert len(store.matrix()) == 3
+    assert store.get('1B') == as_float32(features('1B', 3))
+
+
+def test_queued_vectors_are_written_in_one_batch_by_flush(tmp_path, feature_names):
+    store = FeatureStore(str(tmp_path / 'store'), feature_names, write_interval=60)
+    for i in range(4):
+        store.enqueue_many([f'1Queued{i}'], [features(f'1Queued{i}', i)], [f'fp{i}'])
+    store.enqueue_many(['1Queued0'], [features('1Queued0', 9)])  # the later vector wins
+    assert len(store) == 0  # nothing is written on the caller's thread
+
+    assert store.flush(timeout=5)
+
+    assert len(store) == 4
+    assert store.get('1Queued0') == as_float32(features('1Queued0', 9))
+    assert store.get('1Queued2') == as_float32(features('1Queued2', 2))
+
+
+def test_the_writer_thread_stores_without_a_flush(tmp_path, feature_names):
+    store = FeatureStore(str(tmp_path / 'store'), feature_names, write_interval=0.01)
+    store.enqueue_many(['1A', '1B'], [features('1A', 1), features('1B', 2)])
+
+    assert store._writes.flush(timeout=5)
+    assert len(store) == 2
+
+
+class ColumnModel:
+    """Stand-in model: the probability is the first (scaled) feature."""
+
+    def predict_proba(self, x):
+        return np.column_stack([1 - x[:, 0], x[:, 0]])
+
+
+class Identity:
+    def transform(self, x):
+        return np.asarray(x, dtype=np.float64)
+
+
+def test_rescore_scores_every_stored_vector(tmp_path, feature_names):
+    store = FeatureStore(str(tmp_path / 'store'), feature_names)
+    vectors = [features(f'1Rescore{i}', i) for i in range(7)]
+    store.put_many([f'1Rescore{i}' for i in range(7)], vectors)
+    # Score with the model's own column order, here the store's in reverse
+    model_names = feature_names[::-1]
+    snapshot = SimpleNamespace(model=ColumnModel(), scaler=Identity(), feature_names=model_names,
+                               threshold=0.5, version='test')
+    output = str(tmp_path / 'rescored.csv')
+
+    total, flagged = rescore(store, snapshot, output, 'csv', chunk_rows=3)
+
+    with open(output, newline='') as f:
+        rows = {row['address']: row for row in csv.DictReader(f)}
+    assert total == len(rows) == 7
+    for i, feature_dict in enumerate(vectors):
+        probability = float(np.float32(feature_dict[model_names[0]]))
+        assert float(rows[f'1Rescore{i}']['ransomware_probability']) == pytest.approx(probability)
+    assert flagged == sum(row['is_ransomware'] == 'True' for row in rows.values())
@@ -0,0 +1,157 @@
+# --- test_fetcher.py (Upstream client against a local stub of the rawaddr API) ---
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from fetcher import AsyncBlockchainFetcher, BlockchainFetcher, FetchError, TokenBucket
+
+
+class StubAPI(BaseHTTPRequestHandler):
+    """Answers /rawaddr/<address> with an empty history. `server.script` lists the
+    status codes (and headers) to answer first, before the 200s."""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse shows in `server.ports`
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits.append((time.monotonic(), self.path))
+            server.ports.add(self.client_address[1])
+            status, headers = server.script.pop(0) if server.script else (200, {})
+        time.sleep(server.delay)
+        body = json.dumps({'address': self.path.rsplit('/', 1)[-1], 'n_tx': 0, 'txs': []}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except ConnectionError:
+            pass  # the client gave up on it
+
+
+@pytest.fixture
+def api():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubAPI)
+    server.lock = threading.Lock()
+    server.hits = []
+    server.ports = set()
+    server.script = []
+    server.delay = 0.0
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client(api, **kwargs):
+    options = dict(rate=0, burst=1, retries=3, backoff=0.01, timeout=5)
+    options.update(kwargs)
+    return BlockchainFetcher(base_url=api.url, **options)
+
+
+def test_a_cancelled_reservation_gives_its_token_back():
+    bucket = TokenBucket(rate=1, capacity=1)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(1.0, abs=0.05)
+
+    bucket.refund()
+    assert bucket.reserve() == pytest.approx(1.0, abs=0.05)
+
+
+def test_batch_fetches_do_not_book_slots_past_the_deadline(api):
+    fetcher = client(api, rate=2, burst=1)
+    fetcher.limiter.reserve()  # the next slot is half a second away
+
+    results = AsyncBlockchainFetcher(fetcher).fetch_addresses_sync(['1A', '1B'], deadline=time.monotonic() + 0.2)
+
+    assert all(isinstance(result, FetchError) for result in results.values())
+    assert api.hits == []
+    # Nothing was booked: the next caller gets the slot that was already due, not one after it
+    assert fetcher.limiter.reserve() <= 0.5
+
+
+def test_fetches_cancelled_at_the_deadline_refund_their_slots(api):
+    fetcher = client(api, rate=10, burst=1, max_concurrency=1)
+    api.delay = 0.5  # the first fetch holds the only connection slot past the deadline
+
+    results = AsyncBlockchainFetcher(fetcher).fetch_addresses_sync(
+        ['1A', '1B', '1C'], deadline=time.monotonic() + 0.3
+    )
+
+    assert all(isinstance(result, FetchError) for result in results.values())
+    assert len(api.hits) == 1
+    # 1B and 1C booked the next two slots, then gave them back when cancelled
+    assert fetcher.limiter._tokens == pytest.approx(0, abs=0.1)
+
+
+def gaps(api):
+    times = [at for at, _ in api.hits]
+    return [b - a for a, b in zip(times, times[1:])]
+
+
+def test_5xx_answers_are_retried_with_backoff(api):
+    api.script = [(503, {}), (502, {})]
+
+    assert client(api).fetch_address('1Retry') == {'address': '1Retry', 'n_tx': 0, 'txs': []}
+    assert len(api.hits) == 3
+
+
+def test_retries_give_up_with_a_fetch_error(api):
+    api.script = [(500, {})] * 3
+
+    with pytest.raises(FetchError):
+        client(api, retries=2).fetch_address('1Down')
+    assert len(api.hits) == 3
+
+
+def test_429_waits_as_long_as_retry_after_says(api):
+    api.script = [(429, {'Retry-After': '0.3'})]
+
+    client(api).fetch_address('1Limited')
+    assert len(api.hits) == 2
+    assert gaps(api)[0] >= 0.3  # the backoff alone would retry after about 0.01s
+
+
+def test_the_token_bucket_paces_requests(api):
+    fetcher = client(api, rate=10, burst=1)
+
+    for i in range(4):
+        fetcher.fetch_address(f'1Paced{i}')
+    assert all(gap >= 0.09 for gap in gaps(api))
+
+
+def test_async_batches_retry_and_share_the_token_bucket(api):
+    fetcher = client(api, rate=10, burst=1, max_concurrency=4)
+    api.script = [(503, {}), (429, {'Retry-After': '0'})]
+
+    results = AsyncBlockchainFetcher(fetcher).fetch_addresses_sync(['1A', '1B', '1C'])
+
+    assert sorted(results) == ['1A', '1B', '1C']
+    assert not any(isinstance(result, Exception) for result in results.values())
+    assert len(api.hits) == 5
+    assert all(gap >= 0.09 for gap in gaps(api))
+
+
+def test_async_batches_reuse_one_session_and_its_connections(api):
+    batches = AsyncBlockchainFetcher(client(api, max_concurrency=1))
+
+    batches.fetch_addresses_sync(['1A', '1B'])
+    session = batches._session
+    batches.fetch_addresses_sync(['1C'])
+
+    assert batches._session is session
+    assert len(api.hits) == 3
+    assert len(api.ports) == 1
+    batches.close()
+    assert session.closed
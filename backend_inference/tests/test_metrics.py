@@ -0,0 +1,40 @@
+# --- test_metrics.py (Multi-process metrics files stay current without new observations) ---
+
+import json
+import os
+import time
+
+from metrics import MetricsRegistry
+
+
+def read_own_file(directory):
+    with open(os.path.join(directory, f"{os.getpid()}.json")) as f:
+        return json.load(f)
+
+
+def test_idle_process_writes_its_last_updates(tmp_path):
+    registry = MetricsRegistry(str(tmp_path), flush_interval=0.05)
+    requests = registry.counter('requests_total', 'Requests.')
+
+    for _ in range(5):
+        requests.inc()
+    # No further observation arrives: the flusher thread alone must write the 5
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if os.path.exists(tmp_path / f"{os.getpid()}.json") and read_own_file(str(tmp_path))['requests_total']:
+            break
+        time.sleep(0.05)
+    assert read_own_file(str(tmp_path))['requests_total'] == [[[], 5]]
+
+
+def test_reset_drops_inherited_values(tmp_path):
+    registry = MetricsRegistry(str(tmp_path), flush_interval=60)
+    stages = registry.histogram('stage_seconds', 'Stages.', ['stage'], buckets=(1.0,))
+    stages.observe(0.5, stage='warmup')
+
+    registry.reset()
+    stages.observe(2.0, stage='request')
+    registry.flush()
+
+    assert read_own_file(str(tmp_path))['stage_seconds'] == [[['request'], [0, 1, 2.0]]]
+    assert 'stage_seconds_count{stage="warmup"}' not in registry.render()
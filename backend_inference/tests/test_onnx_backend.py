@@ -0,0 +1,88 @@
+# --- test_onnx_backend.py (ONNX vs joblib parity, and hot reload of the ONNX file) ---
+
+import os
+import time
+
+import joblib
+import numpy as np
+import onnxruntime as ort
+import pytest
+from sklearn.preprocessing import StandardScaler
+
+import xgverifyv3
+from feature_engine import features_from_columns, flatten_transactions
+from model_registry import ModelRegistry
+from txgen import synthetic_history
+
+N_FEATURES = 66
+
+
+def feature_dicts():
+    histories = [synthetic_history(f'1Parity{n}', n, seed=n) for n in (1, 2, 5, 20, 50, 200, 1_000)]
+    return [features_from_columns(flatten_transactions(h, h[0]['hash'].split('-')[0])) for h in histories]
+
+
+def test_shipped_onnx_model_contract():
+    session = ort.InferenceSession(xgverifyv3.ONNX_MODEL_FILE, providers=['CPUExecutionProvider'])
+    model_input = session.get_inputs()[0]
+    assert model_input.name == 'float_input'
+    assert model_input.shape[-1] == N_FEATURES
+    assert 'probabilities' in [output.name for output in session.get_outputs()]
+
+    x = np.random.default_rng(0).normal(size=(16, N_FEATURES)).astype(np.float32)
+    probabilities = np.asarray(session.run(['probabilities'], {'float_input': x})[0])
+    assert probabilities.shape == (16, 2)
+    np.testing.assert_allclose(probabilities.sum(axis=1), 1.0, rtol=1e-5)
+
+
+def test_onnx_matches_joblib_probabilities():
+    if not os.path.exists(xgverifyv3.MODEL_FILE):
+        pytest.skip(f"model bundle {xgverifyv3.MODEL_FILE} not present (set MODEL_FILE)")
+    snapshot = xgverifyv3.get_model_snapshot()
+    dicts = feature_dicts()
+
+    expected = xgverifyv3.score_feature_dicts(dicts, snapshot, backend='joblib')
+    actual = xgverifyv3.score_feature_dicts(dicts, snapshot, backend='onnx')
+
+    # float32 inputs on the ONNX side
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-5)
+
+
+@pytest.fixture
+def bundle(tmp_path):
+    path = tmp_path / 'model.joblib'
+    scaler = StandardScaler().fit(np.zeros((2, N_FEATURES)))
+    joblib.dump({'model': None, 'scaler': scaler, 'feature_names': [f'f{i}' for i in range(N_FEATURES)],
+                 'threshold': 0.5}, path)
+    onnx_path = tmp_path / 'model.onnx'
+    onnx_path.write_bytes(b'first export')
+    return str(path), str(onnx_path)
+
+
+def test_replacing_only_the_onnx_file_changes_the_version(bundle):
+    path, onnx_path = bundle
+    registry = ModelRegistry(path, poll_interval=0, companion_paths=[onnx_path])
+    first = registry.load().version
+
+    with open(onnx_path, 'wb') as f:
+        f.write(b'second, longer export')
+    second = registry.load().version
+
+    assert second != first
+    assert registry.load().version == second
+    assert ModelRegistry(path, poll_interval=0).load().version not in (first, second)
+
+
+def test_watcher_picks_up_a_new_onnx_file(bundle):
+    path, onnx_path = bundle
+    registry = ModelRegistry(path, poll_interval=0.05, companion_paths=[onnx_path])
+    first = registry.start().version
+    try:
+        with open(onnx_path, 'wb') as f:
+            f.write(b'second, longer export')
+        deadline = time.monotonic() + 5
+        while registry.get().version == first and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert registry.get().version != first
+    finally:
+        registry.stop()
@@ -0,0 +1,54 @@
+# --- test_result_cache.py (Invalidation reaches the in-memory results of every worker) ---
+
+import time
+
+from result_cache import ResultCache
+
+
+def workers(tmp_path, n=2, **kwargs):
+    # Each ResultCache holds its own in-memory tier, like one gunicorn worker
+    return [ResultCache(invalidation_path=str(tmp_path / 'invalidations.db'), **kwargs) for _ in range(n)]
+
+
+def test_invalidating_everything_clears_the_other_workers(tmp_path):
+    first, second = workers(tmp_path)
+    for cache in (first, second):
+        cache.put('1A', '3:abc', 'v1', {'probability': 0.1})
+        cache.put('1B', '5:def', 'v1', {'probability': 0.9})
+
+    assert first.invalidate() == 2
+
+    assert second.get('1A', '3:abc', 'v1') is None
+    assert second.get('1B', '5:def', 'v1') is None
+    assert second.stats()['entries'] == 0
+
+
+def test_invalidating_one_address_leaves_the_others(tmp_path):
+    first, second = workers(tmp_path)
+    second.put('1A', '3:abc', 'v1', {'probability': 0.1})
+    second.put('1B', '5:def', 'v1', {'probability': 0.9})
+
+    first.invalidate('1A')
+
+    assert second.get('1A', '3:abc', 'v1') is None
+    assert second.get('1B', '5:def', 'v1') == {'probability': 0.9}
+
+
+def test_results_stored_after_an_invalidation_are_served(tmp_path):
+    first, second = workers(tmp_path)
+    first.invalidate()
+    time.sleep(0.01)
+    second.put('1A', '3:abc', 'v1', {'probability': 0.1})
+
+    assert second.get('1A', '3:abc', 'v1') == {'probability': 0.1}
+
+
+def test_the_persistent_tier_is_cleared_for_everyone(tmp_path):
+    first, second = [ResultCache(persistent_path=str(tmp_path / 'results.db')) for _ in range(2)]
+    first.put('1A', '3:abc', 'v1', {'probability': 0.1})
+    assert second.get('1A', '3:abc', 'v1') == {'probability': 0.1}
+
+    second.invalidate('1A')
+
+    assert first.get('1A', '3:abc', 'v1') is None
+    assert second.get('1A', '3:abc', 'v1') is None
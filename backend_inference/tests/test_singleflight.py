@@ -0,0 +1,192 @@
+# --- test_singleflight.py (Concurrent callers of one key share one run) ---
+
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from scheduler import DeadlineExceeded
+from singleflight import SingleFlight, SingleFlightTimeout
+
+
+def start(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.start()
+    return thread
+
+
+def test_concurrent_callers_share_one_call(tmp_path):
+    inflight = SingleFlight(str(tmp_path / 'locks'))
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return {'score': 0.5}
+
+    threads = [start(lambda: results.append(inflight.do('key', work, timeout=5))) for _ in range(8)]
+    while not inflight._calls or inflight._calls['key'].waiters < 7:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == [{'score': 0.5}] * 8
+    assert len({id(result) for result in results}) == 8  # each caller gets its own copy
+    assert os.listdir(tmp_path / 'locks') == []  # lock files do not pile up
+
+
+def test_the_error_reaches_every_waiter(tmp_path):
+    inflight = SingleFlight(str(tmp_path / 'locks'))
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        release.wait(5)
+        raise ValueError('upstream broke')
+
+    def call():
+        try:
+            inflight.do('key', fail, timeout=5)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [start(call) for _ in range(4)]
+    while not inflight._calls or inflight._calls['key'].waiters < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 4
+    assert len({id(e) for e in errors}) == 1
+    # Failures are not remembered: the next call runs again
+    assert inflight.do('key', lambda: 'ok') == 'ok'
+
+
+def hold_lock(lock_dir, key, held, release):
+    inflight = SingleFlight(lock_dir)
+    inflight.do(key, lambda: held.set() or release.wait(5))
+
+
+def test_another_process_holding_the_key_is_waited_for(tmp_path):
+    lock_dir = str(tmp_path / 'locks')
+    held, release = multiprocessing.Event(), multiprocessing.Event()
+    other = multiprocessing.get_context('fork').Process(target=hold_lock, args=(lock_dir, 'key', held, release))
+    other.start()
+    held.wait(5)
+    inflight = SingleFlight(lock_dir, poll_interval=0.01)
+
+    with pytest.raises(SingleFlightTimeout):
+        inflight.do('key', lambda: 'mine', timeout=0.1)
+    release.set()
+    assert inflight.do('key', lambda: 'mine', timeout=5) == 'mine'
+    other.join(5)
+    assert os.listdir(lock_dir) == []
+
+
+def test_do_many_runs_new_keys_once_and_shares_running_ones(tmp_path):
+    inflight = SingleFlight(str(tmp_path / 'locks'))
+    release = threading.Event()
+    batches = []
+
+    def upper(keys):
+        batches.append(sorted(keys))
+        release.wait(5)
+        return {key: key.upper() for key in keys}
+
+    single, many = [], []
+    leader = start(lambda: single.append(inflight.do('a', lambda: upper(['a'])['a'], timeout=5)))
+    while 'a' not in inflight._calls:
+        time.sleep(0.01)
+    batch = start(lambda: many.append(inflight.do_many(['a', 'b', 'c', 'b'], upper, timeout=5)))
+    while inflight._calls['a'].waiters < 1:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    batch.join()
+
+    assert many == [{'a': 'A', 'b': 'B', 'c': 'C'}]
+    assert single == ['A']
+    assert sorted(batches) == [['a'], ['b', 'c']]
+
+
+def test_do_many_reports_errors_per_key(tmp_path):
+    inflight = SingleFlight(str(tmp_path / 'locks'))
+    broken = ValueError('no data')
+
+    results = inflight.do_many(['a', 'b'], lambda keys: {'a': 'A', 'b': broken})
+    assert results == {'a': 'A', 'b': broken}
+
+    def fail(keys):
+        raise RuntimeError('batch failed')
+
+    results = inflight.do_many(['a', 'b'], fail)
+    assert {key: str(e) for key, e in results.items()} == {'a': 'batch failed', 'b': 'batch failed'}
+
+
+def test_a_short_waiter_leaves_the_run_going_for_the_others(tmp_path):
+    inflight = SingleFlight(str(tmp_path / 'locks'))
+    runs = []
+
+    def slow():
+        runs.append(1)
+        time.sleep(0.3)
+        return 'done'
+
+    with pytest.raises(SingleFlightTimeout):
+        # Started by a caller that only waits 0.05s, the run is given 5s
+        inflight.do('key', slow, timeout=0.05, run_timeout=5)
+    assert inflight.do('key', slow, timeout=5) == 'done'
+    assert runs == [1]
+
+
+def test_a_waiter_with_time_left_retries_a_run_that_timed_out(tmp_path):
+    inflight = SingleFlight(str(tmp_path / 'locks'))
+    started = threading.Event()
+    calls = []
+
+    def run_out_of_time():
+        calls.append('short')
+        started.set()
+        time.sleep(0.1)
+        raise DeadlineExceeded('short deadline passed')
+
+    errors = []
+
+    def lead():
+        try:
+            inflight.do('key', run_out_of_time, timeout=5)
+        except DeadlineExceeded as e:
+            errors.append(e)
+
+    leader = start(lead)
+    started.wait(5)
+    result = inflight.do('key', lambda: calls.append('retry') or 'scored', timeout=5)
+    leader.join()
+
+    assert result == 'scored'
+    assert len(errors) == 1  # the caller whose deadline it was still gets the error
+    assert calls == ['short', 'retry']
+
+
+def test_do_many_retries_keys_whose_run_timed_out(tmp_path):
+    inflight = SingleFlight(str(tmp_path / 'locks'))
+    started = threading.Event()
+
+    def short(keys):
+        started.set()
+        time.sleep(0.1)
+        return {key: DeadlineExceeded('short deadline passed') for key in keys}
+
+    leader = start(inflight.do_many, ['a', 'b'], short, 5)
+    started.wait(5)
+    results = inflight.do_many(['a', 'b', 'c'], lambda keys: {key: key.upper() for key in keys}, timeout=5)
+    leader.join()
+
+    assert results == {'a': 'A', 'b': 'B', 'c': 'C'}
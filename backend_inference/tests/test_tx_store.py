@@ -0,0 +1,122 @@
+# --- test_tx_store.py (TTL, LRU eviction and migration of older cache formats) ---
+
+import json
+import sqlite3
+import time
+import zlib
+
+import pytest
+
+from feature_engine import features_from_columns, flatten_transactions
+from tx_store import EVICT_TO, TxStore
+from txgen import synthetic_history
+
+
+def history(address, n=5, seed=0):
+    return synthetic_history(address, n, seed)
+
+
+def totals_match(store):
+    conn = store._conn()
+    actual = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tx_cache').fetchone()
+    return store.stats() == {'entries': actual[0], 'bytes': actual[1]}
+
+
+def test_round_trip_keeps_the_features_and_n_tx_total(tmp_path):
+    store = TxStore(str(tmp_path / 'tx.db'))
+    transactions = history('1RoundTrip', 30, seed=1)
+
+    store.put('1RoundTrip', transactions, n_tx_total=120)
+    cached = store.get('1RoundTrip')
+
+    assert len(cached) == 30
+    assert cached.n_tx_total == 120
+    assert features_from_columns(cached) == features_from_columns(flatten_transactions(transactions, '1RoundTrip'))
+    assert store.get('1Unknown') is None
+
+
+def test_entries_older_than_the_ttl_are_stale(tmp_path):
+    store = TxStore(str(tmp_path / 'tx.db'), ttl=60)
+    store.put('1Fresh', history('1Fresh'))
+    store.put('1Old', history('1Old'), fetched_at=time.time() - 120)
+
+    assert store.get('1Fresh') is not None
+    assert store.get('1Old') is None
+    # Kept for the fallback when the API is down
+    assert len(store.get('1Old', allow_stale=True)) == 5
+
+
+def test_least_recently_used_entries_are_evicted_past_max_entries(tmp_path):
+    store = TxStore(str(tmp_path / 'tx.db'), max_entries=10)
+    for i in range(10):
+        store.put(f'1Addr{i}', history(f'1Addr{i}', seed=i))
+    # Make 1Addr0 the most recently used entry
+    store._conn().execute('UPDATE tx_cache SET accessed_at = accessed_at + 1000 WHERE address = ?', ('1Addr0',))
+    assert store.stats()['entries'] == 10
+
+    store.put('1Addr10', history('1Addr10', seed=10))
+
+    remaining = {row[0] for row in store._conn().execute('SELECT address FROM tx_cache')}
+    assert len(remaining) == int(10 * EVICT_TO)
+    assert {'1Addr0', '1Addr10'} <= remaining
+    assert totals_match(store)
+
+
+def test_eviction_by_size_keeps_the_totals_in_step(tmp_path):
+    store = TxStore(str(tmp_path / 'tx.db'))
+    store.put('1Probe', history('1Probe', 40))
+    row_size = store.stats()['bytes']
+    store.delete('1Probe')
+
+    store.max_bytes = row_size * 5
+    for i in range(12):
+        store.put(f'1Size{i}', history(f'1Size{i}', 40, seed=i))
+        assert store.stats()['bytes'] <= store.max_bytes
+    # Replacing a row updates the byte total instead of adding to it
+    store.put('1Size11', history('1Size11', 5))
+    assert totals_match(store)
+
+
+@pytest.fixture
+def legacy_json(tmp_path):
+    path = tmp_path / 'local_tx_cache.json'
+    path.write_text(json.dumps({'1LegacyA': history('1LegacyA', 4, seed=3), '1LegacyB': history('1LegacyB', 6, seed=4)}))
+    return str(path)
+
+
+def test_legacy_json_file_is_migrated_once(tmp_path, legacy_json):
+    store = TxStore(str(tmp_path / 'tx.db'), legacy_json=legacy_json)
+
+    assert len(store.get('1LegacyA')) == 4
+    assert len(store.get('1LegacyB')) == 6
+    assert totals_match(store)
+
+    # A second store on the same database does not import the file again over newer data
+    store.put('1LegacyA', history('1LegacyA', 9, seed=5))
+    again = TxStore(str(tmp_path / 'tx.db'), legacy_json=legacy_json)
+    assert len(again.get('1LegacyA')) == 9
+
+
+def test_rows_and_schema_from_before_the_columnar_format_are_upgraded(tmp_path):
+    path = str(tmp_path / 'tx.db')
+    transactions = history('1OldRow', 12, seed=6)
+    payload = zlib.compress(json.dumps(transactions).encode('utf-8'))
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE tx_cache (address TEXT PRIMARY KEY, payload BLOB NOT NULL, n_tx INTEGER NOT NULL,
+                               size INTEGER NOT NULL, fetched_at REAL NOT NULL, accessed_at REAL NOT NULL);
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+    """)
+    now = time.time()
+    conn.execute('INSERT INTO tx_cache VALUES (?, ?, ?, ?, ?, ?)', ('1OldRow', payload, 12, len(payload), now, now))
+    conn.commit()
+    conn.close()
+
+    store = TxStore(path, keep_raw=True)
+    assert store.stats() == {'entries': 1, 'bytes': len(payload)}
+    columns = store.get('1OldRow')
+
+    assert features_from_columns(columns) == features_from_columns(flatten_transactions(transactions, '1OldRow'))
+    assert store._conn().execute('SELECT format FROM tx_cache').fetchone()[0] == 'columns'
+    assert store.get_raw('1OldRow') == transactions
+    assert totals_match(store)
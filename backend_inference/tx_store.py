@@ -0,0 +1,251 @@
+# --- tx_store.py (Keyed on-disk transaction cache) ---
+
+import json
+import logging
+import os
+import sqlite3
+import time
+import zlib
+
+from feature_engine import TxColumns, dumps_columns, flatten_transactions, loads_columns
+from storage import LocalConnection
+
+logger = logging.getLogger(__name__)
+
+# Reads only refresh the LRU timestamp when it is older than this, so hot
+# addresses don't turn every cache hit into a write.
+ACCESS_RESOLUTION = 60.0
+
+# Once over a cap, eviction goes down to this fraction of it, so a full cache
+# doesn't run the eviction queries again on every following write.
+EVICT_TO = 0.9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tx_cache (
+    address     TEXT PRIMARY KEY,
+    payload     BLOB NOT NULL,
+    n_tx        INTEGER NOT NULL,
+    size        INTEGER NOT NULL,
+    fetched_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    format      TEXT NOT NULL DEFAULT 'json',
+    raw         BLOB,
+    n_tx_total  INTEGER
+);
+CREATE INDEX IF NOT EXISTS tx_cache_accessed_at ON tx_cache (accessed_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS totals (
+    id      INTEGER PRIMARY KEY CHECK (id = 0),
+    entries INTEGER NOT NULL,
+    bytes   INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS tx_cache_totals_insert AFTER INSERT ON tx_cache BEGIN
+    UPDATE totals SET entries = entries + 1, bytes = bytes + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS tx_cache_totals_update AFTER UPDATE OF size ON tx_cache BEGIN
+    UPDATE totals SET bytes = bytes + NEW.size - OLD.size;
+END;
+CREATE TRIGGER IF NOT EXISTS tx_cache_totals_delete AFTER DELETE ON tx_cache BEGIN
+    UPDATE totals SET entries = entries - 1, bytes = bytes - OLD.size;
+END;
+"""
+
+
+class TxStore:
+    """Per-address transaction cache backed by SQLite.
+
+    Each address is its own row, so a lookup only reads that address. SQLite's WAL
+    mode makes upserts atomic and safe across threads and worker processes. Entries
+    older than `ttl` seconds are treated as stale, and the least recently used
+    entries are evicted once `max_entries` or `max_bytes` is exceeded. The entry
+    count and total size are kept up to date by triggers, so a write only pays
+    for eviction when it actually crosses a cap.
+
+    Transactions are stored as the compact TxColumns the features are computed
+    from ('columns' rows); the raw blockchain.info JSON is only kept alongside
+    when `keep_raw` is set. Rows written before that ('json') are converted on
+    first read. The address's total transaction count reported upstream is kept
+    next to the columns (`TxColumns.n_tx_total`), since a rawaddr page may hold
+    only part of the history.
+    """
+
+    def __init__(self, path, ttl=0, max_entries=0, max_bytes=0, legacy_json=None, keep_raw=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.legacy_json = legacy_json
+        self.keep_raw = keep_raw
+        self._conn = LocalConnection(path, SCHEMA, self._setup)
+
+    def _setup(self, conn):
+        self._upgrade_schema(conn)
+        if self.legacy_json:
+            self._migrate_json(conn, self.legacy_json)
+
+    @staticmethod
+    def _upgrade_schema(conn):
+        # Stores created before the columnar format lack these columns; their rows are 'json'
+        existing = {row[1] for row in conn.execute('PRAGMA table_info(tx_cache)')}
+        for name, definition in (('format', "TEXT NOT NULL DEFAULT 'json'"), ('raw', 'BLOB'), ('n_tx_total', 'INTEGER')):
+            if name not in existing:
+                try:
+                    conn.execute(f'ALTER TABLE tx_cache ADD COLUMN {name} {definition}')
+                except sqlite3.OperationalError as e:
+                    # Another process added it first
+                    if 'duplicate column' not in str(e):
+                        raise
+        # Seed the running totals once; the triggers keep them current from then on
+        if conn.execute('SELECT 1 FROM totals').fetchone() is None:
+            conn.execute('INSERT OR IGNORE INTO totals (id, entries, bytes) '
+                         'SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM tx_cache')
+
+    @staticmethod
+    def _encode(transactions):
+        return zlib.compress(json.dumps(transactions, separators=(',', ':')).encode('utf-8'), 1)
+
+    @staticmethod
+    def _decode(payload):
+        return json.loads(zlib.decompress(payload))
+
+    def _encode_row(self, address, transactions):
+        """(columns, payload, raw) for a raw transaction list or an already built TxColumns."""
+        if isinstance(transactions, TxColumns):
+            return transactions, dumps_columns(transactions), None
+        columns = flatten_transactions(transactions, address)
+        raw = self._encode(transactions) if self.keep_raw else None
+        return columns, dumps_columns(columns), raw
+
+    def is_stale(self, fetched_at, now=None):
+        if not self.ttl:
+            return False
+        return (now or time.time()) - fetched_at > self.ttl
+
+    def get(self, address, allow_stale=False):
+        """Return the cached TxColumns for `address`, or None on a miss or stale entry."""
+        conn = self._conn()
+        row = conn.execute(
+            'SELECT payload, fetched_at, accessed_at, format, n_tx_total FROM tx_cache WHERE address = ?', (address,)
+        ).fetchone()
+        if row is None:
+            return None
+        payload, fetched_at, accessed_at, fmt, n_tx_total = row
+        now = time.time()
+        if not allow_stale and self.is_stale(fetched_at, now):
+            return None
+        if fmt == 'json':
+            # Convert a row from before the columnar format, keeping its age
+            return self.put(address, self._decode(payload), fetched_at=fetched_at, evict=False)
+        if now - accessed_at > ACCESS_RESOLUTION:
+            conn.execute('UPDATE tx_cache SET accessed_at = ? WHERE address = ?', (now, address))
+        columns = loads_columns(address, payload)
+        columns.n_tx_total = n_tx_total
+        return columns
+
+    def get_raw(self, address):
+        """The raw blockchain.info transactions for `address`, if they were kept."""
+        row = self._conn().execute('SELECT payload, format, raw FROM tx_cache WHERE address = ?', (address,)).fetchone()
+        if row is None:
+            return None
+        payload, fmt, raw = row
+        if fmt == 'json':
+            return self._decode(payload)
+        return self._decode(raw) if raw is not None else None
+
+    def put(self, address, transactions, fetched_at=None, evict=True, n_tx_total=None):
+        """Insert or replace the transactions for `address`, evicting if a size cap is now exceeded.
+
+        Accepts the raw transaction list or a TxColumns and returns the TxColumns stored.
+        `n_tx_total` is the address's transaction count as reported upstream (the
+        API's `n_tx`), if known.
+        """
+        columns, payload, raw = self._encode_row(address, transactions)
+        if n_tx_total is None:
+            n_tx_total = columns.n_tx_total
+        columns.n_tx_total = n_tx_total
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            'INSERT INTO tx_cache (address, payload, n_tx, size, fetched_at, accessed_at, format, raw, n_tx_total) '
+            "VALUES (?, ?, ?, ?, ?, ?, 'columns', ?, ?) "
+            'ON CONFLICT(address) DO UPDATE SET payload = excluded.payload, n_tx = excluded.n_tx, '
+            'size = excluded.size, fetched_at = excluded.fetched_at, accessed_at = excluded.accessed_at, '
+            'format = excluded.format, raw = excluded.raw, n_tx_total = excluded.n_tx_total',
+            (address, payload, len(columns), len(payload) + len(raw or b''), fetched_at or now, now, raw, n_tx_total)
+        )
+        if evict and self._over_limit(conn):
+            self.evict()
+        return columns
+
+    def delete(self, address):
+        self._conn().execute('DELETE FROM tx_cache WHERE address = ?', (address,))
+
+    def _totals(self, conn):
+        return conn.execute('SELECT entries, bytes FROM totals').fetchone() or (0, 0)
+
+    def _over_limit(self, conn):
+        if not self.max_entries and not self.max_bytes:
+            return False
+        entries, size = self._totals(conn)
+        return bool(self.max_entries and entries > self.max_entries) or bool(self.max_bytes and size > self.max_bytes)
+
+    def evict(self):
+        """Drop least recently used entries once `max_entries` / `max_bytes` is exceeded.
+
+        Goes down to EVICT_TO of the exceeded cap. Returns the number of entries removed.
+        """
+        conn = self._conn()
+        entries, size = self._totals(conn)
+        removed = 0
+        if self.max_entries and entries > self.max_entries:
+            removed += conn.execute(
+                'DELETE FROM tx_cache WHERE address IN ('
+                'SELECT address FROM tx_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (int(self.max_entries * EVICT_TO),)
+            ).rowcount
+        if self.max_bytes and size > self.max_bytes:
+            removed += conn.execute(
+                'DELETE FROM tx_cache WHERE address IN ('
+                'SELECT address FROM (SELECT address, SUM(size) OVER (ORDER BY accessed_at DESC, address) AS running '
+                'FROM tx_cache) WHERE running > ?)',
+                (int(self.max_bytes * EVICT_TO),)
+            ).rowcount
+        if removed:
+            logger.info("[TX STORE] Evicted %d cached addresses", removed)
+        return removed
+
+    def stats(self):
+        count, size = self._totals(self._conn())
+        return {'entries': count, 'bytes': size}
+
+    def _migrate_json(self, conn, legacy_path):
+        """One-time import of the old single-file JSON cache."""
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone():
+            return
+        if not os.path.exists(legacy_path):
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have finished the migration while we waited for the lock
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone():
+                conn.execute('COMMIT')
+                return
+            with open(legacy_path, 'r') as f:
+                legacy = json.load(f)
+            fetched_at = os.path.getmtime(legacy_path)
+            for address, transactions in legacy.items():
+                columns, payload, raw = self._encode_row(address, transactions)
+                conn.execute(
+                    'INSERT OR IGNORE INTO tx_cache (address, payload, n_tx, size, fetched_at, accessed_at, format, raw) '
+                    "VALUES (?, ?, ?, ?, ?, ?, 'columns', ?)",
+                    (address, payload, len(columns), len(payload) + len(raw or b''), fetched_at, fetched_at, raw)
+                )
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_json', ?)", (legacy_path,))
+            conn.execute('COMMIT')
+            logger.info("[TX STORE] Migrated %d addresses from %s", len(legacy), legacy_path)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
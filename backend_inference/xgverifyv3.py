@@ -1,286 +1,341 @@
 # --- inference.py (Complete Feature Alignment) ---
 
 import requests
-import pandas as pd
-import numpy as np
-import json
-import time
 import os
-import joblib
 import argparse
-from collections import defaultdict, Counter
+import atexit
+import logging
+import tempfile
+import threading
+import time
+
+from address_state import AddressStateStore, score_columns
+from block_index import BlockIndex
+from counterparty_graph import CounterpartyGraph
+from feature_engine import TxColumns, features_from_columns, flatten_transactions
+from feature_store import FeatureStore
+from fetcher import AsyncBlockchainFetcher, BlockchainFetcher
+from metrics import CACHE_REQUESTS, PREDICTIONS, TRANSACTIONS_PER_ADDRESS, stage_timer
+from model_registry import ModelRegistry
+from result_cache import ResultCache, transaction_fingerprint
+from scheduler import DeadlineExceeded, MicroBatcher, remaining
+from singleflight import SingleFlight
+from tx_store import TxStore
+
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
-CACHE_FILE = 'local_tx_cache.json'
-MODEL_FILE = 'enhanced_ransomware_model_v3.joblib'
-SATOSHI_TO_BTC = 100_000_000
-
-def fetch_transactions(address):
-    """Fetches transaction data for an address, using a local cache."""
-    print(f"\n[FETCHER] Looking for address: {address}")
-    cache = {}
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, 'r') as f:
-            cache = json.load(f)
-    if address in cache:
-        print("[FETCHER] Found in cache.")
-        return cache[address]
-
-    print("[FETCHER] Not in cache. Calling blockchain.info API...")
-    api_url = f"https://blockchain.info/rawaddr/{address}"
+CACHE_FILE = 'local_tx_cache.json'  # legacy single-file cache, migrated into TX_CACHE_DB
+TX_CACHE_DB = os.environ.get('TX_CACHE_DB', 'local_tx_cache.db')
+TX_CACHE_TTL = float(os.environ.get('TX_CACHE_TTL', '86400'))
+TX_CACHE_MAX_ENTRIES = int(os.environ.get('TX_CACHE_MAX_ENTRIES', '100000'))
+TX_CACHE_MAX_BYTES = int(os.environ.get('TX_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+TX_CACHE_KEEP_RAW = os.environ.get('TX_CACHE_KEEP_RAW', '0') == '1'  # also store the raw API JSON
+FEATURE_STATE_DB = os.environ.get('FEATURE_STATE_DB', 'feature_state.db')
+FEATURE_STATE_ENABLED = os.environ.get('FEATURE_STATE_ENABLED', '1') == '1'  # summaries for the streaming path
+COUNTERPARTY_GRAPH_DB = os.environ.get('COUNTERPARTY_GRAPH_DB', 'counterparty_graph.db')
+COUNTERPARTY_GRAPH_ENABLED = os.environ.get('COUNTERPARTY_GRAPH_ENABLED', '1') == '1'
+FEATURE_STORE_DIR = os.environ.get('FEATURE_STORE_DIR', 'feature_store')  # scored vectors, for bulk rescoring
+FEATURE_STORE_ENABLED = os.environ.get('FEATURE_STORE_ENABLED', '1') == '1'
+BLOCK_INDEX_DB = os.environ.get('BLOCK_INDEX_DB', '')  # index built by block_index.py; empty: API only
+BLOCK_INDEX_ONLY = os.environ.get('BLOCK_INDEX_ONLY', '0') == '1'  # never fall back to the API
+BLOCK_INDEX_CACHE_SIZE = int(os.environ.get('BLOCK_INDEX_CACHE_SIZE', '256'))  # flattened histories kept per worker
+STREAMING_INGEST = os.environ.get('STREAMING_INGEST', '0') == '1'
+STREAM_PAGE_SIZE = int(os.environ.get('STREAM_PAGE_SIZE', '50'))
+STREAM_MAX_TXS = int(os.environ.get('STREAM_MAX_TXS', '10000'))
+STREAM_TIME_BUDGET = float(os.environ.get('STREAM_TIME_BUDGET', '60'))
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'joblib')  # 'joblib' or 'onnx'
+ONNX_MODEL_FILE = os.environ.get(
+    'ONNX_MODEL_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'analysis', 'src', 'analysis_model.onnx')
+)
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '10000'))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '300'))
+RESULT_CACHE_DB = os.environ.get('RESULT_CACHE_DB', '')  # empty: in-memory tier only
+RESULT_CACHE_DB_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_DB_MAX_ENTRIES', '100000'))
+# Where DELETE /predict/cache is recorded for every worker; default: RESULT_CACHE_DB, or a temp file
+RESULT_CACHE_INVALIDATIONS_DB = os.environ.get(
+    'RESULT_CACHE_INVALIDATIONS_DB',
+    RESULT_CACHE_DB or os.path.join(tempfile.gettempdir(), 'ransomware-api-invalidations.db')
+)
+SINGLEFLIGHT_TIMEOUT = float(os.environ.get('SINGLEFLIGHT_TIMEOUT', '120'))
+SINGLEFLIGHT_LOCK_DIR = os.environ.get(
+    'SINGLEFLIGHT_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'ransomware-api-locks')
+)
+# Concurrent single-address predictions are scored together: a batch is flushed at
+# MICRO_BATCH_MAX_SIZE rows or after MICRO_BATCH_MAX_WAIT_MS (1 disables batching)
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', '32'))
+MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get('MICRO_BATCH_MAX_WAIT_MS', '5'))
+MICRO_BATCH_MAX_QUEUE = int(os.environ.get('MICRO_BATCH_MAX_QUEUE', '256'))
+MODEL_FILE = os.environ.get('MODEL_FILE', 'enhanced_ransomware_model_v3.joblib')
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', '5'))
+BLOCKCHAIN_API_URL = os.environ.get('BLOCKCHAIN_API_URL', 'https://blockchain.info')
+UPSTREAM_RATE_PER_SEC = float(os.environ.get('UPSTREAM_RATE_PER_SEC', '0.1'))
+UPSTREAM_BURST = int(os.environ.get('UPSTREAM_BURST', '1'))
+UPSTREAM_MAX_CONCURRENCY = int(os.environ.get('UPSTREAM_MAX_CONCURRENCY', '4'))
+UPSTREAM_TIMEOUT = float(os.environ.get('UPSTREAM_TIMEOUT', '45'))
+UPSTREAM_RETRIES = int(os.environ.get('UPSTREAM_RETRIES', '3'))
+UPSTREAM_MAX_QUEUE_WAIT = float(os.environ.get('UPSTREAM_MAX_QUEUE_WAIT', '60'))
+
+# Loaded once per process; see model_registry.py. With the ONNX backend the ONNX file
+# is part of the model version and hot-reloaded with the bundle.
+model_registry = ModelRegistry(
+    MODEL_FILE,
+    poll_interval=MODEL_RELOAD_INTERVAL,
+    companion_paths=[ONNX_MODEL_FILE] if INFERENCE_BACKEND == 'onnx' else (),
+)
+tx_store = TxStore(
+    TX_CACHE_DB,
+    ttl=TX_CACHE_TTL,
+    max_entries=TX_CACHE_MAX_ENTRIES,
+    max_bytes=TX_CACHE_MAX_BYTES,
+    legacy_json=CACHE_FILE,
+    keep_raw=TX_CACHE_KEEP_RAW,
+)
+address_states = AddressStateStore(FEATURE_STATE_DB)
+block_index = BlockIndex(BLOCK_INDEX_DB, cache_size=BLOCK_INDEX_CACHE_SIZE) if BLOCK_INDEX_DB else None
+counterparty_graph = CounterpartyGraph(COUNTERPARTY_GRAPH_DB) if COUNTERPARTY_GRAPH_ENABLED else None
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_SIZE,
+    ttl=RESULT_CACHE_TTL,
+    persistent_path=RESULT_CACHE_DB or None,
+    max_persistent_entries=RESULT_CACHE_DB_MAX_ENTRIES,
+    invalidation_path=RESULT_CACHE_INVALIDATIONS_DB or None,
+)
+fetcher = BlockchainFetcher(
+    base_url=BLOCKCHAIN_API_URL,
+    rate=UPSTREAM_RATE_PER_SEC,
+    burst=UPSTREAM_BURST,
+    max_concurrency=UPSTREAM_MAX_CONCURRENCY,
+    timeout=UPSTREAM_TIMEOUT,
+    retries=UPSTREAM_RETRIES,
+    max_queue_wait=UPSTREAM_MAX_QUEUE_WAIT,
+)
+async_fetcher = AsyncBlockchainFetcher(fetcher)
+# One upstream fetch / one pipeline run per address at a time, across threads and workers
+inflight = SingleFlight(lock_dir=SINGLEFLIGHT_LOCK_DIR, timeout=SINGLEFLIGHT_TIMEOUT)
+
+def fetch_transactions(address, deadline=None, run_deadline=None):
+    """Fetches transaction data for an address, using a local cache.
+
+    Returns the address's transactions as a compact TxColumns, or None. This call
+    gives up at the monotonic `deadline`; the upstream fetch, which concurrent
+    callers share, runs until `run_deadline` (see _shared). With BLOCK_INDEX_DB,
+    addresses in the local node's index are served from it without touching the
+    cache or the API.
+    """
+    logger.debug("[FETCHER] Looking for address: %s", address)
+    if block_index is not None:
+        local = _from_block_index(address)
+        if local is not None or BLOCK_INDEX_ONLY:
+            return local
+    with stage_timer('cache_lookup'):
+        cached = tx_store.get(address)
+    CACHE_REQUESTS.inc(cache='transactions', outcome='miss' if cached is None else 'hit')
+    if cached is not None:
+        logger.debug("[FETCHER] Found in cache.")
+        return cached
+
+    return _shared(f"fetch:{address}", lambda run: _fetch_uncached(address, run), deadline, run_deadline)
+
+def _from_block_index(address):
+    with stage_timer('block_index'):
+        columns = block_index.columns(address)
+    CACHE_REQUESTS.inc(cache='block_index', outcome='miss' if columns is None else 'hit')
+    return columns
+
+def _wait_timeout(deadline):
+    """How long to wait for another caller's in-flight work: SINGLEFLIGHT_TIMEOUT, capped by `deadline`."""
+    if deadline is None:
+        return None
+    return max(0.0, min(SINGLEFLIGHT_TIMEOUT, remaining(deadline)))
+
+def _shared(key, run, deadline=None, run_deadline=None):
+    """`run(run_deadline)` once for all concurrent callers of `key`.
+
+    The run is bounded by `run_deadline` (default `deadline`), the server's deadline
+    rather than a shorter "timeout" one request asked for: the other requests
+    waiting on it must not fail on that. This caller still stops waiting at
+    `deadline`; the run then goes on without it.
+    """
+    if run_deadline is None or deadline is None or run_deadline <= deadline:
+        run_deadline = deadline
+    return inflight.do(key, lambda: run(run_deadline),
+                       timeout=_wait_timeout(deadline), run_timeout=_wait_timeout(run_deadline))
+
+def _fetch_uncached(address, deadline=None):
+    # Another worker may have filled the cache while we waited for the address lock
+    cached = tx_store.get(address)
+    if cached is not None:
+        logger.debug("[FETCHER] Fetched by a concurrent request.")
+        return cached
+
+    logger.debug("[FETCHER] Not in cache. Calling blockchain.info API...")
     try:
-        response = requests.get(api_url, timeout=45)
-        response.raise_for_status()
-        data = response.json()
-        transactions = data.get('txs', [])
-        print(f"[FETCHER] SUCCESS: Found {len(transactions)} transactions.")
-        
-        cache[address] = transactions
-        with open(CACHE_FILE, 'w') as f:
-            json.dump(cache, f, indent=2)
-
-        time.sleep(10)
+        with stage_timer('upstream_fetch'):
+            data = fetcher.fetch_address(address, deadline=deadline)
+        # Only the columnar form is kept; the raw JSON is dropped here unless TX_CACHE_KEEP_RAW.
+        # n_tx is the address's full count, which may exceed this first page
+        transactions = tx_store.put(address, data.get('txs', []), n_tx_total=data.get('n_tx'))
+        logger.debug("[FETCHER] SUCCESS: Found %d transactions.", len(transactions))
         return transactions
     except requests.exceptions.RequestException as e:
-        print(f"[FETCHER] ERROR: {e}")
-        return None
+        logger.warning("[FETCHER] %s: %s", address, e)
+        stale = tx_store.get(address, allow_stale=True)
+        if stale is not None:
+            logger.warning("[FETCHER] Serving stale cached transactions for %s.", address)
+        return stale
 
-def extract_all_addresses_from_tx(tx):
-    """Extract all unique addresses involved in a transaction."""
-    addresses = set()
-    
-    # Input addresses
-    for inp in tx.get('inputs', []):
-        if inp.get('prev_out') and inp['prev_out'].get('addr'):
-            addresses.add(inp['prev_out']['addr'])
-    
-    # Output addresses
-    for out in tx.get('out', []):
-        if out.get('addr'):
-            addresses.add(out['addr'])
-    
-    return addresses
+def fetch_transactions_many(addresses, offline=False, deadline=None):
+    """Fetch several addresses, resolving cache misses concurrently. Returns {address: txs or None}.
 
-def safe_stats(values):
-    """Calculate statistics safely handling empty lists."""
-    if not values:
-        return {'min': 0.0, 'max': 0.0, 'mean': 0.0, 'median': 0.0, 'total': 0.0}
-    
-    return {
-        'min': float(min(values)),
-        'max': float(max(values)),
-        'mean': float(np.mean(values)),
-        'median': float(np.median(values)),
-        'total': float(sum(values))
-    }
+    With `offline`, only the local cache is used (stale entries included) and
+    misses come back as None without calling the API.
+    """
+    results = {}
+    misses = []
+    if block_index is not None:
+        for address in addresses:
+            local = _from_block_index(address)
+            if local is not None or BLOCK_INDEX_ONLY:
+                results[address] = local
+        addresses = [address for address in addresses if address not in results]
+    with stage_timer('cache_lookup'):
+        for address in addresses:
+            cached = tx_store.get(address, allow_stale=offline)
+            CACHE_REQUESTS.inc(cache='transactions', outcome='miss' if cached is None else 'hit')
+            if cached is not None:
+                results[address] = cached
+            else:
+                misses.append(address)
+    logger.debug("[FETCHER] Batch: %d cached, %d to fetch", len(results), len(misses))
+
+    if offline:
+        results.update(dict.fromkeys(misses))
+    elif misses:
+        # Same keys as fetch_transactions, so concurrent single and batch requests
+        # share one upstream fetch per address
+        keys = {f"fetch:{address}": address for address in misses}
+        fetched = inflight.do_many(
+            list(keys),
+            lambda run: {f"fetch:{address}": txs for address, txs in
+                         _fetch_many_uncached([keys[key] for key in run], deadline).items()},
+            timeout=_wait_timeout(deadline)
+        )
+        for key, address in keys.items():
+            outcome = fetched[key]
+            if isinstance(outcome, Exception):
+                logger.warning("[FETCHER] %s: %s", address, outcome)
+                outcome = tx_store.get(address, allow_stale=True)
+            results[address] = outcome
+    return results
+
+def _fetch_many_uncached(addresses, deadline=None):
+    # Another request may have filled the cache while we waited for the address locks
+    results = {}
+    misses = []
+    for address in addresses:
+        cached = tx_store.get(address)
+        if cached is not None:
+            results[address] = cached
+        else:
+            misses.append(address)
+    if not misses:
+        return results
+
+    with stage_timer('upstream_fetch'):
+        fetched = async_fetcher.fetch_addresses_sync(misses, deadline=deadline)
+    for address, data in fetched.items():
+        if isinstance(data, Exception):
+            logger.warning("[FETCHER] %s: %s", address, data)
+            results[address] = tx_store.get(address, allow_stale=True)
+            if results[address] is None and deadline is not None and remaining(deadline) <= 0:
+                # Lets a request with more time left, waiting on this fetch, try it again
+                results[address] = DeadlineExceeded(f"Deadline passed while fetching {address}")
+            continue
+        results[address] = tx_store.put(address, data.get('txs', []), n_tx_total=data.get('n_tx'))
+    return results
 
 def build_feature_dict(transactions, target_address):
-    """Extract comprehensive 56-feature vector from transaction data - EXACT COPY from add_new_sample_enhanced.py"""
-    print(f"[TRANSLATOR] Building comprehensive feature vector for: {target_address}")
-    if not transactions:
+    """Extract comprehensive 56-feature vector from transaction data - same output as add_new_sample_enhanced.py
+
+    `transactions` is a TxColumns from the cache, or a raw blockchain.info transaction list.
+    """
+    logger.debug("[TRANSLATOR] Building comprehensive feature vector for: %s", target_address)
+    if transactions is None or not len(transactions):
         return None
 
-    # Sort transactions by time
-    transactions.sort(key=lambda x: x.get('time', 0))
-    
-    # Initialize data collectors
-    sent_transactions = []
-    received_transactions = []
-    all_transaction_values = []
-    all_fees = []
-    block_heights = []
-    transaction_times = []
-    all_counterparty_addresses = []
-    address_interaction_counts = Counter()
-    
-    # Process each transaction
-    for tx in transactions:
-        tx_time = tx.get('time', 0)
-        tx_block = tx.get('block_height', 0)
-        tx_fee = tx.get('fee', 0)
-        
-        if tx_block > 0:
-            block_heights.append(tx_block)
-        if tx_time > 0:
-            transaction_times.append(tx_time)
-        
-        # Always include fees (even if 0) for transactions
-        all_fees.append(tx_fee)
-        
-        # Check if target address is sender
-        is_sender = False
-        sent_value = 0
-        for inp in tx.get('inputs', []):
-            if inp.get('prev_out') and inp['prev_out'].get('addr') == target_address:
-                is_sender = True
-                sent_value += inp['prev_out'].get('value', 0)
-        
-        # Check if target address is receiver
-        is_receiver = False
-        received_value = 0
-        for out in tx.get('out', []):
-            if out.get('addr') == target_address:
-                is_receiver = True
-                received_value += out.get('value', 0)
-        
-        # Record transaction details
-        if is_sender and sent_value > 0:
-            sent_transactions.append({
-                'value': sent_value,
-                'block': tx_block,
-                'time': tx_time,
-                'fee': tx_fee
-            })
-            all_transaction_values.append(sent_value)
-        
-        if is_receiver and received_value > 0:
-            received_transactions.append({
-                'value': received_value,
-                'block': tx_block,
-                'time': tx_time
-            })
-            all_transaction_values.append(received_value)
-        
-        # Track counterparty addresses for interaction analysis
-        all_tx_addresses = extract_all_addresses_from_tx(tx)
-        all_tx_addresses.discard(target_address)  # Remove target address
-        
-        for addr in all_tx_addresses:
-            all_counterparty_addresses.append(addr)
-            address_interaction_counts[addr] += 1
-
-    # Convert to BTC
-    sent_values_btc = [tx['value'] / SATOSHI_TO_BTC for tx in sent_transactions]
-    received_values_btc = [tx['value'] / SATOSHI_TO_BTC for tx in received_transactions]
-    all_values_btc = [v / SATOSHI_TO_BTC for v in all_transaction_values]
-    fees_btc = [f / SATOSHI_TO_BTC for f in all_fees]
-    
-    # Calculate block intervals
-    block_intervals = []
-    sent_block_intervals = []
-    received_block_intervals = []
-    
-    if len(block_heights) > 1:
-        sorted_blocks = sorted(block_heights)
-        for i in range(1, len(sorted_blocks)):
-            interval = sorted_blocks[i] - sorted_blocks[i-1]
-            block_intervals.append(interval)
-    
-    # Block intervals for sent transactions
-    sent_blocks = sorted([tx['block'] for tx in sent_transactions if tx['block'] > 0])
-    if len(sent_blocks) > 1:
-        for i in range(1, len(sent_blocks)):
-            sent_block_intervals.append(sent_blocks[i] - sent_blocks[i-1])
-    
-    # Block intervals for received transactions
-    received_blocks = sorted([tx['block'] for tx in received_transactions if tx['block'] > 0])
-    if len(received_blocks) > 1:
-        for i in range(1, len(received_blocks)):
-            received_block_intervals.append(received_blocks[i] - received_blocks[i-1])
-    
-    # Calculate fee shares (fee as percentage of transaction value)
-    fee_shares = []
-    for tx in sent_transactions:
-        if tx['value'] > 0 and tx['fee'] > 0:
-            fee_share = (tx['fee'] / tx['value']) * 100
-            fee_shares.append(fee_share)
+    with stage_timer('feature_extraction'):
+        columns = transactions
+        if not isinstance(columns, TxColumns):
+            columns = flatten_transactions(transactions, target_address)
+        features = features_from_columns(columns)
+    feed_graph(target_address, columns)
     
-    # Also calculate fee shares for all transactions where target was involved
-    for tx in transactions:
-        tx_fee = tx.get('fee', 0)
-        if tx_fee > 0:
-            # Find total value moved in this transaction involving target address
-            total_value = 0
-            for inp in tx.get('inputs', []):
-                if inp.get('prev_out') and inp['prev_out'].get('addr') == target_address:
-                    total_value += inp['prev_out'].get('value', 0)
-            for out in tx.get('out', []):
-                if out.get('addr') == target_address:
-                    total_value += out.get('value', 0)
-            
-            if total_value > 0:
-                fee_share = (tx_fee / total_value) * 100
-                if fee_share not in fee_shares:  # Avoid duplicates
-                    fee_shares.append(fee_share)
-    
-    # Address interaction analysis
-    unique_addresses = len(set(all_counterparty_addresses))
-    addresses_multiple_interactions = len([addr for addr, count in address_interaction_counts.items() if count > 1])
-    
-    # Address interaction values (how much transacted with each address)
-    address_values = list(address_interaction_counts.values())
-    
-    # Calculate timestep-related features (approximation using block groupings)
-    unique_blocks = len(set(block_heights)) if block_heights else 0
-    
-    # Build comprehensive features dictionary
-    features = {
-        # Basic transaction counts
-        'num_txs_as_sender': float(len(sent_transactions)),
-        'num_txs_as receiver': float(len(received_transactions)),
-        'total_txs': float(len(transactions)),
-        
-        # Block and time features
-        'first_block_appeared_in': float(min(block_heights)) if block_heights else 0.0,
-        'last_block_appeared_in': float(max(block_heights)) if block_heights else 0.0,
-        'lifetime_in_blocks': float(max(block_heights) - min(block_heights)) if len(block_heights) > 1 else 0.0,
-        'first_sent_block': float(min(sent_blocks)) if sent_blocks else 0.0,
-        'first_received_block': float(min(received_blocks)) if received_blocks else 0.0,
-        'num_timesteps_appeared_in': float(unique_blocks),
-        
-        # BTC transaction value features
-        **{f'btc_transacted_{k}': v for k, v in safe_stats(all_values_btc).items()},
-        **{f'btc_sent_{k}': v for k, v in safe_stats(sent_values_btc).items()},
-        **{f'btc_received_{k}': v for k, v in safe_stats(received_values_btc).items()},
-        
-        # Fee features
-        **{f'fees_{k}': v for k, v in safe_stats(fees_btc).items()},
-        
-        # Fee share features
-        **{f'fees_as_share_{k}': v for k, v in safe_stats(fee_shares).items()},
-        
-        # Block interval features
-        **{f'blocks_btwn_txs_{k}': v for k, v in safe_stats(block_intervals).items()},
-        **{f'blocks_btwn_input_txs_{k}': v for k, v in safe_stats(sent_block_intervals).items()},
-        **{f'blocks_btwn_output_txs_{k}': v for k, v in safe_stats(received_block_intervals).items()},
-        
-        # Address interaction features
-        'num_addr_transacted_multiple': float(addresses_multiple_interactions),
-        **{f'transacted_w_address_{k}': v for k, v in safe_stats(address_values).items()},
-        
-        # Time step (approximation - this might need refinement based on original dataset)
-        'Time step': float(unique_blocks),  # Using unique blocks as proxy for timesteps
-    }
-    
-    # Ensure all expected features are present
-    expected_features = [
-        'Time step', 'num_txs_as_sender', 'num_txs_as receiver', 'first_block_appeared_in', 
-        'last_block_appeared_in', 'lifetime_in_blocks', 'total_txs', 'first_sent_block', 
-        'first_received_block', 'num_timesteps_appeared_in', 'btc_transacted_total', 
-        'btc_transacted_min', 'btc_transacted_max', 'btc_transacted_mean', 'btc_transacted_median',
-        'btc_sent_total', 'btc_sent_min', 'btc_sent_max', 'btc_sent_mean', 'btc_sent_median',
-        'btc_received_total', 'btc_received_min', 'btc_received_max', 'btc_received_mean', 
-        'btc_received_median', 'fees_total', 'fees_min', 'fees_max', 'fees_mean', 'fees_median',
-        'fees_as_share_total', 'fees_as_share_min', 'fees_as_share_max', 'fees_as_share_mean', 
-        'fees_as_share_median', 'blocks_btwn_txs_total', 'blocks_btwn_txs_min', 'blocks_btwn_txs_max',
-        'blocks_btwn_txs_mean', 'blocks_btwn_txs_median', 'blocks_btwn_input_txs_total', 
-        'blocks_btwn_input_txs_min', 'blocks_btwn_input_txs_max', 'blocks_btwn_input_txs_mean',
-        'blocks_btwn_input_txs_median', 'blocks_btwn_output_txs_total', 'blocks_btwn_output_txs_min',
-        'blocks_btwn_output_txs_max', 'blocks_btwn_output_txs_mean', 'blocks_btwn_output_txs_median',
-        'num_addr_transacted_multiple', 'transacted_w_address_total', 'transacted_w_address_min',
-        'transacted_w_address_max', 'transacted_w_address_mean', 'transacted_w_address_median'
-    ]
-    
-    # Fill any missing features with 0.0
-    for feature in expected_features:
-        if feature not in features:
-            features[feature] = 0.0
-    
-    print(f"[TRANSLATOR] SUCCESS: Extracted {len(features)} features")
-    print(f"[TRANSLATOR] Non-zero features: {sum(1 for v in features.values() if v != 0.0)}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[TRANSLATOR] Extracted %d features, %d non-zero",
+                     len(features), sum(1 for v in features.values() if v != 0.0))
     
     return features
 
+def feed_graph(address, columns):
+    """Queue the address's counterparties for the shared graph; they are written off the request path."""
+    if counterparty_graph is not None:
+        counterparty_graph.enqueue_update(address, columns)
+
+def record_graph_scores(addresses, probabilities):
+    """Queue the latest probabilities for the graph, for multi-hop exposure."""
+    if counterparty_graph is not None and addresses:
+        counterparty_graph.enqueue_scores(addresses, probabilities)
+
+def flush_background_writes(timeout=None):
+    """Write what the request path queued for the stores; call before the process exits."""
+    if counterparty_graph is not None:
+        counterparty_graph.flush(timeout)
+    if _feature_store is not None:
+        _feature_store.flush(timeout)
+
+atexit.register(flush_background_writes)
+
+def stream_feature_dict(address, max_txs=None, time_budget=None):
+    """Build base features from the paginated history without holding the raw transactions.
+
+    Returns (features, history); `history.fetched` / `history.n_tx` tell how much of
+    the address's history was read.
+    """
+    logger.debug("[TRANSLATOR] Streaming transaction history for: %s", address)
+    time_budget = time_budget if time_budget is not None else STREAM_TIME_BUDGET
+    started = time.monotonic()
+
+    def read_history():
+        return fetcher.iter_address(
+            address,
+            page_size=STREAM_PAGE_SIZE,
+            max_txs=max_txs if max_txs is not None else STREAM_MAX_TXS,
+            time_budget=max(0.0, time_budget - (time.monotonic() - started)) if time_budget else time_budget,
+        )
+
+    history = read_history()
+    # Pages are fetched lazily while the stream is consumed, so this also covers the upstream calls
+    with stage_timer('feature_extraction'):
+        if FEATURE_STATE_ENABLED:
+            scored = address_states.update_from_stream(address, history)
+            if scored is None:
+                # The stored summary doesn't add up to the reported history (a reorg,
+                # or it was cut short): read it all again and replace the summary
+                address_states.delete(address)
+                history = read_history()
+                scored = address_states.update_from_stream(address, history)
+        else:
+            scored = score_columns(flatten_transactions(history, address))
+
+    logger.debug("[TRANSLATOR] Read %d of %s transactions in %d pages", history.fetched, history.n_tx, history.pages)
+    if scored is None or scored.features is None:
+        return None, history
+    if counterparty_graph is not None:
+        counterparty_graph.enqueue_edges(address, scored.fingerprint, scored.load_edges)
+    return scored.features, history
+
 def create_enhanced_pattern_features(df):
     """Create enhanced pattern features for ransomware detection - EXACT COPY from training script"""
     
@@ -342,104 +397,315 @@ def create_enhanced_pattern_features(df):
     
     return df
 
-def predict_ransomware(address):
-    """Complete inference pipeline for ransomware detection."""
-    print("====== RANSOMWARE DETECTION INFERENCE PIPELINE ======")
-    print(f"Target Address: {address}")
-    
-    # Check if model exists
-    if not os.path.exists(MODEL_FILE):
-        print(f"[ERROR] Model file not found: {MODEL_FILE}")
-        print("[ERROR] Please ensure the trained model is in the same directory.")
-        return None
-    
-    # Load model and components
-    print(f"[INFERENCE] Loading trained model from {MODEL_FILE}...")
-    model_data = joblib.load(MODEL_FILE)
-    model = model_data['model']
-    scaler = model_data['scaler']
-    feature_names = model_data['feature_names']
-    threshold = model_data['threshold']
-    
-    print(f"[INFERENCE] Model loaded successfully!")
-    print(f"[INFERENCE] Expected features: {len(feature_names)}")
-    print(f"[INFERENCE] Detection threshold: {threshold:.3f}")
-    
-    # Step 1: Fetch transaction data
-    transactions = fetch_transactions(address)
-    if transactions is None:
-        print("[ERROR] Failed to fetch transaction data.")
-        return None
-    
-
-    # Step 2: Extract base features (56 features - exact same as training)
-    feature_dict = build_feature_dict(transactions, address)
-    if feature_dict is None:
-        print("[ERROR] Failed to extract features.")
-        return None
-    
-    # Step 3: Convert to DataFrame for enhanced feature creation
-    df_sample = pd.DataFrame([feature_dict])
-    
-    # Step 4: Create the 10 enhanced pattern features (EXACT same as training)
-    print("[INFERENCE] Creating enhanced pattern features...")
-
-    df_sample = create_enhanced_pattern_features(df_sample)
-    
-    # Step 5: Ensure feature alignment with training
+def align_features(df, feature_names):
+    """Return the feature matrix with exactly the training columns, in training order."""
     # Remove non-feature columns that might be present
     exclude_cols = ['address', 'class']
-    available_features = [col for col in df_sample.columns if col not in exclude_cols]
-    
-    print(f"[INFERENCE] Available features after enhancement: {len(available_features)}")
-    print(f"[INFERENCE] Expected features from training: {len(feature_names)}")
-    
+    available_features = [col for col in df.columns if col not in exclude_cols]
+
     # Align features exactly with training
     missing_features = set(feature_names) - set(available_features)
     extra_features = set(available_features) - set(feature_names)
-    
+
     if missing_features:
-        print(f"[WARNING] Missing features: {missing_features}")
+        logger.warning("[INFERENCE] Missing features: %s", missing_features)
         # Add missing features with default value 0
         for feature in missing_features:
-            df_sample[feature] = 0.0
-    
+            df[feature] = 0.0
+
     if extra_features:
-        print(f"[WARNING] Extra features (will be ignored): {extra_features}")
-    
+        logger.debug("[INFERENCE] Extra features (will be ignored): %s", extra_features)
+
     # Select only the features used in training, in the same order
-    X_inference = df_sample[feature_names]
+    return df[feature_names]
 
-    print(f"HELLO {feature_names}")
-    
-    
-    print(f"[INFERENCE] Final feature vector shape: {X_inference.shape}")
-    print(f"[INFERENCE] Feature alignment: {'✅ PERFECT' if X_inference.shape[1] == len(feature_names) else '❌ MISMATCH'}")
-    
-    # Step 6: Scale features using the same scaler from training
-    print("[INFERENCE] Scaling features...")
-    X_scaled = scaler.transform(X_inference)
-    print(f"HELLO {X_scaled}")
-    
-    
-    # Step 7: Make prediction
-    print("[INFERENCE] Making prediction...")
-    prediction_proba = model.predict_proba(X_scaled)[0, 1]  # Probability of being illicit
+_onnx_scorer = None
+_onnx_scorer_lock = threading.Lock()
+
+def get_onnx_scorer(snapshot):
+    """ONNX session for the current model version, created once and rebuilt on reload."""
+    global _onnx_scorer
+    scorer = _onnx_scorer
+    if scorer is not None and scorer.version == snapshot.version:
+        return scorer
+    with _onnx_scorer_lock:
+        if _onnx_scorer is None or _onnx_scorer.version != snapshot.version:
+            from onnx_backend import OnnxScorer
+            logger.info("[INFERENCE] Creating ONNX session from %s", ONNX_MODEL_FILE)
+            _onnx_scorer = OnnxScorer(ONNX_MODEL_FILE, snapshot.scaler, snapshot.feature_names, snapshot.version)
+        return _onnx_scorer
+
+def score_feature_dicts(feature_dicts, snapshot, backend=None):
+    """Run enhancement, scaling and the model once over a batch of base feature dicts.
+
+    Returns the probability of being illicit for each row, in input order. The
+    'onnx' backend does the same on NumPy buffers with onnxruntime, without pandas.
+    """
+    if (backend or INFERENCE_BACKEND) == 'onnx':
+        scorer = get_onnx_scorer(snapshot)
+        # vectorize() derives the enhanced features and scales in one pass
+        with stage_timer('enhancement'):
+            x = scorer.vectorize(feature_dicts)
+        with stage_timer('inference'):
+            return scorer.run(x)
+
+    # pandas is only needed here: importing it lazily keeps it out of the API's import time
+    import pandas as pd
+
+    with stage_timer('enhancement'):
+        df = pd.DataFrame(feature_dicts)
+        df = create_enhanced_pattern_features(df)
+        X_inference = align_features(df, snapshot.feature_names)
+    logger.debug("[INFERENCE] Final feature matrix shape: %s", X_inference.shape)
+
+    with stage_timer('scaling'):
+        X_scaled = snapshot.scaler.transform(X_inference)
+    with stage_timer('inference'):
+        return snapshot.model.predict_proba(X_scaled)[:, 1]
+
+def _score_micro_batch(items):
+    """MicroBatcher callback: `items` are (feature_dict, snapshot); one model pass per model version."""
+    probabilities = [None] * len(items)
+    groups = {}
+    for i, (_, snapshot) in enumerate(items):
+        groups.setdefault(snapshot.version, (snapshot, []))[1].append(i)
+    for snapshot, indexes in groups.values():
+        scored = score_feature_dicts([items[i][0] for i in indexes], snapshot)
+        for i, probability in zip(indexes, scored):
+            probabilities[i] = probability
+    return probabilities
+
+scoring_batcher = MicroBatcher(
+    _score_micro_batch,
+    max_batch_size=MICRO_BATCH_MAX_SIZE,
+    max_wait=MICRO_BATCH_MAX_WAIT_MS / 1000,
+    max_queue=MICRO_BATCH_MAX_QUEUE,
+    name='scoring-batcher',
+)
+
+_feature_store = None
+_feature_store_lock = threading.Lock()
+
+def get_feature_store(snapshot):
+    """Process-wide FeatureStore; its column order is the model's feature order when first created."""
+    global _feature_store
+    if _feature_store is None:
+        with _feature_store_lock:
+            if _feature_store is None:
+                _feature_store = FeatureStore(FEATURE_STORE_DIR, snapshot.feature_names)
+    return _feature_store
+
+def store_features(addresses, feature_dicts, fingerprints, snapshot):
+    """Queue the scored vectors so a later model version can rescore them without refetching."""
+    if not FEATURE_STORE_ENABLED or not addresses:
+        return
+    try:
+        store = get_feature_store(snapshot)
+    except (OSError, ValueError) as e:
+        logger.warning("[INFERENCE] Could not open the feature store: %s", e)
+        return
+    store.enqueue_many(addresses, feature_dicts, fingerprints)
+
+def build_result(address, prediction_proba, snapshot, transactions_analyzed, transactions_total=None):
+    """Format a single prediction for the API / CLI."""
+    threshold = snapshot.threshold
     prediction_binary = int(prediction_proba >= threshold)
-    
-    # Step 8: Return results
-    result = {
+    return {
         'address': address,
         'ransomware_probability': float(prediction_proba),
         'is_ransomware': bool(prediction_binary),
         'confidence_level': 'HIGH' if abs(prediction_proba - 0.5) > 0.3 else 'MEDIUM' if abs(prediction_proba - 0.5) > 0.1 else 'LOW',
         'threshold_used': float(threshold),
-        'feature_count': len(feature_names),
-        'transactions_analyzed': len(transactions)
+        'feature_count': len(snapshot.feature_names),
+        'transactions_analyzed': transactions_analyzed,
+        'transactions_total': transactions_total if transactions_total is not None else transactions_analyzed,
+        'history_truncated': transactions_total is not None and transactions_total > transactions_analyzed,
+        'model_version': snapshot.version
     }
+
+def get_model_snapshot():
+    """Use the process-wide model; load it on first use (e.g. from the CLI)."""
+    snapshot = model_registry.get() or model_registry.load()
+    if snapshot is None:
+        logger.error("[INFERENCE] Model file not found or unreadable: %s", MODEL_FILE)
+    return snapshot
+
+def warmup():
+    """Load the model and score one empty address so the first request pays no import or init cost.
+
+    Touches no cache, store or network. Returns the elapsed seconds, or None if no
+    model could be loaded.
+    """
+    start = time.perf_counter()
+    snapshot = get_model_snapshot()
+    if snapshot is None:
+        return None
+    score_feature_dicts([features_from_columns(flatten_transactions([], 'warmup'))], snapshot)
+    elapsed = time.perf_counter() - start
+    logger.info("[INFERENCE] Warm-up (%s backend, model %s) took %.3fs", INFERENCE_BACKEND, snapshot.version, elapsed)
+    return elapsed
+
+def result_cache_version(snapshot):
+    """Model identity for result caching; the two backends can differ in the last digits."""
+    return f"{snapshot.version}/{INFERENCE_BACKEND}"
+
+def predict_ransomware(address, streaming=None, deadline=None, run_deadline=None):
+    """Complete inference pipeline for ransomware detection.
+
+    With `streaming` (default: STREAMING_INGEST) the full paginated history is read
+    from the API instead of the single cached rawaddr page. Concurrent calls for the
+    same address share one run; waiters raise SingleFlightTimeout after
+    SINGLEFLIGHT_TIMEOUT seconds or at the monotonic `deadline`. Upstream fetches and
+    the wait for a scoring batch end at `run_deadline` (default `deadline`;
+    scheduler.DeadlineExceeded while queued), which may be later when this request
+    asked for less time than the server allows.
+    """
+    streaming = streaming if streaming is not None else STREAMING_INGEST
+    return _shared(
+        f"predict:{address}:{'stream' if streaming else 'cache'}",
+        lambda run: _predict_ransomware(address, streaming, run),
+        deadline, run_deadline
+    )
+
+def _predict_ransomware(address, streaming, deadline=None):
+    logger.debug("[INFERENCE] Target address: %s", address)
     
+    snapshot = get_model_snapshot()
+    if snapshot is None:
+        PREDICTIONS.inc(outcome='error')
+        return None
+
+    logger.debug("[INFERENCE] Model version %s, %d features, threshold %.3f",
+                 snapshot.version, len(snapshot.feature_names), snapshot.threshold)
+    
+    # The block index already holds the full history; streaming only applies to the API
+    if streaming and block_index is not None and (BLOCK_INDEX_ONLY or block_index.has_address(address)):
+        streaming = False
+
+    if streaming:
+        try:
+            time_budget = STREAM_TIME_BUDGET if deadline is None else min(STREAM_TIME_BUDGET, remaining(deadline))
+            feature_dict, history = stream_feature_dict(address, time_budget=max(0.0, time_budget))
+        except requests.exceptions.RequestException as e:
+            logger.warning("[INFERENCE] Failed to fetch transaction data for %s: %s", address, e)
+            PREDICTIONS.inc(outcome='error')
+            return None
+        if feature_dict is None:
+            logger.warning("[INFERENCE] No transactions to extract features from for %s", address)
+            PREDICTIONS.inc(outcome='error')
+            return None
+
+        TRANSACTIONS_PER_ADDRESS.observe(feature_dict['total_txs'])
+        prediction_proba = scoring_batcher.submit((feature_dict, snapshot), deadline)
+        store_features([address], [feature_dict], None, snapshot)
+        record_graph_scores([address], [prediction_proba])
+        result = build_result(address, prediction_proba, snapshot, int(feature_dict['total_txs']), history.n_tx)
+        result['history_truncated'] = history.truncated
+        result['cache_hit'] = False
+        PREDICTIONS.inc(outcome='scored')
+        return result
+
+    # Step 1: Fetch transaction data
+    transactions = fetch_transactions(address, deadline)
+    if transactions is None:
+        logger.warning("[INFERENCE] Failed to fetch transaction data for %s", address)
+        PREDICTIONS.inc(outcome='error')
+        return None
+
+    # Same address, same transactions, same model: reuse the previous result
+    fingerprint = transaction_fingerprint(transactions)
+    cached = result_cache.get(address, fingerprint, result_cache_version(snapshot))
+    CACHE_REQUESTS.inc(cache='results', outcome='miss' if cached is None else 'hit')
+    if cached is not None:
+        logger.debug("[INFERENCE] Result cache hit for %s", address)
+        cached['cache_hit'] = True
+        PREDICTIONS.inc(outcome='cached')
+        return cached
+    
+    # Step 2: Extract base features (56 features - exact same as training)
+    feature_dict = build_feature_dict(transactions, address)
+    if feature_dict is None:
+        logger.warning("[INFERENCE] No transactions to extract features from for %s", address)
+        PREDICTIONS.inc(outcome='error')
+        return None
+    
+    # Step 3: Enhanced pattern features, alignment, scaling and prediction, batched
+    # with whatever other requests are being scored right now
+    TRANSACTIONS_PER_ADDRESS.observe(len(transactions))
+    prediction_proba = scoring_batcher.submit((feature_dict, snapshot), deadline)
+    store_features([address], [feature_dict], [fingerprint], snapshot)
+    record_graph_scores([address], [prediction_proba])
+    
+    # Step 4: Return results
+    result = build_result(address, prediction_proba, snapshot, len(transactions), transactions.n_tx_total)
+    result_cache.put(address, fingerprint, result_cache_version(snapshot), result)
+    result['cache_hit'] = False
+    PREDICTIONS.inc(outcome='scored')
     return result
 
+def predict_ransomware_batch(addresses, offline=False, deadline=None):
+    """Score many addresses with a single enhancement / scaling / model pass.
+
+    Returns one entry per input address, in input order. Addresses that could not
+    be scored get `{'address': ..., 'error': ...}` instead of a prediction. With
+    `offline`, transactions come only from the local cache. Fetches still running
+    at the monotonic `deadline` are abandoned.
+    """
+    logger.debug("[INFERENCE] Batch of %d addresses", len(addresses))
+    snapshot = get_model_snapshot()
+    if snapshot is None:
+        return None
+
+    # Work on each distinct address once, then fan results back out in input order
+    unique_addresses = list(dict.fromkeys(addresses))
+    outcomes = {}
+    scored_addresses = []
+    feature_dicts = []
+    tx_counts = []
+    fingerprints = []
+    cache_version = result_cache_version(snapshot)
+
+    fetched = fetch_transactions_many(unique_addresses, offline=offline, deadline=deadline)
+    for address in unique_addresses:
+        transactions = fetched.get(address)
+        if transactions is None:
+            error = 'Not in the local transaction cache' if offline or BLOCK_INDEX_ONLY else 'Failed to fetch transaction data'
+            outcomes[address] = {'address': address, 'error': error}
+            PREDICTIONS.inc(outcome='error')
+            continue
+        fingerprint = transaction_fingerprint(transactions)
+        cached = result_cache.get(address, fingerprint, cache_version)
+        CACHE_REQUESTS.inc(cache='results', outcome='miss' if cached is None else 'hit')
+        if cached is not None:
+            cached['cache_hit'] = True
+            outcomes[address] = cached
+            PREDICTIONS.inc(outcome='cached')
+            continue
+        feature_dict = build_feature_dict(transactions, address)
+        if feature_dict is None:
+            outcomes[address] = {'address': address, 'error': 'No transactions found for address'}
+            PREDICTIONS.inc(outcome='error')
+            continue
+        TRANSACTIONS_PER_ADDRESS.observe(len(transactions))
+        scored_addresses.append(address)
+        feature_dicts.append(feature_dict)
+        tx_counts.append((len(transactions), transactions.n_tx_total))
+        fingerprints.append(fingerprint)
+
+    if feature_dicts:
+        probabilities = score_feature_dicts(feature_dicts, snapshot)
+        store_features(scored_addresses, feature_dicts, fingerprints, snapshot)
+        record_graph_scores(scored_addresses, probabilities)
+        for address, proba, (n_tx, n_tx_total), fingerprint in zip(scored_addresses, probabilities, tx_counts, fingerprints):
+            result = build_result(address, proba, snapshot, n_tx, n_tx_total)
+            result_cache.put(address, fingerprint, cache_version, result)
+            result['cache_hit'] = False
+            outcomes[address] = result
+        PREDICTIONS.inc(len(feature_dicts), outcome='scored')
+
+    logger.debug("[INFERENCE] Batch scored %d/%d addresses", len(feature_dicts), len(unique_addresses))
+    return [outcomes[address] for address in addresses]
+
 def main(address):
     """Main inference function."""
     result = predict_ransomware(address)
@@ -458,6 +724,7 @@ def main(address):
     print(f"Detection Threshold: {result['threshold_used']:.3f}")
     print(f"Transactions Analyzed: {result['transactions_analyzed']}")
     print(f"Features Used: {result['feature_count']}")
+    print(f"Model Version: {result['model_version']}")
     
     if result['is_ransomware']:
         print("\n⚠️  WARNING: This address shows patterns consistent with ransomware activity!")
@@ -473,8 +740,16 @@ def main(address):
     print("="*60)
 
 if __name__ == '__main__':
+    import bulk_score
+
     parser = argparse.ArgumentParser(description="Bitcoin ransomware detection inference.")
-    parser.add_argument("address", type=str, help="The Bitcoin address to analyze.")
+    parser.add_argument("address", type=str, nargs='?', help="The Bitcoin address to analyze.")
+    bulk_score.add_arguments(parser)
     args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING').upper(), format='%(message)s')
     
+    if args.input:
+        raise SystemExit(bulk_score.run(args))
+    if not args.address:
+        parser.error("an address or --input is required")
     main(args.address)
\ No newline at end of file